@@ -0,0 +1,249 @@
+import argparse
+import collections
+import io
+import threading
+import time
+
+from frame_encoder import scaled_size
+
+# -----------------------------------------
+# Frame sources
+# -----------------------------------------
+
+class V4L2FrameSource:
+    """
+    USB webcam kept open through OpenCV's V4L2 backend.
+    read() returns a BGR numpy array, encode() turns one into JPEG bytes.
+    """
+
+    def __init__(self, device="/dev/video0", width=1280, height=720, fps=30):
+        self.device = device
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.cap = None
+
+    def open(self):
+        import cv2
+        self.cap = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open camera {self.device}")
+        # MJPG keeps 1280x720 at full frame rate over USB 2.0
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        # Don't let the driver queue up old frames behind our back
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def read(self):
+        ok, frame = self.cap.read()
+        if not ok:
+            raise IOError(f"Camera {self.device} returned no frame")
+        return frame
+
+    def size(self, frame):
+        return frame.shape[1], frame.shape[0]
+
+    def encode(self, frame, size, quality):
+        import cv2
+        if size != self.size(frame):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        if not ok:
+            raise IOError("JPEG encode failed")
+        return buf.tobytes()
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class SyntheticFrameSource:
+    """
+    Moving test pattern at a fixed frame rate, for running the capture service
+    (and everything downstream of it) without a camera.
+    """
+
+    def __init__(self, width=1280, height=720, fps=15):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.count = 0
+        self._next_at = None
+
+    def open(self):
+        self.count = 0
+        self._next_at = time.monotonic()
+
+    def read(self):
+        from PIL import Image, ImageDraw
+        # Pace like a real camera
+        self._next_at += 1.0 / self.fps
+        delay = self._next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        self.count += 1
+        shade = (self.count * 4) % 256
+        image = Image.new("RGB", (self.width, self.height), (shade, 64, 255 - shade))
+        draw = ImageDraw.Draw(image)
+        x = (self.count * 16) % self.width
+        draw.rectangle([x, self.height // 3, x + self.width // 8, 2 * self.height // 3], fill=(255, 255, 255))
+        draw.text((10, 10), f"synthetic frame {self.count}", fill=(0, 0, 0))
+        return image
+
+    def size(self, frame):
+        return frame.size
+
+    def encode(self, frame, size, quality):
+        if size != frame.size:
+            frame = frame.resize(size)
+        out = io.BytesIO()
+        frame.save(out, format="JPEG", quality=quality)
+        return out.getvalue()
+
+    def close(self):
+        pass
+
+
+# -----------------------------------------
+# Capture service
+# -----------------------------------------
+
+class CapturedFrame:
+    def __init__(self, seq, timestamp, raw, size):
+        self.seq = seq
+        self.timestamp = timestamp  # time.time() when the frame was read
+        self.raw = raw
+        self.size = size
+        self.encoded = {}  # (width, height, quality) -> JPEG bytes
+
+
+class CaptureService:
+    """
+    Keeps the camera open and continuously reads frames into a small ring buffer.
+    Publishers take the newest frame with latest_jpeg(); it is encoded on demand,
+    once per requested size/quality, so frames nobody asks for cost no encoding.
+    """
+
+    def __init__(self, source, ring_size=4, warmup_frames=20, retry_delay=1.0):
+        self.source = source
+        self.warmup_frames = warmup_frames
+        self.retry_delay = retry_delay
+        self._ring = collections.deque(maxlen=ring_size)
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        self.stats = {"frames": 0, "encodes": 0, "errors": 0}
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _capture_loop(self):
+        while self._running:
+            try:
+                self.source.open()
+                # The first frames after opening are dark/unsettled (what fswebcam -S 20 skipped
+                # on every capture). Now they are skipped once per open instead.
+                for _ in range(self.warmup_frames):
+                    self.source.read()
+                while self._running:
+                    raw = self.source.read()
+                    self._push(raw)
+            except Exception as e:
+                print(f"[Camera] Capture error: {e}. Reopening in {self.retry_delay}s")
+                self.stats["errors"] += 1
+                time.sleep(self.retry_delay)
+            finally:
+                self.source.close()
+
+    def _push(self, raw):
+        with self._cond:
+            self._seq += 1
+            self._ring.append(CapturedFrame(self._seq, time.time(), raw, self.source.size(raw)))
+            self.stats["frames"] += 1
+            self._cond.notify_all()
+
+    def latest(self, after=None, timeout=5.0):
+        """
+        Newest frame in the ring. With after (a time.time() value) wait for a frame read
+        after that moment, e.g. to skip frames blurred by a movement that just ended.
+        Returns None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._ring or (after is not None and self._ring[-1].timestamp <= after):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._ring[-1]
+
+    def latest_jpeg(self, max_res=None, quality=85, after=None, timeout=5.0):
+        """
+        Newest frame as JPEG, downscaled so its longer side is at most max_res.
+        Returns (jpeg bytes, width, height, capture timestamp), or None on timeout.
+        """
+        frame = self.latest(after=after, timeout=timeout)
+        if frame is None:
+            return None
+        width, height = frame.size
+        if max_res is not None:
+            width, height = scaled_size(width, height, max_res)
+        key = (width, height, quality)
+        jpeg = frame.encoded.get(key)
+        if jpeg is None:
+            jpeg = self.source.encode(frame.raw, (width, height), quality)
+            frame.encoded[key] = jpeg
+            self.stats["encodes"] += 1
+        return jpeg, width, height, frame.timestamp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the capture service and report frame rate and hand-off latency.")
+    parser.add_argument("--synthetic", action="store_true", help="use the synthetic test pattern instead of a camera")
+    parser.add_argument("--device", default="/dev/video0")
+    parser.add_argument("--max-res", type=int, default=360)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    source = SyntheticFrameSource() if args.synthetic else V4L2FrameSource(args.device)
+    service = CaptureService(source, warmup_frames=0 if args.synthetic else 20)
+    service.start()
+    service.latest(timeout=10.0)
+
+    start = time.time()
+    first_seq = service.latest().seq
+    handoffs = []
+    result = None
+    while time.time() - start < args.seconds:
+        t0 = time.perf_counter()
+        # Ask for a frame read after the request, like the ROV does after each movement
+        result = service.latest_jpeg(max_res=args.max_res, after=time.time())
+        if result is None:
+            print("No frame within timeout")
+            break
+        handoffs.append(time.perf_counter() - t0)
+    frames = service.latest().seq - first_seq
+    service.stop()
+
+    print(f"Capture rate: {frames / args.seconds:.1f} fps")
+    if handoffs:
+        print(f"Fresh frame hand-off: avg {1000 * sum(handoffs) / len(handoffs):.1f} ms, "
+              f"max {1000 * max(handoffs):.1f} ms over {len(handoffs)} requests "
+              f"({len(result[0])} byte JPEG at {result[1]}x{result[2]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 import gpiozero
 import base64
 import time
-import os
-import subprocess
+import queue
 import threading
 import paho.mqtt.client as mqtt
-import subprocess
-import threading
+
+from camera_capture import CaptureService, SyntheticFrameSource, V4L2FrameSource
+from lidar_ring import RingReader
+from lidar_sectors import SectorAnalyzer
 
 
 # MQTT Config
@@ -23,6 +24,15 @@ SUB_TOPICS = [
     "team24/fog/navdir"
 ]
 
+# Camera Config
+CAMERA_DEVICE = "/dev/video0"
+USE_SYNTHETIC_CAMERA = False  # Test pattern instead of the webcam
+
+# Motion Config
+NAVDIR_SETTLE_S = 2.0    # Wait this long before acting on a navdir, a YES result arriving meanwhile cancels the move
+GUARD_INTERVAL_S = 0.05  # How often a forward move re-checks the front distance
+SAFE_DISTANCE_M = 0.2
+
 # Motor Setup
 in1 = gpiozero.OutputDevice(16)
 in2 = gpiozero.OutputDevice(26)
@@ -46,17 +56,18 @@ last_ai_status = 0
 last_result = 0
 nav_timeout_timer = None
 
+# Full scans from the LiDAR reader node, shared through memory (lidar_ring.py)
+lidar = RingReader()
+sectors = SectorAnalyzer()
+
 # Add this first
 def get_90_degree_distance():
-    try:
-        with open(os.path.expanduser("~/scan_90deg.txt"), "r") as f:
-            value = float(f.read().strip())
-            return value
-    except Exception:
-        return None
+    # Nearest return in the 30° arc around 90°, not just the single 90° ray (lidar_sectors.py)
+    scan = lidar.latest()
+    return sectors.analyze_scan(scan)["front"].min if scan is not None else None
 
 # Then this below it
-def wait_for_safe_90_distance(threshold=0.2):
+def wait_for_safe_90_distance(threshold=SAFE_DISTANCE_M):
     while True:
         distance = get_90_degree_distance()
         if distance is not None:
@@ -65,12 +76,103 @@ def wait_for_safe_90_distance(threshold=0.2):
                 print("🛑 Emergency stop! Object too close (< 0.3m). Aborting movement.")
                 return False
             return True
-        time.sleep(0.1)
+        if motion.preempted():
+            return False
+        lidar.wait_for_scan(timeout=0.1)
+
+def obstacle_ahead():
+    distance = get_90_degree_distance()
+    if distance is not None and distance < SAFE_DISTANCE_M:
+        print(f"🛑 Emergency stop! Object too close ({distance:.2f} m) while moving.")
+        return True
+    return False
+
+
+# -----------------------------------------
+# Motion Executor
+# -----------------------------------------
+
+class MotionExecutor:
+    """
+    Runs motor commands on their own thread, so the MQTT callbacks only enqueue and the
+    network thread keeps answering keepalives and delivering messages while the ROV moves.
+
+    submit() queues a command and preempts the one running: a move in hold() returns
+    at once. A move that is already superseded by a newer command when its turn comes
+    is skipped; commands submitted with skippable=False (stops, asking for a goal) always
+    run, in order. halt() also drops everything queued and stops the motors.
+    """
+
+    def __init__(self):
+        self._commands = queue.Queue()
+        # Every command carries the generation it was submitted as. The running command is
+        # preempted once a newer generation exists, so a command is never cut short by its own submit.
+        self._changed = threading.Condition()
+        self._latest = 0
+        self._current = 0
+        self._thread = threading.Thread(target=self._run, name="motion", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, name, action, skippable=True):
+        with self._changed:
+            self._latest += 1
+            self._commands.put((self._latest, name, action, skippable))
+            self._changed.notify_all()
+
+    def halt(self):
+        while True:
+            try:
+                self._commands.get_nowait()
+            except queue.Empty:
+                break
+        self.submit("stop", stop, skippable=False)
+
+    def preempted(self):
+        with self._changed:
+            return self._latest != self._current
+
+    def hold(self, duration, guard=None):
+        """
+        Keep the current motion going for duration seconds. Runs on the motion thread.
+        Returns False if a newer command or the guard (e.g. obstacle_ahead) cut it short.
+        """
+        deadline = time.monotonic() + duration
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            with self._changed:
+                if self._latest == self._current:
+                    self._changed.wait(min(remaining, GUARD_INTERVAL_S) if guard else remaining)
+                if self._latest != self._current:
+                    return False
+            if guard is not None and guard():
+                return False
 
+    def _run(self):
+        while True:
+            generation, name, action, skippable = self._commands.get()
+            with self._changed:
+                self._current = generation
+                superseded = generation != self._latest
+            if skippable and superseded:
+                print(f"[Motion] Skipping {name}, superseded.")
+                continue
+            print(f"[Motion] {name}")
+            try:
+                action()
+            except Exception as e:
+                print(f"[Motion] {name} failed:", e)
+                halt_motors()
 
 
-def stop():
-    global result_received
+motion = MotionExecutor()
+
+
+
+def halt_motors():
     en_a.value = 0
     en_b.value = 0
     in1.off()
@@ -79,6 +181,10 @@ def stop():
     in4.off()
     print("Motors stopped.")
 
+def stop():
+    global result_received
+    halt_motors()
+
     if not result_received:
         capture_and_send_image()
     else:
@@ -93,8 +199,7 @@ def move_forward(speed=0.75, duration=3):
     in3.on()
     in4.off()
     print("Moving forward")
-    time.sleep(duration)
-    stop()
+    finish_move(motion.hold(duration, guard=obstacle_ahead))
 
 def move_backward(speed=0.6, duration=2):
     en_a.value = 0.61
@@ -104,8 +209,7 @@ def move_backward(speed=0.6, duration=2):
     in3.off()
     in4.on()
     print("Moving backward")
-    time.sleep(duration)
-    stop()
+    finish_move(motion.hold(duration))
 
 def rotate_left(speed=1.0, duration=0.4):
     en_a.value = speed
@@ -115,8 +219,7 @@ def rotate_left(speed=1.0, duration=0.4):
     in3.on()
     in4.off()
     print("Rotating left")
-    time.sleep(duration)
-    stop()
+    finish_move(motion.hold(duration))
 
 def rotate_right(speed=1.0, duration=0.3):
     en_a.value = speed
@@ -126,18 +229,26 @@ def rotate_right(speed=1.0, duration=0.3):
     in3.off()
     in4.on()
     print("Rotating right")
-    time.sleep(duration)
-    stop()
+    finish_move(motion.hold(duration))
+
+def finish_move(completed):
+    # Preempted by a newer command: just stop the motors, the newer command decides what is next
+    if completed or not motion.preempted():
+        stop()
+    else:
+        halt_motors()
 
 def capture_and_send_image():
-    image_path = "image2.jpg"
-    subprocess.run(["fswebcam", "-S", "20", "-r", "1280x720", "--no-banner", image_path])
+    # Newest frame from the open camera, read after the motors stopped
+    captured = camera.latest_jpeg(after=time.time())
+    if captured is None:
+        print("No camera frame available, nothing sent.")
+        return
     print("Image captured.")
 
-    with open(image_path, "rb") as img_file:
-        image_b64 = base64.b64encode(img_file.read()).decode("utf-8")
-        mqtt_client.publish(PUBLISH_IMAGE_TOPIC, image_b64)
-        print("Image sent to MQTT.")
+    image_b64 = base64.b64encode(captured[0]).decode("utf-8")
+    mqtt_client.publish(PUBLISH_IMAGE_TOPIC, image_b64)
+    print("Image sent to MQTT.")
 
 def prompt_for_goal():
     global ai_ready, result_received, navdir_received
@@ -153,6 +264,18 @@ def prompt_for_goal():
             return True
         print("❗ Goal cannot be empty. Please try again.")
 
+# The goal is typed on the console by this thread; callbacks only ask for a new one
+goal_needed = threading.Event()
+
+def goal_prompt_thread():
+    global goal_sent
+    while True:
+        goal_needed.wait()
+        goal_needed.clear()
+        goal_sent = prompt_for_goal()
+        if goal_sent:
+            motion.submit("capture", capture_and_send_image, skippable=False)
+
 def start_navdir_timeout_timer():
     global nav_timeout_timer
 
@@ -175,16 +298,12 @@ def on_connect(client, userdata, flags, rc):
         client.subscribe(topic)
         print(f"Subscribed to {topic}")
 
-    global goal_sent, ai_ready, result_received, navdir_received
-    ai_ready = False
-    result_received = False
-    navdir_received = False
-    goal_sent = prompt_for_goal()
-    if goal_sent:
-        capture_and_send_image()
+    # Never block the network thread on the console, the prompt thread asks for the goal
+    if not goal_sent:
+        goal_needed.set()
 
 def on_message(client, userdata, msg):
-    global ai_ready, result_received, navdir_received, nav_timeout_timer, goal_sent
+    global ai_ready, result_received, navdir_received
 
     topic = msg.topic
     payload = msg.payload.decode().strip().upper()
@@ -213,23 +332,17 @@ def on_message(client, userdata, msg):
             ai_ready = False
             result_received = True
             navdir_received = False
-            stop()
+            motion.halt()  # Cuts a move short, even during its navdir settle time
             print("🕒 Waiting for NEW goal. Please enter it manually below:")
-            '''
-            goal_sent = prompt_for_goal()
-            if goal_sent:
-                capture_and_send_image()
-                '''
+            # Once the motors have stopped, prompt_for_goal resets the result flags
+            motion.submit("ask for goal", goal_needed.set, skippable=False)
 
 
     elif topic == "team24/fog/navdir":
-        time.sleep(2)
         if result_received and not ai_ready:
             print("🛑 Ignoring navdir. Goal already found. Prompting for new goal.")
-            stop()
-            goal_sent = prompt_for_goal()
-            if goal_sent:
-                capture_and_send_image()
+            motion.halt()
+            motion.submit("ask for goal", goal_needed.set, skippable=False)
             return  # Exit navdir handling early
 
         navdir_received = True
@@ -237,30 +350,46 @@ def on_message(client, userdata, msg):
             nav_timeout_timer.cancel()
         print(f"NAVDIR received: {payload}")
         if payload in ["W", "S", "A", "D"]:
-            print(f"[DEBUG] Navdir '{payload}' received. Checking distance...")
-            if wait_for_safe_90_distance():
-                print("[DEBUG] Safe to move.")
-                if payload == "W":
-                    print("[DEBUG] Executing move_forward()")
-                    move_forward()
-                elif payload == "S":
-                    print("[DEBUG] Executing move_backward()")
-                    move_backward()
-                elif payload == "A":
-                    print("[DEBUG] Executing rotate_left()")
-                    rotate_left()
-                elif payload == "D":
-                    print("[DEBUG] Executing rotate_right()")
-                    rotate_right()
-            else:
-                print("⚠️ Movement skipped due to safety condition.")
-
+            motion.submit(f"navdir {payload}", lambda: execute_navdir(payload))
         elif payload == "STOP":
-            stop()
+            motion.halt()
         elif payload == "BUSY":
             print("Navdir: Server still processing.")
 
 
+def execute_navdir(payload):
+    # Runs on the motion thread; a YES result or a newer navdir during the settle time cancels the move
+    if not motion.hold(NAVDIR_SETTLE_S):
+        return
+    if result_received and not ai_ready:
+        print("🛑 Ignoring navdir. Goal already found.")
+        return
+    print(f"[DEBUG] Navdir '{payload}' received. Checking distance...")
+    if wait_for_safe_90_distance():
+        print("[DEBUG] Safe to move.")
+        if payload == "W":
+            print("[DEBUG] Executing move_forward()")
+            move_forward()
+        elif payload == "S":
+            print("[DEBUG] Executing move_backward()")
+            move_backward()
+        elif payload == "A":
+            print("[DEBUG] Executing rotate_left()")
+            rotate_left()
+        elif payload == "D":
+            print("[DEBUG] Executing rotate_right()")
+            rotate_right()
+    else:
+        print("⚠️ Movement skipped due to safety condition.")
+
+
+# Keep the camera open for the whole run instead of forking fswebcam per capture
+if USE_SYNTHETIC_CAMERA:
+    camera = CaptureService(SyntheticFrameSource(), warmup_frames=0)
+else:
+    camera = CaptureService(V4L2FrameSource(CAMERA_DEVICE))
+camera.start()
+
 # MQTT Client Setup
 mqtt_client = mqtt.Client()
 mqtt_client.username_pw_set(USERNAME, PASSWORD)
@@ -268,6 +397,9 @@ mqtt_client.on_connect = on_connect
 mqtt_client.on_message = on_message
 mqtt_client.connect(BROKER, PORT, 60)
 
+motion.start()
+threading.Thread(target=goal_prompt_thread, name="goal-prompt", daemon=True).start()
+
 # Start MQTT Loop
 mqtt_client.loop_forever()
 
@@ -1,31 +1,116 @@
 import gpiozero
 import base64
 import time
-import os
-import subprocess
 import threading
+import itertools
+import json
+import queue
 import paho.mqtt.client as mqtt
 
+from frame_protocol import encode_frame
+from frame_encoder import DEFAULT_CAPS, parse_capabilities
+from camera_capture import CaptureService, SyntheticFrameSource, V4L2FrameSource
+from lidar_ring import RingReader
+from lidar_sectors import SectorAnalyzer
+from local_planner import LocalPlanner, fog_direction
+
 # MQTT Config
 BROKER = "nekocoaster.ddns.net"
 PORT = 16883
 USERNAME = "team24"
 PASSWORD = "qwerty123456"
 
-PUBLISH_NAV_TOPIC = "team24/rov/navcam"
-PUBLISH_CAMERA_TOPIC = "team24/rov/camera"
+# Set to a unique name when several ROVs share one fog server. The vehicle's frames and the
+# server's answers then go through team24/rov/<VEHICLE_ID>/... and team24/fog/<VEHICLE_ID>/...,
+# and the server keeps a separate objective and queue share for it (fleet.py on the server).
+# None uses the original topics.
+VEHICLE_ID = None
+
+
+def vehicle_topic(topic):
+    if VEHICLE_ID is None:
+        return topic
+    levels = topic.split("/")
+    return "/".join(levels[:2] + [VEHICLE_ID] + levels[2:])
+
+
+PUBLISH_NAV_TOPIC = vehicle_topic("team24/rov/navcam")
+PUBLISH_CAMERA_TOPIC = vehicle_topic("team24/rov/camera")
+PUBLISH_FRAME_TOPIC = vehicle_topic("team24/rov/frame")
+
+# Send one frame per cycle and let the fog server answer both the object and the
+# navigation question from it (server2.py shared prefill). Needs a server that
+# subscribes to PUBLISH_FRAME_TOPIC.
+SHARED_FRAME_MODE = False
+
+# Publish frames as a small binary header + raw JPEG (frame_protocol.py) instead of a
+# base64 string. Servers accept both, set False for servers that predate the binary protocol.
+BINARY_FRAMES = True
+
+# Keep several frames in flight instead of send, sleep and poll FOG_AI_BUSY. The server echoes
+# each frame's id on the /detail result topics, so answers are matched to the frames they answer
+# and answers for frames captured before the last movement are discarded. Needs BINARY_FRAMES.
+PIPELINED = True
+PIPELINE_DEPTH = 2       # Frames in flight at once
+ANSWER_TIMEOUT_S = 10.0  # Give up on a frame the server has not answered by then
+LIDAR_TIMEOUT_S = 1.0    # No distance reading for this long counts as unsafe to move
+
+# Pipelined loop only: decide the direction from the LiDAR scan when it is unambiguous (open space
+# ahead, or a wall with a clear side) and ask the fog server only otherwise. If the fog server has
+# not answered a navigation frame within NAV_DEADLINE_S, go with the LiDAR's best guess.
+LOCAL_PLANNER = True
+NAV_DEADLINE_S = 2.0
+
+# Camera Config
+CAMERA_DEVICE = "/dev/video0"
+CAPTURE_WIDTH = 1280
+CAPTURE_HEIGHT = 720
+CAPTURE_JPEG_QUALITY = 85    # Used until the server's capabilities say otherwise
+USE_SYNTHETIC_CAMERA = False  # Test pattern instead of the webcam, for bench runs without a camera
+
+TOPIC_CAPABILITIES = "team24/fog/capabilities"  # Shared by the whole fleet
+TOPIC_LIFECYCLE = "team24/fog/lifecycle"        # Retained LOADING, WARMING, READY, STOPPING or OFFLINE, fleet-wide
+TOPIC_AI_STATUS = vehicle_topic("team24/fog/AI_Status")
+TOPIC_RESULT = vehicle_topic("team24/fog/result")
+TOPIC_NAVDIR = vehicle_topic("team24/fog/navdir")
+TOPIC_RESULT_DETAIL = TOPIC_RESULT + "/detail"
+TOPIC_NAVDIR_DETAIL = TOPIC_NAVDIR + "/detail"
 
 SUB_TOPICS = [
-    "team24/fog/AI_Status",
-    "team24/fog/result",
-    "team24/fog/navdir"
+    TOPIC_CAPABILITIES,
+    TOPIC_LIFECYCLE,
+    TOPIC_AI_STATUS,
+    TOPIC_RESULT,
+    TOPIC_NAVDIR,
+    TOPIC_RESULT_DETAIL,
+    TOPIC_NAVDIR_DETAIL
 ]
 
+# Tasks the server answers for a frame sent as each task
+FRAME_TASKS = {"camera": ("camera",), "navcam": ("navcam",), "frame": ("camera", "navcam")}
+
 # State variables
+frame_ids = itertools.count(1)
+SERVER_CAPS = DEFAULT_CAPS  # Input size/codec the fog server accepts, from its retained capabilities topic
 FOG_NAVDIR = 'E'  # Default to 'E' for stop.
 FOG_AI_BUSY = False
 FOG_RESULT = False
 
+# Set by the topic handlers the moment the matching message arrives, waited on by the control loops
+ai_ready = threading.Event()         # AI_Status is READY
+ai_ready.set()
+result_answered = threading.Event()  # YES or NO on the result topic
+navdir_answered = threading.Event()  # A direction on the navdir topic
+
+# Pipelined loop state
+in_flight = {}          # frame id -> {"tasks": tasks not answered yet, "captured": capture time, "sent": send time}
+in_flight_lock = threading.Lock()
+answers = queue.Queue()  # (frame id, task, label, capture time) of matched answers, in arrival order
+LAST_MOVE_END = 0.0      # Frames captured before this show a view the ROV has since moved away from
+NAV_ASKED_AT = None      # When the fog server was asked for a direction that has not been acted on yet
+nav_decisions = {"local": 0, "fog": 0, "fallback": 0}
+planner = LocalPlanner()
+
 # Motor Setup
 in1 = gpiozero.OutputDevice(16)
 in2 = gpiozero.OutputDevice(26)
@@ -44,17 +129,20 @@ en_b.on()
 # LiDAR distance Functions
 # -----------------------------------------
 
+# Full scans from the LiDAR reader node, shared through memory (lidar_ring.py)
+lidar = RingReader()
+sectors = SectorAnalyzer()
+
 # Function to get the 90-degree distance
 def get_90_degree_distance():
-    try:
-        with open(os.path.expanduser("~/scan_90deg.txt"), "r") as f:
-            value = float(f.read().strip())
-            return value
-    except Exception:
-        return None
+    # Nearest return in the 30° arc around 90°, not just the single 90° ray (lidar_sectors.py)
+    scan = lidar.latest()
+    return sectors.analyze_scan(scan)["front"].min if scan is not None else None
 
 # Function to check if the distance is safe (less than threshold)
-def wait_for_safe_90_distance(threshold=0.2):
+def wait_for_safe_90_distance(threshold=0.2, timeout=LIDAR_TIMEOUT_S):
+    # Returns at once when the LiDAR reader has a fresh scan, which is the normal case
+    deadline = time.monotonic() + timeout
     while True:
         distance = get_90_degree_distance()
         if distance is not None:
@@ -64,7 +152,11 @@ def wait_for_safe_90_distance(threshold=0.2):
                 move_backward(speed=0.5, duration=0.3)
                 return False
             return True
-        time.sleep(0.1)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"No LiDAR reading for {timeout:.1f}s. Not moving.")
+            return False
+        lidar.wait_for_scan(timeout=remaining)
 
 # -----------------------------------------
 # Movement and Image Capture Functions
@@ -123,37 +215,78 @@ def rotate_right(speed=1.0, duration=0.3):
     time.sleep(duration)
     stop()
 
+def publish_image(topic, task):
+    # Newest frame read after this call, so nothing blurred by a movement that just ended
+    max_res = SERVER_CAPS["max_res"] if SERVER_CAPS else None
+    quality = SERVER_CAPS["quality"] if SERVER_CAPS else CAPTURE_JPEG_QUALITY
+    captured = camera.latest_jpeg(max_res=max_res, quality=quality, after=time.time())
+    if captured is None:
+        print("No camera frame available, nothing sent.")
+        return False
+    image_bytes, width, height, timestamp = captured
+    frame_id = next(frame_ids) & 0xFFFFFFFF  # The header field is 32 bits, the server echoes it as sent
+    if BINARY_FRAMES:
+        payload = encode_frame(image_bytes, task, width, height, frame_id, timestamp)
+    else:
+        payload = base64.b64encode(image_bytes).decode("utf-8")
+    if PIPELINED:
+        # Registered before publishing, the answer can arrive before publish() returns
+        with in_flight_lock:
+            in_flight[frame_id] = {"tasks": set(FRAME_TASKS[task]), "captured": timestamp, "sent": time.time()}
+    mqtt_client.publish(topic, payload)
+    return True
+
 def capture_and_send_image_object():
-    image_path = "objective.jpg"
-    subprocess.run(["fswebcam", "-S", "20", "-r", "1280x720", "--no-banner", image_path])
-    print("Object image captured.")
-    with open(image_path, "rb") as img_file:
-        image_b64 = base64.b64encode(img_file.read()).decode("utf-8")
-        mqtt_client.publish(PUBLISH_CAMERA_TOPIC, image_b64)
+    sent = publish_image(PUBLISH_CAMERA_TOPIC, "camera")
+    if sent:
         print("Object image sent to MQTT.")
+    return sent
 
 def capture_and_send_image_navigation():
-    image_path = "navigation.jpg"
-    subprocess.run(["fswebcam", "-S", "20", "-r", "1280x720", "--no-banner", image_path])
-    print("Navigation image captured.")
-    with open(image_path, "rb") as img_file:
-        image_b64 = base64.b64encode(img_file.read()).decode("utf-8")
-        mqtt_client.publish(PUBLISH_NAV_TOPIC, image_b64)
+    sent = publish_image(PUBLISH_NAV_TOPIC, "navcam")
+    if sent:
         print("Navigation image sent to MQTT.")
+    return sent
+
+def capture_and_send_image_shared():
+    sent = publish_image(PUBLISH_FRAME_TOPIC, "frame")
+    if sent:
+        print("Shared image sent to MQTT.")
+    return sent
 
 # -----------------------------------------
 # Topic Handlers
 # -----------------------------------------
 
+def handle_capabilities(payload):
+    global SERVER_CAPS
+    # Retained by the server, so this arrives on every (re)connect and whenever the server changes it
+    SERVER_CAPS = parse_capabilities(payload)
+    print(f"[Capabilities] Sending frames as: {SERVER_CAPS or 'full capture'}")
+
 def handle_ai_status(payload):
     global FOG_AI_BUSY
     # Expected values: "READY" or "BUSY"
-    if payload.upper() == "BUSY":
-        FOG_AI_BUSY = True
-    elif payload.upper() == "READY":
+    if payload.upper() == "READY":
         FOG_AI_BUSY = False
+        ai_ready.set()
+    else:
+        # BUSY, or LOADING while the server starts
+        FOG_AI_BUSY = True
+        ai_ready.clear()
     print(f"[AI Status] Updated to: {payload}")
 
+def handle_lifecycle(payload):
+    global FOG_AI_BUSY
+    # Retained, so this arrives on connect: hold off while the server is starting, stopping or gone
+    if payload.upper() == "READY":
+        FOG_AI_BUSY = False
+        ai_ready.set()
+    else:
+        FOG_AI_BUSY = True
+        ai_ready.clear()
+    print(f"[Lifecycle] Server is {payload}")
+
 def handle_result(payload):
     global FOG_RESULT
     # Expected values: "YES", "NO", or "BUSY"
@@ -161,25 +294,49 @@ def handle_result(payload):
         FOG_RESULT = True
         print("[Result] Goal object found. Stopping ROV.")
         stop()
+        result_answered.set()
     elif payload.upper() == "NO":
         FOG_RESULT = False
         print("[Result] Goal object not found.")
+        result_answered.set()
     else:
         print("[Result] Still processing...")
     print(f"[Result] Updated to: {payload}")
 
 def handle_navdir(payload):
     global FOG_NAVDIR
-    # Expected values: "W", "A", "S", "D", "E", or "BUSY"
+    # Expected values: "W", "A", "S", "D", "E" (or "STOP"), or "BUSY"
     if payload.upper() != "BUSY":
-        FOG_NAVDIR = payload.upper()
+        FOG_NAVDIR = fog_direction(payload)
+        navdir_answered.set()
     print(f"[NavDir] Updated to: {payload}")
 
+def handle_detail(payload):
+    # {"label": ..., "confidence": ..., "task": ..., "frame_id": ..., "timestamp": ...}, "label" is
+    # null and "dropped" is set if the server dropped the frame
+    try:
+        detail = json.loads(payload)
+    except ValueError:
+        return
+    frame_id, task = detail.get("frame_id"), detail.get("task")
+    with in_flight_lock:
+        frame = in_flight.get(frame_id)
+        if frame is None:
+            return  # Not sent by this loop, or already given up on
+        frame["tasks"].discard(task)
+        if not frame["tasks"]:
+            del in_flight[frame_id]
+    answers.put((frame_id, task, detail.get("label"), frame["captured"]))
+
 # Dictionary mapping topics to their handler functions
 topic_handlers = {
-    "team24/fog/AI_Status": handle_ai_status,
-    "team24/fog/result": handle_result,
-    "team24/fog/navdir": handle_navdir,
+    TOPIC_CAPABILITIES: handle_capabilities,
+    TOPIC_LIFECYCLE: handle_lifecycle,
+    TOPIC_AI_STATUS: handle_ai_status,
+    TOPIC_RESULT: handle_result,
+    TOPIC_NAVDIR: handle_navdir,
+    TOPIC_RESULT_DETAIL: handle_detail,
+    TOPIC_NAVDIR_DETAIL: handle_detail,
 }
 
 # -----------------------------------------
@@ -204,52 +361,170 @@ def on_message(client, userdata, msg):
 # Main Control Loop
 # -----------------------------------------
 
+def move(direction):
+    if direction == 'W':
+        if wait_for_safe_90_distance():  # Check if it's safe to move
+            move_forward()
+    elif direction == 'S':
+        if wait_for_safe_90_distance():  # Check if it's safe to move
+            move_backward()
+    elif direction == 'A':
+        if wait_for_safe_90_distance():  # Check if it's safe to move
+            rotate_left()
+    elif direction == 'D':
+        if wait_for_safe_90_distance():  # Check if it's safe to move
+            rotate_right()
+    elif direction == 'E':
+        stop()
+
+def execute_navdir():
+    global FOG_NAVDIR
+    move(FOG_NAVDIR)
+    FOG_NAVDIR = 'E'  # Reset to stop after executing command
+
+def send_and_wait(send, *answers, timeout=ANSWER_TIMEOUT_S):
+    """
+    Send a frame and wait until the server is READY again, waking as soon as it is.
+    The server publishes the answers before READY, so an answer event still clear by
+    then means the frame was dropped. Returns True if every answer arrived.
+    """
+    for answer in answers:
+        answer.clear()
+    ai_ready.clear()
+    if not send():
+        result_answered.wait(1)  # No camera frame, try again shortly (or stop early on a result)
+        return False
+    if not ai_ready.wait(timeout):
+        print(f"No answer from the fog server within {timeout:.0f}s.")
+        return False
+    if not all(answer.is_set() for answer in answers):
+        print("The fog server dropped the frame.")
+        return False
+    return True
+
+def wait_while_inactive():
+    print("ROV inactive: either goal object has been found or AI is processing.")
+    # Wakes early on the next result or READY, the timeout only paces this message
+    result_answered.clear()
+    if FOG_AI_BUSY:
+        ai_ready.wait(1)
+    else:
+        result_answered.wait(1)
+
 def main_thread():
-    global FOG_NAVDIR, FOG_AI_BUSY, FOG_RESULT
     while True:
-        if not FOG_RESULT and not FOG_AI_BUSY:
+        if not FOG_RESULT and not FOG_AI_BUSY and SHARED_FRAME_MODE:
+            # Stage 1+2: One image answers both the object and the navigation question
+            if not send_and_wait(capture_and_send_image_shared, result_answered, navdir_answered):
+                continue
+            if FOG_RESULT:
+                continue
+            execute_navdir()
+        elif not FOG_RESULT and not FOG_AI_BUSY:
             # Stage 1: Capture image for object detection
-            capture_and_send_image_object()
-            time.sleep(1)  # Wait for the image to be sent
-            
-            # Wait until the AI has finished processing
-            while FOG_AI_BUSY:
-                print("Waiting for AI to process object image...")
-                time.sleep(1)
-            
+            if not send_and_wait(capture_and_send_image_object, result_answered):
+                continue
+            if FOG_RESULT:
+                continue
+
             # Stage 2: Capture image for navigation commands
-            capture_and_send_image_navigation()
-            time.sleep(1)  # Wait for the image to be sent
-            
-            while FOG_AI_BUSY:
-                print("Waiting for AI to process navigation image...")
-                time.sleep(1)
-            
+            if not send_and_wait(capture_and_send_image_navigation, navdir_answered):
+                continue
+
             # Stage 3: Execute navigation command based on AI result
-            if FOG_NAVDIR == 'W':
-                if wait_for_safe_90_distance():  # Check if it's safe to move
-                    move_forward()
-            elif FOG_NAVDIR == 'S':
-                if wait_for_safe_90_distance():  # Check if it's safe to move
-                    move_backward()
-            elif FOG_NAVDIR == 'A':
-                if wait_for_safe_90_distance():  # Check if it's safe to move
-                    rotate_left()
-            elif FOG_NAVDIR == 'D':
-                if wait_for_safe_90_distance():  # Check if it's safe to move
-                    rotate_right()
-            elif FOG_NAVDIR == 'E':
-                stop()
-            
-            FOG_NAVDIR = 'E'  # Reset to stop after executing command
+            execute_navdir()
         else:
-            print("ROV inactive: either goal object has been found or AI is processing.")
-            time.sleep(1)
+            wait_while_inactive()
+
+def expire_in_flight():
+    now = time.time()
+    with in_flight_lock:
+        expired = [frame_id for frame_id, frame in in_flight.items() if now - frame["sent"] > ANSWER_TIMEOUT_S]
+        for frame_id in expired:
+            del in_flight[frame_id]
+    for frame_id in expired:
+        print(f"[Pipeline] No answer for frame {frame_id}, giving up on it.")
+
+def local_decision(fallback=False):
+    scan = lidar.latest()
+    if scan is None:
+        return "E" if fallback else None
+    readings = sectors.analyze_scan(scan)
+    return planner.fallback(readings) if fallback else planner.decide(readings)
+
+def navigate(direction, source):
+    global LAST_MOVE_END, NAV_ASKED_AT
+    nav_decisions[source] += 1
+    total = sum(nav_decisions.values())
+    print(f"[Nav] {direction} ({source}), {nav_decisions['local'] / total:.0%} of {total} decisions made locally.")
+    move(direction)
+    NAV_ASKED_AT = None  # Answered, or overtaken by this move
+    if direction != 'E':
+        LAST_MOVE_END = time.time()
+
+def pipelined_main_thread():
+    global FOG_RESULT, NAV_ASKED_AT
+    # Frames alternate between the object and the navigation question unless one frame answers both
+    next_tasks = itertools.cycle(["frame"] if SHARED_FRAME_MODE else ["camera", "navcam"])
+    senders = {"frame": capture_and_send_image_shared, "camera": capture_and_send_image_object,
+               "navcam": capture_and_send_image_navigation}
+    while True:
+        if FOG_RESULT:
+            wait_while_inactive()
+            continue
+
+        # Capture and upload the next frame while the server is still answering the earlier ones
+        expire_in_flight()
+        with in_flight_lock:
+            room = len(in_flight) < PIPELINE_DEPTH
+        if room:
+            task = next(next_tasks)
+            direction = local_decision() if LOCAL_PLANNER and task != "camera" else None
+            if direction is not None:
+                navigate(direction, "local")
+                if task == "frame":
+                    capture_and_send_image_object()  # The object question still needs the camera
+            elif senders[task]() and task != "camera" and NAV_ASKED_AT is None:
+                NAV_ASKED_AT = time.time()
+
+        timeout = 0.01 if room else 1.0
+        if LOCAL_PLANNER and NAV_ASKED_AT is not None:
+            remaining = NAV_ASKED_AT + NAV_DEADLINE_S - time.time()
+            if remaining <= 0:
+                print(f"[Nav] No direction from the fog server within {NAV_DEADLINE_S:.1f}s.")
+                navigate(local_decision(fallback=True), "fallback")
+                continue
+            timeout = min(timeout, remaining)
+        try:
+            frame_id, task, label, captured = answers.get(timeout=timeout)
+        except queue.Empty:
+            continue
+
+        if label is None:
+            print(f"[Pipeline] Server dropped frame {frame_id} ({task}).")
+        elif task == "camera":
+            if label == "YES":
+                FOG_RESULT = True
+                print(f"[Pipeline] Goal object found in frame {frame_id}. Stopping ROV.")
+                stop()
+        elif task == "navcam":
+            if captured < LAST_MOVE_END:
+                print(f"[Pipeline] Discarding {label} for frame {frame_id}, captured before the last movement.")
+                continue
+            print(f"[Pipeline] Frame {frame_id}: {label}, {time.time() - captured:.2f}s after capture.")
+            navigate(fog_direction(label), "fog")
 
 # -----------------------------------------
-# MQTT Client Setup and Main Loop
+# Camera, MQTT Client Setup and Main Loop
 # -----------------------------------------
 
+# Keep the camera open for the whole run instead of forking fswebcam per capture
+if USE_SYNTHETIC_CAMERA:
+    camera = CaptureService(SyntheticFrameSource(CAPTURE_WIDTH, CAPTURE_HEIGHT), warmup_frames=0)
+else:
+    camera = CaptureService(V4L2FrameSource(CAMERA_DEVICE, CAPTURE_WIDTH, CAPTURE_HEIGHT))
+camera.start()
+
 mqtt_client = mqtt.Client()
 mqtt_client.username_pw_set(USERNAME, PASSWORD)
 mqtt_client.on_connect = on_connect
@@ -257,7 +532,8 @@ mqtt_client.on_message = on_message
 mqtt_client.connect(BROKER, PORT, 60)
 
 # Run the main control loop in a separate daemon thread
-main_thread_thread = threading.Thread(target=main_thread, daemon=True)
+main_loop = pipelined_main_thread if PIPELINED and BINARY_FRAMES else main_thread
+main_thread_thread = threading.Thread(target=main_loop, daemon=True)
 main_thread_thread.start()
 
 # Start the MQTT loop (blocking call)
@@ -0,0 +1,36 @@
+import json
+
+# -----------------------------------------
+# Fog server capabilities
+# -----------------------------------------
+
+# What the ROV sends until the server has told us otherwise: the full capture, as is.
+DEFAULT_CAPS = None
+
+
+def parse_capabilities(payload):
+    """
+    Parse the retained team24/fog/capabilities message, e.g.
+    {"max_res": 360, "codec": "jpeg", "quality": 80, "protocol": 1}.
+    Returns None if the message is empty or unusable, which means "send frames unchanged".
+    """
+    try:
+        caps = json.loads(payload)
+        caps["max_res"] = int(caps["max_res"])
+        caps["quality"] = int(caps.get("quality", 80))
+    except (ValueError, KeyError, TypeError):
+        return None
+    if caps.get("codec", "jpeg") != "jpeg" or caps["max_res"] <= 0:
+        return None
+    return caps
+
+
+def scaled_size(width, height, max_res):
+    """
+    Same rule the server uses: shrink so the longer side is max_res, keep the aspect ratio.
+    """
+    if width <= max_res and height <= max_res:
+        return width, height
+    scale = max_res / float(max(width, height))
+    return int(width * scale), int(height * scale)
+
@@ -0,0 +1,136 @@
+"""
+Binary frame payloads for team24/rov/* image topics.
+
+    offset  size  field
+    0       4     magic b"T24F"
+    4       1     version (1)
+    5       1     task   (TASK_CODES)
+    6       1     codec  (CODEC_CODES)
+    7       1     flags  (reserved, 0)
+    8       2     header length in bytes, image data starts here
+    10      2     width
+    12      2     height
+    14      4     frame id
+    18      8     capture timestamp, float seconds since the epoch
+    26            image bytes
+
+All fields are little-endian. Readers skip to the header length, so later
+versions can append fields without breaking older readers. Payloads without the
+magic are treated as the legacy base64-encoded JPEG string.
+
+Copy of ../frame_protocol.py, the ROV is deployed on its own. Keep the two in sync.
+"""
+import base64
+import io
+import struct
+
+MAGIC = b"T24F"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBBHHHId")
+
+TASK_CODES = {"camera": 0, "navcam": 1, "frame": 2}
+CODEC_CODES = {"jpeg": 0, "png": 1}
+TASK_NAMES = {code: name for name, code in TASK_CODES.items()}
+CODEC_NAMES = {code: name for name, code in CODEC_CODES.items()}
+
+
+class Frame:
+    """
+    A decoded payload. data is a memoryview into the original MQTT payload
+    (binary frames) or the base64-decoded bytes (legacy frames).
+    frame_id and timestamp are None for legacy frames.
+    """
+
+    def __init__(self, data, task=None, codec="jpeg", width=0, height=0, frame_id=None, timestamp=None, version=0):
+        self.data = data
+        self.task = task
+        self.codec = codec
+        self.width = width
+        self.height = height
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.version = version
+
+    def open(self):
+        """
+        Read-only file object over the image bytes, for Image.open().
+        """
+        return BufferReader(self.data)
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable file object over a memoryview, so the image can be decoded straight
+    from the payload buffer. io.BytesIO would copy the whole frame first.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        chunk = self._view[self._pos:end]
+        self._pos += len(chunk)
+        return chunk.tobytes()
+
+
+def encode_frame(image_bytes, task, width, height, frame_id, timestamp, codec="jpeg"):
+    """
+    Header + raw image bytes, ready to publish.
+    """
+    header = HEADER.pack(MAGIC, VERSION, TASK_CODES[task], CODEC_CODES[codec], 0,
+                         HEADER.size, width, height, frame_id & 0xFFFFFFFF, timestamp)
+    return header + image_bytes
+
+
+def is_binary_frame(payload):
+    return payload[:len(MAGIC)] == MAGIC
+
+
+def decode_frame(payload, default_task=None):
+    """
+    Decode a binary frame or, if the payload has no magic, a legacy base64 string.
+    Raises ValueError for truncated or unsupported binary frames.
+    """
+    if not is_binary_frame(payload):
+        return Frame(base64.b64decode(payload), task=default_task)
+
+    if len(payload) < HEADER.size:
+        raise ValueError(f"Truncated frame header ({len(payload)} bytes)")
+    _, version, task, codec, _, header_len, width, height, frame_id, timestamp = HEADER.unpack_from(payload)
+    if version < 1 or header_len < HEADER.size or header_len > len(payload):
+        raise ValueError(f"Unsupported frame (version {version}, header {header_len} bytes)")
+    return Frame(
+        memoryview(payload)[header_len:],
+        task=TASK_NAMES.get(task, default_task),
+        codec=CODEC_NAMES.get(codec, "jpeg"),
+        width=width,
+        height=height,
+        frame_id=frame_id,
+        timestamp=timestamp,
+        version=version,
+    )
@@ -0,0 +1,384 @@
+"""
+Shared-memory ring buffer of full LiDAR scans.
+
+The LiDAR reader node (specific_lidar_reader.py) writes every /scan message into a
+memory-mapped file; the control scripts (compmqtt.py, compmqtt3.py) map the same file
+and read the newest scan, or wait for the next one. Writing a scan is a handful of
+memory copies, with no open/write/close per scan, and readers always see a whole scan.
+
+    offset  size  field
+    0       4     magic b"T24L"
+    4       4     version (1)
+    8       4     slots (K)
+    12      4     max points per scan (N)
+    16      8     sequence number of the newest complete scan, 0 = none yet
+    24            K slots of SLOT_HEADER.size + 4 * N bytes each
+
+    slot:   8     sequence number (0 while the slot is being written)
+            8     timestamp, time.time() when the scan was written
+            8     angle_min (rad)
+            8     angle_increment (rad)
+            8     range_min (m)
+            8     range_max (m)
+            4     number of ranges
+            4     padding
+            4 * N ranges, float32 (m)
+
+All fields are little-endian. The writer marks a slot 0 before filling it and stamps
+its sequence number afterwards; a reader copies a slot and keeps the copy only if the
+slot carried the same sequence number before and after, so a scan overwritten while
+being read is retried instead of returned torn.
+
+    python lidar_ring.py --synthetic          # synthetic scans, no ROS or LiDAR needed
+    python lidar_ring.py --watch              # print the front distance of every new scan
+    python lidar_ring.py --bench              # write cost against the old text file handoff
+"""
+import argparse
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+MAGIC = b"T24L"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQ")
+SLOT_HEADER = struct.Struct("<QdddddII")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 16
+
+# /dev/shm keeps the file in RAM; fall back to the temp dir where there is none
+DEFAULT_PATH = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "team24_lidar")
+DEFAULT_SLOTS = 8
+DEFAULT_MAX_POINTS = 2048  # RPLIDAR A1 scans have well under 2000 points
+
+FRONT_ANGLE = math.radians(90)  # The front of the robot, found by inspecting RViz2
+
+
+class Scan:
+    """
+    One full LiDAR scan. ranges is a float32 numpy array owned by the reader.
+    """
+
+    def __init__(self, seq, timestamp, angle_min, angle_increment, range_min, range_max, ranges):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.angle_min = angle_min
+        self.angle_increment = angle_increment
+        self.range_min = range_min
+        self.range_max = range_max
+        self.ranges = ranges
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+    def range_at(self, angle):
+        """
+        Range of the ray at angle (rad), None if there is no such ray or it has no valid return.
+        """
+        index = int((angle - self.angle_min) / self.angle_increment)
+        if 0 <= index < len(self.ranges):
+            distance = float(self.ranges[index])
+            if math.isfinite(distance):
+                return distance
+        return None
+
+
+class LidarRing:
+    """
+    The mapped ring. create() makes (or resets) it for the writer, open() maps an existing
+    one for reading. A ring is written by one process and read by any number.
+    """
+
+    def __init__(self, path, mm, slots, max_points):
+        self.path = path
+        self._mm = mm
+        self.slots = slots
+        self.max_points = max_points
+        self.slot_size = SLOT_HEADER.size + 4 * max_points
+        self._seq = SEQ.unpack_from(mm, SEQ_OFFSET)[0]
+        # One float32 view per slot over the mapping, so a scan is written with a single copy
+        self._ranges = [
+            np.frombuffer(mm, dtype="<f4", count=max_points, offset=self._slot_offset(i) + SLOT_HEADER.size)
+            for i in range(slots)
+        ]
+
+    @classmethod
+    def create(cls, path=DEFAULT_PATH, slots=DEFAULT_SLOTS, max_points=DEFAULT_MAX_POINTS):
+        size = HEADER.size + slots * (SLOT_HEADER.size + 4 * max_points)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        mm[:size] = bytes(size)
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, slots, max_points, 0)
+        return cls(path, mm, slots, max_points)
+
+    @classmethod
+    def open(cls, path=DEFAULT_PATH):
+        """
+        Map an existing ring. Raises FileNotFoundError if the writer has not created it yet
+        and ValueError if the file is not a ring.
+        """
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{path} is not a LiDAR ring ({size} bytes)")
+            mm = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        magic, version, slots, max_points, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version < 1 or size < HEADER.size + slots * (SLOT_HEADER.size + 4 * max_points):
+            raise ValueError(f"{path} is not a LiDAR ring")
+        return cls(path, mm, slots, max_points)
+
+    def close(self):
+        self._ranges = []
+        self._mm.close()
+
+    def _slot_offset(self, index):
+        return HEADER.size + index * self.slot_size
+
+    # ------------------------------
+    # Writer
+    # ------------------------------
+
+    def write(self, ranges, angle_min, angle_increment, range_min=0.0, range_max=math.inf, timestamp=None):
+        """
+        Append a scan, overwriting the oldest. ranges is any float sequence (the LaserScan
+        message's array.array works as is); points beyond max_points are dropped.
+        Returns the scan's sequence number.
+        """
+        ranges = np.asarray(ranges, dtype=np.float32)[:self.max_points]
+        seq = self._seq + 1
+        index = seq % self.slots
+        offset = self._slot_offset(index)
+        SEQ.pack_into(self._mm, offset, 0)  # Readers skip the slot while it is being written
+        self._ranges[index][:len(ranges)] = ranges
+        SLOT_HEADER.pack_into(self._mm, offset, 0, time.time() if timestamp is None else timestamp,
+                              angle_min, angle_increment, range_min, range_max, len(ranges), 0)
+        SEQ.pack_into(self._mm, offset, seq)
+        SEQ.pack_into(self._mm, SEQ_OFFSET, seq)
+        self._seq = seq
+        return seq
+
+    # ------------------------------
+    # Readers
+    # ------------------------------
+
+    def latest_seq(self):
+        return SEQ.unpack_from(self._mm, SEQ_OFFSET)[0]
+
+    def read(self, seq):
+        """
+        The scan with sequence number seq, None if it has been overwritten (or not written yet).
+        """
+        if seq <= 0:
+            return None
+        index = seq % self.slots
+        offset = self._slot_offset(index)
+        slot_seq, timestamp, angle_min, angle_increment, range_min, range_max, count, _ = \
+            SLOT_HEADER.unpack_from(self._mm, offset)
+        if slot_seq != seq:
+            return None
+        ranges = self._ranges[index][:count].copy()
+        if SEQ.unpack_from(self._mm, offset)[0] != seq:
+            return None  # Overwritten while we copied it
+        return Scan(seq, timestamp, angle_min, angle_increment, range_min, range_max, ranges)
+
+    def latest(self):
+        """
+        The newest complete scan, None if there is none yet.
+        """
+        for _ in range(self.slots):
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+            scan = self.read(seq)
+            if scan is not None:
+                return scan
+        return None
+
+    def recent(self, count):
+        """
+        Up to count of the newest scans that are still in the ring, oldest first.
+        """
+        newest = self.latest_seq()
+        scans = [self.read(seq) for seq in range(max(1, newest - min(count, self.slots) + 1), newest + 1)]
+        return [scan for scan in scans if scan is not None]
+
+    def wait_for_scan(self, after_seq=None, timeout=1.0, poll_s=0.002):
+        """
+        Block until a scan newer than after_seq (default: the newest one now) is in the ring
+        and return it, or None on timeout. Waiting reads the mapped counter every poll_s,
+        there is no syscall involved.
+        """
+        if after_seq is None:
+            after_seq = self.latest_seq()
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.latest_seq() > after_seq:
+                scan = self.latest()
+                if scan is not None:
+                    return scan
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_s)
+
+
+class RingReader:
+    """
+    Reader side for the control scripts. Maps the ring on first use (the reader node may
+    start later) and only hands out scans younger than max_age_s, so a stopped LiDAR
+    reads as no reading rather than as its last distance.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_age_s=0.5):
+        self.path = path
+        self.max_age_s = max_age_s
+        self._ring = None
+
+    def _open(self):
+        if self._ring is None:
+            try:
+                self._ring = LidarRing.open(self.path)
+            except (OSError, ValueError):
+                return None
+        return self._ring
+
+    def latest(self):
+        ring = self._open()
+        scan = ring.latest() if ring is not None else None
+        if scan is None or scan.age > self.max_age_s:
+            return None
+        return scan
+
+    def wait_for_scan(self, timeout=1.0):
+        """
+        The next scan to arrive, None if none arrives within timeout.
+        """
+        ring = self._open()
+        if ring is None:
+            time.sleep(timeout)
+            return None
+        return ring.wait_for_scan(timeout=timeout)
+
+
+# -----------------------------------------
+# Synthetic scans
+# -----------------------------------------
+
+class SyntheticScanSource:
+    """
+    RPLIDAR A1-like scans without ROS or hardware: points rays around a full turn at
+    rate_hz, walls at wall_m and an obstacle that sweeps back and forth in front of
+    the robot, from far_m to near_m.
+    """
+
+    def __init__(self, points=720, rate_hz=10.0, wall_m=3.0, far_m=2.0, near_m=0.15, period_s=8.0):
+        self.points = points
+        self.rate_hz = rate_hz
+        self.wall_m = wall_m
+        self.far_m = far_m
+        self.near_m = near_m
+        self.period_s = period_s
+        self.angle_min = -math.pi
+        self.angle_increment = 2 * math.pi / points
+        self.angles = self.angle_min + self.angle_increment * np.arange(points)
+        self._start = time.monotonic()
+
+    def obstacle_distance(self, now=None):
+        phase = (((now or time.monotonic()) - self._start) / self.period_s) % 1.0
+        return self.near_m + (self.far_m - self.near_m) * abs(1.0 - 2.0 * phase)
+
+    def scan(self):
+        ranges = np.full(self.points, self.wall_m, dtype=np.float32)
+        # A 20 cm wide obstacle centred on the front ray
+        distance = self.obstacle_distance()
+        half_width = math.atan2(0.1, distance)
+        ranges[np.abs(self.angles - FRONT_ANGLE) <= half_width] = distance
+        # Dropouts, like a real scan's inf returns
+        ranges[::37] = np.inf
+        return ranges
+
+    def run(self, ring, seconds=None):
+        interval = 1.0 / self.rate_hz
+        next_at = time.monotonic()
+        end = None if seconds is None else next_at + seconds
+        while end is None or time.monotonic() < end:
+            ring.write(self.scan(), self.angle_min, self.angle_increment, 0.15, 12.0)
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+
+def bench(path, scans=2000):
+    source = SyntheticScanSource()
+    ranges = source.scan()
+    ring = LidarRing.create(path)
+    start = time.perf_counter()
+    for _ in range(scans):
+        ring.write(ranges, source.angle_min, source.angle_increment)
+    ring_us = (time.perf_counter() - start) / scans * 1e6
+    reader = LidarRing.open(path)
+    start = time.perf_counter()
+    for _ in range(scans):
+        reader.latest().range_at(FRONT_ANGLE)
+    read_us = (time.perf_counter() - start) / scans * 1e6
+    reader.close()
+    ring.close()
+
+    text_path = path + ".txt"
+    start = time.perf_counter()
+    for _ in range(scans):
+        with open(text_path, "w") as f:
+            f.write(f"{float(ranges[540]):.2f}")
+    text_us = (time.perf_counter() - start) / scans * 1e6
+    start = time.perf_counter()
+    for _ in range(scans):
+        with open(text_path, "r") as f:
+            float(f.read().strip())
+    text_read_us = (time.perf_counter() - start) / scans * 1e6
+    os.remove(text_path)
+    print(f"ring: write {ring_us:.1f} us per full {len(ranges)}-point scan, read latest scan {read_us:.1f} us")
+    print(f"text file: write {text_us:.1f} us per single distance, read {text_read_us:.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LiDAR scan ring buffer tools.")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--synthetic", action="store_true", help="write synthetic scans into the ring")
+    parser.add_argument("--watch", action="store_true", help="print the front distance of every new scan")
+    parser.add_argument("--bench", action="store_true", help="compare write/read cost with the text file")
+    parser.add_argument("--seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.path)
+    elif args.synthetic:
+        print(f"Writing synthetic scans to {args.path}")
+        SyntheticScanSource().run(LidarRing.create(args.path), args.seconds)
+    elif args.watch:
+        ring = LidarRing.open(args.path)
+        seq = ring.latest_seq()
+        while True:
+            scan = ring.wait_for_scan(seq, timeout=5.0)
+            if scan is None:
+                print("No new scan within 5s")
+                continue
+            seq = scan.seq
+            front = scan.range_at(FRONT_ANGLE)
+            front = "no return" if front is None else f"{front:.2f} m"
+            print(f"scan {scan.seq}: front {front}, {1000 * scan.age:.1f} ms old")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Obstacle distances per sector of a full LiDAR scan.
+
+Instead of the single ray at 90 degrees, every ray of the scan is assigned to the arcs
+around the robot (front, front-left, front-right, rear) and each arc reports its
+nearest return and a low percentile of its returns. An obstacle a few degrees off the
+front axis is then still seen by the front arc.
+
+The ray indices of each arc depend only on the scan geometry (angle_min,
+angle_increment, number of rays), which the LiDAR driver keeps fixed, so they are
+computed once per geometry and reused for every scan; a scan is then a few NumPy
+reductions.
+
+    python lidar_sectors.py --bench           # cost per scan against the LiDAR's scan rate
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+FRONT_DEG = 90  # The front of the robot, found by inspecting RViz2 (see lidar_ring.FRONT_ANGLE)
+
+
+class Sector:
+    """
+    An arc of width_deg degrees centred on center_deg, in the scan's angle convention
+    (counter-clockwise, the front of the robot at FRONT_DEG).
+    """
+
+    def __init__(self, name, center_deg, width_deg):
+        self.name = name
+        self.center = math.radians(center_deg)
+        self.half_width = math.radians(width_deg) / 2
+
+
+DEFAULT_SECTORS = (
+    Sector("front", FRONT_DEG, 30),
+    Sector("front_left", FRONT_DEG + 45, 60),
+    Sector("front_right", FRONT_DEG - 45, 60),
+    Sector("rear", FRONT_DEG + 180, 60),
+)
+
+
+class SectorReading:
+    """
+    min: nearest valid return, near: the percentile-th percentile of the valid returns
+    (lower rank, less sensitive to a single spurious return), points: number of valid returns.
+    min and near are None if the sector has no valid return.
+    """
+
+    def __init__(self, min, near, points):
+        self.min = min
+        self.near = near
+        self.points = points
+
+    def __repr__(self):
+        return f"SectorReading(min={self.min}, near={self.near}, points={self.points})"
+
+
+class SectorAnalyzer:
+    """
+    Per-sector distances for scans. analyze() takes the raw ranges and geometry,
+    analyze_scan() a lidar_ring.Scan.
+    """
+
+    def __init__(self, sectors=DEFAULT_SECTORS, percentile=10.0, max_geometries=4):
+        self.sectors = list(sectors)
+        self.percentile = percentile
+        self.max_geometries = max_geometries
+        self._tables = {}  # (angle_min, angle_increment, rays) -> ray indices per sector
+
+    def indices(self, angle_min, angle_increment, rays):
+        key = (angle_min, angle_increment, rays)
+        tables = self._tables.get(key)
+        if tables is None:
+            angles = angle_min + angle_increment * np.arange(rays)
+            tables = []
+            for sector in self.sectors:
+                # Angle to the sector centre, wrapped to [-pi, pi) so sectors across +-180 degrees work
+                offset = (angles - sector.center + math.pi) % (2 * math.pi) - math.pi
+                tables.append(np.flatnonzero(np.abs(offset) <= sector.half_width))
+            if len(self._tables) >= self.max_geometries:
+                self._tables.clear()
+            self._tables[key] = tables
+        return tables
+
+    def analyze(self, ranges, angle_min, angle_increment, range_min=0.0, range_max=math.inf):
+        """
+        {sector name: SectorReading}. Returns outside [range_min, range_max] (inf, nan,
+        0 for no return) are not valid.
+        """
+        ranges = np.asarray(ranges, dtype=np.float32)
+        valid = np.isfinite(ranges) & (ranges >= range_min) & (ranges <= range_max)
+        readings = {}
+        for sector, index in zip(self.sectors, self.indices(angle_min, angle_increment, len(ranges))):
+            values = ranges[index[valid[index]]]
+            if values.size:
+                # Lower-rank percentile by partial sort, a full np.percentile costs several times more
+                rank = int(self.percentile / 100.0 * (values.size - 1))
+                near = np.partition(values, rank)[rank] if rank else values.min()
+                readings[sector.name] = SectorReading(float(values.min()), float(near), values.size)
+            else:
+                readings[sector.name] = SectorReading(None, None, 0)
+        return readings
+
+    def analyze_scan(self, scan):
+        return self.analyze(scan.ranges, scan.angle_min, scan.angle_increment, scan.range_min, scan.range_max)
+
+
+def bench(rays_list, scans, rate_hz):
+    analyzer = SectorAnalyzer()
+    rng = np.random.default_rng(24)
+    for rays in rays_list:
+        angle_increment = 2 * math.pi / rays
+        ranges = rng.uniform(0.1, 6.0, rays).astype(np.float32)
+        ranges[::37] = np.inf
+        analyzer.analyze(ranges, -math.pi, angle_increment, 0.15, 12.0)  # Builds the tables
+        start = time.perf_counter()
+        for _ in range(scans):
+            analyzer.analyze(ranges, -math.pi, angle_increment, 0.15, 12.0)
+        per_scan = (time.perf_counter() - start) / scans
+        print(f"{rays:>5} rays: {1e6 * per_scan:7.1f} us per scan, "
+              f"{100 * per_scan * rate_hz:.2f}% of a {rate_hz:.0f} Hz scan budget")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LiDAR sector analysis.")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--rays", type=int, nargs="+", default=[360, 720, 1440, 2048])
+    parser.add_argument("--scans", type=int, default=2000)
+    parser.add_argument("--rate-hz", type=float, default=10.0, help="LiDAR scan rate")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.rays, args.scans, args.rate_hz)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
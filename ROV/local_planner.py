@@ -0,0 +1,88 @@
+"""
+Navigation decisions from LiDAR sectors alone, for when the geometry is unambiguous.
+
+The fog server's navigation answer costs a frame upload and a model round trip. When
+the scan plainly shows open space ahead, or a wall ahead with a clear side to turn to,
+the ROV does not need to ask: decide() returns the direction straight away. Everything
+in between (something ahead, but not close) is ambiguous and left to the fog server.
+
+fallback() is the best guess for when the fog server misses its deadline: it always
+returns a direction, and only drives forward when decide() would. With something ahead
+it turns towards the roomier side, or stops.
+
+Directions are the fog server's: W forward, A turn left, S backwards, D turn right,
+E stop. The fog server names the stop answer "STOP"; fog_direction() turns its labels
+into directions move() knows. Readings come from lidar_sectors.SectorAnalyzer.
+"""
+
+FOG_LABELS = {"STOP": "E"}
+
+
+def fog_direction(label):
+    """
+    The move() direction for a fog server navigation label: "STOP" becomes E, and
+    W, A, S, D and E pass through whatever their case.
+    """
+    label = label.strip().upper()
+    return FOG_LABELS.get(label, label)
+
+
+class LocalPlanner:
+    """
+    clear_m: ahead is open if the front arc's nearest return is at least this far, and
+    a side is open if its near distance is. Keep it above the distance one forward move
+    (compmqtt3.py move_forward) covers.
+    blocked_m: ahead is blocked if the front arc's nearest return is closer than this.
+    margin_m: one side must have this much more room than the other to be the clear
+    choice; with less difference between them, turning either way is as good.
+    """
+
+    def __init__(self, clear_m=1.0, blocked_m=0.35, margin_m=0.3):
+        self.clear_m = clear_m
+        self.blocked_m = blocked_m
+        self.margin_m = margin_m
+
+    @staticmethod
+    def _room(reading):
+        # No valid return in an arc means nothing within range there
+        if reading is None or reading.points == 0:
+            return None
+        return reading.near
+
+    def decide(self, readings):
+        """
+        A direction when the scan leaves no doubt, None when the fog server should decide.
+        """
+        front = readings.get("front")
+        if front is None or front.points == 0:
+            return None  # Too few returns ahead to judge
+        if front.min >= self.clear_m:
+            return "W"
+        if front.min >= self.blocked_m:
+            return None  # Something ahead, but not close: the camera knows better what it is
+        return self._turn(readings)
+
+    def _turn(self, readings):
+        left = self._room(readings.get("front_left"))
+        right = self._room(readings.get("front_right"))
+        if left is None or right is None:
+            return None
+        if max(left, right) < self.clear_m:
+            # Boxed in ahead and to both sides: back out if the rear is open
+            rear = self._room(readings.get("rear"))
+            return "S" if rear is not None and rear >= self.clear_m else None
+        if left >= right + self.margin_m:
+            return "A"
+        if right >= left + self.margin_m:
+            return "D"
+        return "A"  # Both sides open alike, either turn will do
+
+    def fallback(self, readings):
+        """
+        A direction for when the fog server did not answer in time, never None.
+        """
+        decision = self.decide(readings)
+        if decision is not None:
+            return decision
+        # Something is ahead within one forward move: never drive at it unseen by the fog server
+        return self._turn(readings) or "E"
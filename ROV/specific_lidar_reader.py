@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
 
-import os
+import time
 import rclpy
 from rclpy.node import Node
+from rclpy.qos import DurabilityPolicy, HistoryPolicy, QoSProfile, ReliabilityPolicy
 from sensor_msgs.msg import LaserScan
-import math
+
+from lidar_ring import LidarRing
+from lidar_sectors import SectorAnalyzer
+
+PRINT_INTERVAL_S = 1.0  # Printing every scan costs more than handing it over
+
+# Sensor data QoS with depth 1: if this node falls behind, scans are dropped, never queued up stale
+SCAN_QOS = QoSProfile(
+    reliability=ReliabilityPolicy.BEST_EFFORT,
+    durability=DurabilityPolicy.VOLATILE,
+    history=HistoryPolicy.KEEP_LAST,
+    depth=1,
+)
 
 class SpecificLidarReader(Node):
     def __init__(self):
@@ -13,22 +26,23 @@ class SpecificLidarReader(Node):
             LaserScan,
             '/scan',
             self.lidar_callback,
-            10)
-        self.latest_distance = None
+            SCAN_QOS)
+        # Every full scan goes into shared memory for compmqtt.py / compmqtt3.py (lidar_ring.py)
+        self.ring = LidarRing.create()
+        self.sectors = SectorAnalyzer()
+        self.last_print = 0.0
 
     def lidar_callback(self, msg):
-        # 90° in radians
-        angle_90_rad = math.radians(90)
-        index = int((angle_90_rad - msg.angle_min) / msg.angle_increment)
-
-        if 0 <= index < len(msg.ranges):
-            distance = msg.ranges[index]
-            if math.isfinite(distance):
-                with open(os.path.expanduser("~/scan_90deg.txt"), "w") as f:
-                    f.write(f"{distance:.2f}")
-                print(f"90° distance written: {distance:.2f}")
-
-        # Do not print anything if no reading
+        scan_seq = self.ring.write(msg.ranges, msg.angle_min, msg.angle_increment, msg.range_min, msg.range_max)
+
+        now = time.monotonic()
+        if now - self.last_print >= PRINT_INTERVAL_S:
+            self.last_print = now
+            readings = self.sectors.analyze(msg.ranges, msg.angle_min, msg.angle_increment,
+                                            msg.range_min, msg.range_max)
+            nearest = ", ".join(f"{name} {reading.min:.2f}" for name, reading in readings.items()
+                                if reading.min is not None)
+            print(f"Scan {scan_seq}: nearest {nearest}")
 
 def main(args=None):
     rclpy.init(args=args)
@@ -0,0 +1,86 @@
+import math
+import re
+
+# ------------------------------
+# Answer sets
+# ------------------------------
+
+# Label -> the spellings the model may start its answer with.
+OBJECTIVE_CHOICES = {
+    "YES": ["Yes", "yes", "YES"],
+    "NO": ["No", "no", "NO"],
+}
+
+NAVCAM_CHOICES = {
+    "W": ["W", "w"],
+    "A": ["A", "a"],
+    "S": ["S", "s"],
+    "D": ["D", "d"],
+    "STOP": ["E", "e"],
+}
+
+
+class AnswerClassifier:
+    """
+    Single-step classifier over a fixed answer set.
+
+    Instead of generating text, read the logits of the next token, keep only the
+    tokens that start one of the allowed answers and softmax over those. A label's
+    probability is the summed probability of its spellings. temperature > 1
+    softens over-confident logits; fit it offline on labelled frames.
+    """
+
+    def __init__(self, tokenizer, choices, temperature=1.0):
+        self.labels = list(choices)
+        self.temperature = temperature
+        self.token_ids = []
+        self.token_labels = []
+        for label, spellings in choices.items():
+            for spelling in spellings:
+                # With and without a leading space, the model may emit either
+                for text in (spelling, " " + spelling):
+                    ids = tokenizer(text, add_special_tokens=False).input_ids
+                    if ids and ids[0] not in self.token_ids:
+                        self.token_ids.append(ids[0])
+                        self.token_labels.append(label)
+
+    def classify(self, logits):
+        """
+        logits: the next-token logits of the allowed tokens, aligned with self.token_ids.
+        Returns (label, confidence, {label: probability}).
+        """
+        scaled = [float(value) / self.temperature for value in logits]
+        peak = max(scaled)
+        mass = dict.fromkeys(self.labels, 0.0)
+        for label, value in zip(self.token_labels, scaled):
+            mass[label] += math.exp(value - peak)
+        total = sum(mass.values())
+        probs = {label: weight / total for label, weight in mass.items()}
+        label = max(probs, key=probs.get)
+        return label, probs[label], probs
+
+    def classify_row(self, row):
+        """
+        Classify from a full-vocabulary logits row (torch tensor or numpy array).
+        """
+        return self.classify(row[self.token_ids].tolist())
+
+
+# ------------------------------
+# Text answers (generate mode)
+# ------------------------------
+
+def parse_choice(text, choices, default):
+    """
+    Find the first whole-word answer from choices in free text.
+    Letters inside other words ("DOWN", "WAIT") do not count.
+    """
+    spelling_to_label = {}
+    for label, spellings in choices.items():
+        for spelling in spellings:
+            spelling_to_label[spelling.upper()] = label
+    pattern = r"\b(" + "|".join(re.escape(s) for s in spelling_to_label) + r")\b"
+    match = re.search(pattern, text.upper())
+    if match is None:
+        return default
+    return spelling_to_label[match.group(1)]
@@ -0,0 +1,110 @@
+"""
+Throughput vs. latency of the micro-batching window in inference_scheduler.
+
+Runs the real InferenceScheduler against a stand-in batch handler whose cost
+grows sub-linearly with batch size (a fixed per-call overhead plus a smaller
+per-frame cost, which is roughly how one generate call behaves on the GPU).
+Frames arrive as a Poisson stream. For each (max_batch_size, max_batch_wait_ms)
+setting it prints achieved throughput, end-to-end latency percentiles and the
+number of dropped frames.
+
+    python bench_batching.py --rate 6 --duration 10
+"""
+import argparse
+import random
+import threading
+import time
+
+from inference_scheduler import InferenceJob, InferenceScheduler
+
+# (max_batch_size, max_batch_wait_ms); the first row is the single-frame path
+WINDOW_SETTINGS = [
+    (1, 0),
+    (2, 0),
+    (4, 0),
+    (4, 25),
+    (4, 100),
+    (8, 50),
+    (8, 200),
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_setting(batch_size, wait_ms, rate, duration, call_ms, frame_ms, deadline_s, seed):
+    latencies = []
+    dropped = []
+    lock = threading.Lock()
+
+    def handler(jobs, replica):
+        time.sleep((call_ms + frame_ms * len(jobs)) / 1000.0)
+        return ["NO"] * len(jobs)
+
+    def on_result(job, result):
+        with lock:
+            latencies.append(time.monotonic() - job.enqueued_at)
+
+    def on_drop(job, reason):
+        with lock:
+            dropped.append(reason)
+
+    scheduler = InferenceScheduler(handler, max_queue=64,
+                                   max_batch_size=batch_size, max_batch_wait_ms=wait_ms)
+    scheduler.start()
+
+    rng = random.Random(seed)
+    start = time.monotonic()
+    submitted = 0
+    while time.monotonic() - start < duration:
+        scheduler.submit(InferenceJob("camera", None, deadline_s, on_result=on_result, on_drop=on_drop))
+        submitted += 1
+        time.sleep(rng.expovariate(rate))
+
+    # Let the queue drain before measuring
+    while scheduler.qsize() and time.monotonic() - start < duration + deadline_s:
+        time.sleep(0.01)
+    time.sleep((call_ms + frame_ms * batch_size) / 1000.0)
+    elapsed = time.monotonic() - start
+    scheduler.stop()
+
+    batches = scheduler.stats["batches"]
+    calls = sum(batches.values())
+    mean_batch = sum(size * count for size, count in batches.items()) / calls if calls else 0.0
+    return {
+        "submitted": submitted,
+        "processed": len(latencies),
+        "dropped": len(dropped),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_batch": mean_batch,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=6.0, help="frames per second offered by the fleet")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per setting")
+    parser.add_argument("--call-ms", type=float, default=250.0, help="fixed cost of one generate call")
+    parser.add_argument("--frame-ms", type=float, default=60.0, help="extra cost per frame in the batch")
+    parser.add_argument("--deadline", type=float, default=5.0, help="per-frame deadline in seconds")
+    parser.add_argument("--seed", type=int, default=24)
+    args = parser.parse_args()
+
+    print(f"Offered load {args.rate:.1f} frames/s, generate cost {args.call_ms:.0f} ms + {args.frame_ms:.0f} ms/frame")
+    print(f"{'batch':>5} {'wait_ms':>7} {'fps':>6} {'p50_ms':>8} {'p95_ms':>8} {'mean_bs':>7} {'dropped':>7}")
+    for batch_size, wait_ms in WINDOW_SETTINGS:
+        r = run_setting(batch_size, wait_ms, args.rate, args.duration,
+                        args.call_ms, args.frame_ms, args.deadline, args.seed)
+        print(f"{batch_size:>5} {wait_ms:>7} {r['throughput']:>6.2f} {r['p50_ms']:>8.0f} "
+              f"{r['p95_ms']:>8.0f} {r['mean_batch']:>7.2f} {r['dropped']:>7}")
+
+
+if __name__ == "__main__":
+    main()
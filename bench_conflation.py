@@ -0,0 +1,122 @@
+"""
+Frame conflation: how fresh are the answers when ROVs stream faster than the model?
+
+Each simulated vehicle publishes a navcam frame every --interval-ms without waiting for
+answers, like compmqtt3.py with frames in flight, through the real fog server message
+path and the stand-in model (standin_backend.py) in device mode. With conflation a new
+frame replaces the vehicle's queued one; without it, frames beyond the vehicle's queue
+slots are refused (a BUSY reply). For both it prints answers per second, how many frames
+were conflated or refused, and the age of each answered frame (capture to answer), which
+is what the ROV acts on.
+
+    python bench_conflation.py --vehicles 1 4 --interval-ms 100 --device-ms 300
+"""
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time
+
+import numpy as np
+
+import frame_protocol
+from bench_decode import synthetic_corpus
+from fleet import vehicle_topic
+from fog_server import FogServer, FogServerConfig, Route
+from fog_tasks import TASKS
+from standin_backend import StandInBackend
+
+NAVCAM_TOPIC = "team24/rov/navcam"
+DETAIL_TOPIC = TASKS["navcam"].detail_topic
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class StreamingVehicle:
+    def __init__(self, vehicle_id, frames, interval_s):
+        self.vehicle_id = vehicle_id
+        self.frames = frames
+        self.interval_s = interval_s
+        self.sent = 0
+        self.ages = []
+
+    def answered(self, detail):
+        if detail["label"] is not None:
+            self.ages.append(time.time() - detail["timestamp"])
+
+    def run(self, server, stop):
+        topic = vehicle_topic(NAVCAM_TOPIC, self.vehicle_id)
+        while not stop.is_set():
+            jpeg = self.frames[self.sent % len(self.frames)]
+            frame = frame_protocol.encode_frame(jpeg, "navcam", 360, 202, self.sent, time.time())
+            server.on_message(server.client, None, Message(topic, frame))
+            self.sent += 1
+            stop.wait(self.interval_s)
+
+
+def run(count, conflate, frames, args):
+    backend = StandInBackend(dim=64, layers=1, device_ms=args.device_ms)
+    config = FogServerConfig(
+        routes=[Route("navcam", NAVCAM_TOPIC, ["navcam"], deadline_s=5.0)],
+        conflate_frames=conflate,
+        max_batch_size=1,
+        result_cache=False,  # The corpus repeats, every frame must reach the model
+    )
+    server = FogServer(config, [backend])
+    backend.load()
+    vehicles = [StreamingVehicle(f"rov{i + 1}", frames, args.interval_ms / 1000.0) for i in range(count)]
+    callbacks = {}
+    for vehicle in vehicles:
+        callbacks[vehicle_topic(DETAIL_TOPIC, vehicle.vehicle_id)] = lambda payload, v=vehicle: v.answered(json.loads(payload))
+
+    def publish(topic, payload=None, *a, **kw):
+        callback = callbacks.get(topic)
+        if callback is not None:
+            callback(payload)
+
+    server.client.publish = publish
+    stop = threading.Event()
+    threads = [threading.Thread(target=vehicle.run, args=(server, stop), daemon=True) for vehicle in vehicles]
+    # The server's debug output would dominate the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.scheduler.start()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        time.sleep(args.device_ms / 1000.0 * (count + 1))  # Let the queue drain
+        server.scheduler.stop()
+    return vehicles, server.scheduler.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--interval-ms", type=float, default=100.0, help="time between a vehicle's frames")
+    parser.add_argument("--device-ms", type=float, default=300.0, help="stand-in model time per call")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    frames = synthetic_corpus(8, width=360, height=202)
+    print(f"frame every {args.interval_ms:.0f} ms per vehicle, model {args.device_ms:.0f} ms/call")
+    print(f"{'vehicles':>8} {'mode':>9} {'sent':>5} {'answers/s':>9} {'conflated':>9} {'refused':>7} "
+          f"{'age p50 ms':>10} {'p95 ms':>7} {'max ms':>7}")
+    for count in args.vehicles:
+        for conflate in (False, True):
+            vehicles, stats = run(count, conflate, frames, args)
+            ages = np.array([age for vehicle in vehicles for age in vehicle.ages] or [0.0]) * 1000
+            print(f"{count:>8} {'conflate' if conflate else 'busy':>9} {sum(v.sent for v in vehicles):>5} "
+                  f"{stats['processed'] / args.seconds:>9.1f} {stats['conflated']:>9} "
+                  f"{stats['rejected']:>7} {np.percentile(ages, 50):>10.0f} "
+                  f"{np.percentile(ages, 95):>7.0f} {ages.max():>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare the original decode path (full-resolution decode, then resize) with
+image_decode.decode_image (DCT-domain reduced decode, then one cheap resize).
+
+    python bench_decode.py --corpus path/to/rov_frames/   # directory of 1280x720 JPEGs
+    python bench_decode.py                                # synthetic 1280x720 corpus
+
+Frames are wrapped in frame_protocol.Frame exactly as the server receives them.
+"""
+import argparse
+import glob
+import io
+import os
+import random
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import image_decode
+from frame_protocol import Frame
+
+IMG_MAX_RES = 360
+
+
+def synthetic_corpus(count, width=1280, height=720, quality=85, seed=24):
+    """
+    ROV-like frames: smooth gradients, blurred blocks and a little noise, so the JPEGs
+    have realistic size and entropy instead of being flat colour.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        draw = ImageDraw.Draw(image)
+        for _ in range(30):
+            x, y = rng.randrange(width), rng.randrange(height)
+            colour = tuple(rng.randrange(256) for _ in range(3))
+            draw.rectangle([x, y, x + rng.randrange(20, 300), y + rng.randrange(20, 200)], fill=colour)
+        image = image.filter(ImageFilter.GaussianBlur(2))
+        noise = Image.effect_noise((width, height), 24).convert("RGB")
+        image = Image.blend(image, noise, 0.15)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality)
+        corpus.append(out.getvalue())
+    return corpus
+
+
+def load_corpus(directory):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.jp*g"))):
+        with open(path, "rb") as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def time_path(decode, corpus, repeat):
+    sizes = set()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in corpus:
+            image = decode(Frame(data, codec="jpeg"), IMG_MAX_RES)
+            sizes.add(image.size)
+    elapsed = time.perf_counter() - start
+    return 1000.0 * elapsed / (repeat * len(corpus)), sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="directory of JPEG frames (default: synthetic 1280x720 frames)")
+    parser.add_argument("--count", type=int, default=20, help="synthetic frames to generate")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.count)
+    if not corpus:
+        raise SystemExit("Empty corpus")
+    avg_kb = sum(len(data) for data in corpus) / len(corpus) / 1024
+    print(f"{len(corpus)} frames, avg {avg_kb:.0f} KB, target {IMG_MAX_RES}px, "
+          f"turbojpeg {'on' if image_decode._turbo is not None else 'off'}")
+
+    full_ms, full_sizes = time_path(image_decode.decode_image_full, corpus, args.repeat)
+    fast_ms, fast_sizes = time_path(image_decode.decode_image, corpus, args.repeat)
+    print(f"full decode + resize : {full_ms:7.2f} ms/frame  -> {sorted(full_sizes)}")
+    print(f"reduced decode       : {fast_ms:7.2f} ms/frame  -> {sorted(fast_sizes)}")
+    print(f"speedup              : {full_ms / fast_ms:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+End-to-end fog server benchmark on one host, with no GPU, model weights or ROV.
+
+Starts the MQTT broker stand-in (mqtt_broker.py) unless --broker is given, and runs the fog
+server's asyncio core (FogServer.serve) with the deterministic stand-in model
+(standin_backend.py) in place of LLaVA, at --device-ms/--frame-ms per call. It then drives
+the server with simulated vehicles. Each vehicle is its own MQTT client on its own vehicle
+topics, and it works in one of two modes:
+
+    open loop (--rate N):    N frames per second whatever the answers, like compmqtt3.py
+                             streaming with frames in flight
+    closed loop (--rate 0):  send a frame, wait for its answer (or --timeout-s), send the
+                             next, like the send-and-wait loop
+
+Frames are synthetic (bench_decode.synthetic_corpus) or recorded JPEGs (--frames DIR).
+Latency is measured on the vehicle, from publishing a frame to receiving its answer on the
+/detail topic. Each run reports throughput, the drop rate (dropped by the server or never
+answered) and latency percentiles, plus the server's p95 per stage. --out writes it all as
+JSON, with the commit and the settings, and --compare prints the change against an earlier
+file, so regressions show up across commits.
+
+    python bench_e2e.py --vehicles 1 4 8 --rate 3 --device-ms 300 --out e2e.json
+    python bench_e2e.py --vehicles 1 4 8 --rate 3 --device-ms 300 --compare e2e.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import subprocess
+import threading
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from PIL import Image
+
+import frame_protocol
+import stage_metrics
+from bench_decode import synthetic_corpus
+from fleet import vehicle_topic
+from fog_server import FogServer, FogServerConfig, Route
+from fog_tasks import TASKS
+from mqtt_broker import start_broker
+from standin_backend import StandInBackend
+
+ROUTES = {
+    "camera": Route("camera", "team24/rov/camera", ["camera"], deadline_s=10.0),
+    "navcam": Route("navcam", "team24/rov/navcam", ["navcam"], deadline_s=5.0),
+    "frame": Route("frame", "team24/rov/frame", ["camera", "navcam"], deadline_s=5.0),
+}
+
+
+def load_frames(directory):
+    """
+    [(jpeg bytes, width, height)] from the .jpg files in directory, or synthetic frames.
+    """
+    if directory is None:
+        return [(jpeg, 360, 202) for jpeg in synthetic_corpus(8, width=360, height=202)]
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".jpg", ".jpeg")):
+            with open(os.path.join(directory, name), "rb") as f:
+                jpeg = f.read()
+            with Image.open(io.BytesIO(jpeg)) as image:
+                frames.append((jpeg, image.width, image.height))
+    if not frames:
+        raise SystemExit(f"No .jpg frames in {directory}")
+    return frames
+
+
+class SimulatedVehicle:
+    """
+    One ROV on its own MQTT client. A frame counts as answered once every task of its
+    route has answered it, and as dropped if the server reported it dropped for any task.
+    """
+
+    def __init__(self, vehicle_id, route, frames, broker):
+        self.vehicle_id = vehicle_id
+        self.route = route
+        self.frames = frames
+        self.topic = vehicle_topic(route.topic, vehicle_id)
+        self.sent = 0
+        self.latencies = []
+        self.dropped = {}
+        self.in_flight = {}  # frame id -> (publish time, tasks still to answer)
+        self._lock = threading.Lock()
+        self._answered = threading.Event()
+        self.client = mqtt.Client(client_id=f"bench-{vehicle_id}")
+        self.client.on_message = self.on_message
+        self.client.connect(*broker)
+        for task in route.tasks:
+            self.client.subscribe(vehicle_topic(TASKS[task].detail_topic, vehicle_id))
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, msg):
+        detail = json.loads(msg.payload)
+        with self._lock:
+            entry = self.in_flight.get(detail["frame_id"])
+            if entry is None:
+                return
+            sent_at, tasks = entry
+            if detail["label"] is None:
+                del self.in_flight[detail["frame_id"]]
+                self.dropped[detail["dropped"]] = self.dropped.get(detail["dropped"], 0) + 1
+            else:
+                tasks.discard(detail["task"])
+                if tasks:
+                    return
+                del self.in_flight[detail["frame_id"]]
+                self.latencies.append(time.monotonic() - sent_at)
+        self._answered.set()
+
+    def send(self):
+        jpeg, width, height = self.frames[self.sent % len(self.frames)]
+        payload = frame_protocol.encode_frame(jpeg, self.route.name, width, height, self.sent, time.time())
+        with self._lock:
+            self.in_flight[self.sent] = (time.monotonic(), set(self.route.tasks))
+        self._answered.clear()
+        self.client.publish(self.topic, payload)
+        self.sent += 1
+
+    def run(self, rate, timeout_s, stop):
+        next_at = time.monotonic()
+        while not stop.is_set():
+            self.send()
+            if rate > 0:
+                next_at += 1.0 / rate
+                stop.wait(max(0.0, next_at - time.monotonic()))
+            elif not self._answered.wait(timeout_s):
+                with self._lock:
+                    self.in_flight.clear()  # Given up on, counted as not answered
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def percentiles_ms(values):
+    values = np.array(values or [0.0]) * 1000.0
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "p99": float(np.percentile(values, 99)), "max": float(values.max()), "mean": float(values.mean())}
+
+
+def run(count, frames, broker, args):
+    config = FogServerConfig(
+        mqtt_broker=broker[0],
+        mqtt_port=broker[1],
+        routes=[ROUTES[args.route]],
+        max_queued_frames=args.max_queue,
+        max_batch_size=args.batch,
+        result_cache=args.result_cache,
+        conflate_frames=not args.no_conflate,
+        stats_interval_s=3600.0,
+        metrics_port=None,
+    )
+    backends = [StandInBackend(f"stand-in-{i}", dim=64, layers=1, device_ms=args.device_ms, frame_ms=args.frame_ms)
+                for i in range(args.replicas)]
+    server = FogServer(config, backends)
+    stage_metrics.metrics.reset()
+    thread = threading.Thread(target=server.run)
+    # The server's debug output would dominate the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread.start()
+        if not server.serving.wait(30.0):
+            raise RuntimeError("Fog server did not start")
+        time.sleep(args.settle_s)  # Subscriptions settled
+        vehicles = [SimulatedVehicle(f"rov{i + 1}", ROUTES[args.route], frames, broker) for i in range(count)]
+        stop = threading.Event()
+        threads = [threading.Thread(target=vehicle.run, args=(args.rate, args.timeout_s, stop), daemon=True)
+                   for vehicle in vehicles]
+        start = time.monotonic()
+        for vehicle_thread in threads:
+            vehicle_thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for vehicle_thread in threads:
+            vehicle_thread.join()
+        elapsed = time.monotonic() - start
+        time.sleep(args.timeout_s)  # Answers to the last frames
+        server.stop()
+        thread.join()
+    for vehicle in vehicles:
+        vehicle.close()
+    return summarize(count, vehicles, elapsed, server.stats())
+
+
+def summarize(count, vehicles, elapsed, stats):
+    sent = sum(vehicle.sent for vehicle in vehicles)
+    latencies = [latency for vehicle in vehicles for latency in vehicle.latencies]
+    dropped = {}
+    for vehicle in vehicles:
+        for reason, n in vehicle.dropped.items():
+            dropped[reason] = dropped.get(reason, 0) + n
+    unanswered = sent - len(latencies) - sum(dropped.values())
+    return {
+        "vehicles": count,
+        "sent": sent,
+        "answered": len(latencies),
+        "dropped": dropped,
+        "unanswered": unanswered,
+        "drop_rate": (sent - len(latencies)) / sent if sent else 0.0,
+        "throughput": len(latencies) / elapsed,
+        "latency_ms": percentiles_ms(latencies),
+        "server_p95_ms": {stage: timing["p95"] * 1000.0 for stage, timing in stats["stages"].items()},
+        "scheduler": {key: value for key, value in stats["scheduler"].items() if isinstance(value, int)},
+    }
+
+
+def commit():
+    try:
+        head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True).stdout.strip()
+        return head + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    with open(path) as f:
+        previous = json.load(f)
+    before = {run["vehicles"]: run for run in previous["runs"]}
+    print(f"against {path} (commit {previous.get('commit')}):")
+    for run in results["runs"]:
+        old = before.get(run["vehicles"])
+        if old is None:
+            continue
+        change = lambda new, base: f"{100.0 * (new - base) / base:+.1f}%" if base else "n/a"
+        print(f"{run['vehicles']:>8} vehicles: throughput {change(run['throughput'], old['throughput'])}, "
+              f"p95 {change(run['latency_ms']['p95'], old['latency_ms']['p95'])}, "
+              f"drop rate {100 * old['drop_rate']:.1f}% -> {100 * run['drop_rate']:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--rate", type=float, default=3.0, help="frames per second per vehicle, 0 = closed loop")
+    parser.add_argument("--route", choices=sorted(ROUTES), default="navcam")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--timeout-s", type=float, default=5.0, help="how long a vehicle waits for an answer")
+    parser.add_argument("--frames", help="directory of recorded .jpg frames (default: synthetic)")
+    parser.add_argument("--device-ms", type=float, default=300.0, help="stand-in model time per call")
+    parser.add_argument("--frame-ms", type=float, default=20.0, help="stand-in model time per frame of a call")
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--no-conflate", action="store_true")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="let the server reuse answers; the frames repeat, so most would hit")
+    parser.add_argument("--broker", help="host:port of an MQTT broker (default: start mqtt_broker.py)")
+    parser.add_argument("--settle-s", type=float, default=0.5, help="wait after the server has started")
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--compare", help="results JSON of an earlier run")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames)
+    process = None
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        broker = (host, int(port))
+    else:
+        process, port = start_broker()
+        broker = ("127.0.0.1", port)
+
+    mode = f"{args.rate:g} frames/s per vehicle" if args.rate > 0 else "closed loop"
+    print(f"{args.route} route, {mode}, model {args.device_ms:.0f} ms/call + {args.frame_ms:.0f} ms/frame, "
+          f"{args.replicas} replica(s), {len(frames)} {'recorded' if args.frames else 'synthetic'} frames")
+    print(f"{'vehicles':>8} {'sent':>6} {'answers/s':>9} {'drop %':>6} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'p99 ms':>7} {'max ms':>7}  dropped")
+    results = {"commit": commit(), "time": datetime.datetime.now().isoformat(timespec="seconds"),
+               "settings": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+               "runs": []}
+    try:
+        for count in args.vehicles:
+            result = run(count, frames, broker, args)
+            results["runs"].append(result)
+            latency = result["latency_ms"]
+            dropped = dict(result["dropped"])
+            if result["unanswered"]:
+                dropped["unanswered"] = result["unanswered"]
+            print(f"{count:>8} {result['sent']:>6} {result['throughput']:>9.2f} {100 * result['drop_rate']:>6.1f} "
+                  f"{latency['p50']:>7.0f} {latency['p95']:>7.0f} {latency['p99']:>7.0f} {latency['max']:>7.0f}  "
+                  f"{dropped or ''}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
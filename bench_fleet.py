@@ -0,0 +1,184 @@
+"""
+Fleet capacity: how many ROVs one fog server sustains at a target cycle time.
+
+Drives the real fog server message path (FogServer.on_message, the fair-share
+InferenceScheduler, handle_batch and the per-vehicle result topics) with simulated
+vehicles and the stand-in model (standin_backend.py) in device mode. Each vehicle runs
+the ROV's closed loop: send a frame on its own topic, wait for its answer, then wait
+out the rest of its cycle before the next frame. For each fleet size it prints answer
+latency percentiles, drops and whether every vehicle kept to the target.
+
+    python bench_fleet.py --vehicles 1 2 4 8 12 16 --target-ms 500
+    python bench_fleet.py --vehicles 4 --flood        # plus one vehicle sending as fast as it can
+
+With --flood, the flooding vehicle's numbers are reported separately; the question is
+whether the well-behaved vehicles still get their answers in time.
+"""
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time
+
+import numpy as np
+
+import frame_protocol
+from bench_decode import synthetic_corpus
+from fleet import vehicle_topic
+from fog_server import FogServer, FogServerConfig, Route
+from fog_tasks import TASKS
+from standin_backend import StandInBackend
+
+CAMERA_TOPIC = "team24/rov/camera"
+DETAIL_TOPIC = TASKS["camera"].detail_topic
+STATUS_TOPIC = FogServerConfig.status_topic
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class Vehicle:
+    """
+    One simulated ROV. The server's publish calls answered() for the JSON answer on this
+    vehicle's detail topic and ready() for READY on its status topic, which the server
+    publishes once the vehicle has no frame left in flight, answered or dropped.
+    """
+
+    def __init__(self, vehicle_id, frames, cycle_s, answer_timeout_s):
+        self.vehicle_id = vehicle_id
+        self.frames = frames
+        self.cycle_s = cycle_s
+        self.answer_timeout_s = answer_timeout_s
+        self.latencies = []
+        self.dropped = 0
+        self.timeouts = 0
+        self.answers = 0
+        self._done = threading.Event()
+
+    def answered(self, detail):
+        if "dropped" not in detail:
+            self.answers += 1
+
+    def ready(self):
+        self._done.set()
+
+    def run(self, server, stop):
+        topic = vehicle_topic(CAMERA_TOPIC, self.vehicle_id)
+        sent = 0
+        while not stop.is_set():
+            start = time.monotonic()
+            self._done.clear()
+            answers = self.answers
+            server.on_message(server.client, None, Message(topic, self.frames[sent % len(self.frames)]))
+            sent += 1
+            if not self._done.wait(self.answer_timeout_s):
+                self.timeouts += 1
+            elif self.answers > answers:
+                self.latencies.append(time.monotonic() - start)
+            else:
+                self.dropped += 1
+            stop.wait(max(0.0, start + self.cycle_s - time.monotonic()))
+
+
+def run(count, frames, args):
+    backend = StandInBackend(dim=64, layers=1, device_ms=args.device_ms, frame_ms=args.frame_ms)
+    config = FogServerConfig(
+        routes=[Route("camera", CAMERA_TOPIC, ["camera"], deadline_s=args.target_ms / 1000.0)],
+        max_queued_frames=args.max_queue,
+        max_queued_per_vehicle=args.max_queue_per_vehicle,
+        fair_share=not args.fifo,
+        max_batch_size=args.batch,
+        result_cache=False,  # The corpus repeats, every frame must reach the model
+    )
+    server = FogServer(config, [backend])
+    backend.load()
+
+    vehicles = [Vehicle(f"rov{i + 1}", frames, args.target_ms / 1000.0, 4 * args.target_ms / 1000.0)
+                for i in range(count)]
+    flooder = None
+    if args.flood:
+        # Sends every 5 ms without waiting for answers
+        flooder = Vehicle("flooder", frames, 0.005, 0.0)
+    callbacks = {}
+    for vehicle in vehicles + ([flooder] if flooder else []):
+        callbacks[vehicle_topic(DETAIL_TOPIC, vehicle.vehicle_id)] = lambda payload, v=vehicle: v.answered(json.loads(payload))
+        callbacks[vehicle_topic(STATUS_TOPIC, vehicle.vehicle_id)] = (
+            lambda payload, v=vehicle: v.ready() if payload == "READY" else None)
+
+    def publish(topic, payload=None, *a, **kw):
+        callback = callbacks.get(topic)
+        if callback is not None:
+            callback(payload)
+
+    server.client.publish = publish
+    stop = threading.Event()
+    threads = [threading.Thread(target=vehicle.run, args=(server, stop), daemon=True)
+               for vehicle in vehicles + ([flooder] if flooder else [])]
+    # The server's debug output would dominate the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.scheduler.start()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        server.scheduler.stop()
+    return vehicles, flooder
+
+
+def summarize(vehicles, target_s):
+    latencies = np.array([latency for vehicle in vehicles for latency in vehicle.latencies] or [0.0])
+    dropped = sum(vehicle.dropped + vehicle.timeouts for vehicle in vehicles)
+    worst_p95 = max((np.percentile(vehicle.latencies, 95) if vehicle.latencies else float("inf"))
+                    for vehicle in vehicles)
+    return {
+        "answers": sum(len(vehicle.latencies) for vehicle in vehicles),
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "max": float(latencies.max()),
+        "dropped": dropped,
+        "ok": dropped == 0 and worst_p95 <= target_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[1, 2, 4, 6, 8, 12, 16])
+    parser.add_argument("--target-ms", type=float, default=500.0, help="cycle time every vehicle should keep")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--device-ms", type=float, default=30.0, help="stand-in model time per call")
+    parser.add_argument("--frame-ms", type=float, default=10.0, help="stand-in model time per frame of a call")
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=32, help="server max_queued_frames, at least one per vehicle")
+    parser.add_argument("--max-queue-per-vehicle", type=int, default=2)
+    parser.add_argument("--fifo", action="store_true", help="first come first served instead of fair share")
+    parser.add_argument("--flood", action="store_true", help="add a vehicle that sends frames back to back")
+    args = parser.parse_args()
+
+    frames = [frame_protocol.encode_frame(jpeg, "camera", 360, 202, i, time.time())
+              for i, jpeg in enumerate(synthetic_corpus(8, width=360, height=202))]
+    target_s = args.target_ms / 1000.0
+    print(f"target cycle {args.target_ms:.0f} ms, model {args.device_ms:.0f} ms/call + {args.frame_ms:.0f} ms/frame, "
+          f"batch {args.batch}, {'FIFO' if args.fifo else 'fair share'}{', with flooder' if args.flood else ''}")
+    print(f"{'vehicles':>8} {'answers/s':>9} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7} {'dropped':>7}  target")
+    sustained = 0
+    for count in args.vehicles:
+        vehicles, flooder = run(count, frames, args)
+        result = summarize(vehicles, target_s)
+        print(f"{count:>8} {result['answers'] / args.seconds:>9.1f} {result['p50'] * 1000:>7.0f} "
+              f"{result['p95'] * 1000:>7.0f} {result['max'] * 1000:>7.0f} {result['dropped']:>7}  "
+              f"{'met' if result['ok'] else 'missed'}")
+        if flooder is not None:
+            print(f"{'flooder':>8} {flooder.answers / args.seconds:>9.1f}  (answers/s to the flooding vehicle)")
+        if result["ok"]:
+            sustained = max(sustained, count)
+    print(f"capacity: {sustained} vehicles at a {args.target_ms:.0f} ms cycle")
+
+
+if __name__ == "__main__":
+    main()
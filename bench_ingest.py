@@ -0,0 +1,140 @@
+"""
+Ingest under load: does receiving frames ever wait for the model?
+
+Runs the fog server's asyncio core (FogServer.serve) against an MQTT broker (by default
+the stand-in from mqtt_broker.py, started for the run) with a slow
+stand-in model (standin_backend.py, device mode), then publishes binary frames from
+several vehicles at increasing rates. For every frame the server receives it records how
+long on_message held the event loop and how long the frame took from publish to
+on_message. If ingest blocked on inference, both would grow towards the model time; with
+the bounded queues they stay flat, and the excess is dropped with a reason instead.
+
+    python bench_ingest.py --rates 50 200 1000 2000
+    python bench_ingest.py --broker localhost:1883          # against Mosquitto
+"""
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import frame_protocol
+from bench_decode import synthetic_corpus
+from fleet import vehicle_topic
+from fog_server import FogServer, FogServerConfig, Route
+from mqtt_broker import start_broker
+from standin_backend import StandInBackend
+
+CAMERA_TOPIC = "team24/rov/camera"
+
+
+class TimedIngest:
+    """
+    Wraps the server's on_message, which the event loop calls as the MQTT socket is read.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.hold_s = []
+        self.delay_s = []
+
+    def __call__(self, client, userdata, msg):
+        start = time.perf_counter()
+        self.server.on_message(client, userdata, msg)
+        self.hold_s.append(time.perf_counter() - start)
+        self.delay_s.append(time.time() - frame_protocol.decode_frame(msg.payload).timestamp)
+
+
+def publish_at(client, frames, vehicles, rate, seconds):
+    interval = 1.0 / rate
+    topics = [vehicle_topic(CAMERA_TOPIC, f"rov{i + 1}") for i in range(vehicles)]
+    next_at = time.monotonic()
+    end = next_at + seconds
+    sent = 0
+    while time.monotonic() < end:
+        jpeg = frames[sent % len(frames)]
+        # Stamped at publish time, so the receive delay covers the broker hop and ingest
+        client.publish(topics[sent % vehicles], frame_protocol.encode_frame(jpeg, "camera", 360, 202, sent, time.time()))
+        sent += 1
+        next_at += interval
+        time.sleep(max(0.0, next_at - time.monotonic()))
+    return sent
+
+
+def run(rate, frames, broker, args):
+    host, port = broker
+    config = FogServerConfig(
+        mqtt_broker=host,
+        mqtt_port=port,
+        metrics_port=None,
+        routes=[Route("camera", CAMERA_TOPIC, ["camera"], deadline_s=5.0)],
+        result_cache=False,  # The corpus repeats, every frame must reach the model
+        stats_interval_s=3600.0,
+    )
+    server = FogServer(config, [StandInBackend(dim=64, layers=1, device_ms=args.device_ms)])
+    ingest = TimedIngest(server)
+    server.client.on_message = ingest
+    thread = threading.Thread(target=server.run)
+
+    rov = mqtt.Client()
+    rov.connect(host, port)
+    rov.loop_start()
+    # The server's debug output would dominate the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread.start()
+        server.serving.wait(30.0)
+        time.sleep(0.5)  # Subscriptions settled
+        sent = publish_at(rov, frames, args.vehicles, rate, args.seconds)
+        time.sleep(0.5)
+        server.stop()
+        thread.join()
+    rov.loop_stop()
+    rov.disconnect()
+    return sent, ingest, server.stats()
+
+
+def report(rate, sent, ingest, stats):
+    hold = np.array(ingest.hold_s or [0.0]) * 1e6
+    delay = np.array(ingest.delay_s or [0.0]) * 1e3
+    scheduler = stats["scheduler"]
+    dropped = (scheduler["rejected"] + scheduler["evicted"] + scheduler["expired"] + scheduler["conflated"]
+               + scheduler["failed"] + stats["core"]["ingest_dropped"])
+    print(f"{rate:>7.0f} {sent:>6} {len(ingest.hold_s):>8} {np.percentile(hold, 50):>11.0f} "
+          f"{np.percentile(hold, 99):>7.0f} {hold.max():>7.0f} {np.percentile(delay, 50):>12.1f} "
+          f"{np.percentile(delay, 99):>7.1f} {delay.max():>7.1f} {scheduler['processed']:>8} {dropped:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--broker", help="host:port of an MQTT broker (default: start mqtt_broker.py)")
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 200, 1000, 2000], help="frames per second")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--vehicles", type=int, default=8)
+    parser.add_argument("--device-ms", type=float, default=300.0, help="stand-in model time per call")
+    args = parser.parse_args()
+
+    frames = synthetic_corpus(8, width=360, height=202)
+    print(f"model {args.device_ms:.0f} ms/call, {args.vehicles} vehicles")
+    print(f"{'rate/s':>7} {'sent':>6} {'received':>8} {'hold p50 us':>11} {'p99 us':>7} {'max us':>7} "
+          f"{'delay p50 ms':>12} {'p99 ms':>7} {'max ms':>7} {'answered':>8} {'dropped':>7}")
+    process = None
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        broker = (host, int(port))
+    else:
+        process, port = start_broker()
+        broker = ("127.0.0.1", port)
+    try:
+        for rate in args.rates:
+            report(rate, *run(rate, frames, broker, args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
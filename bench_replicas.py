@@ -0,0 +1,120 @@
+"""
+Throughput scaling of the inference worker pool with the number of model replicas.
+
+Runs the real fog server ingestion and scheduling path (FogServer.handle_batch on
+the InferenceScheduler) with N replicas of the stand-in model (standin_backend.py)
+against a saturated queue of synthetic frames. For each replica count it prints
+frames/s, speedup over one replica, scaling efficiency and per-replica utilization.
+
+    python bench_replicas.py --mode process --replicas 1 2 4   # CPU compute, one process per replica
+    python bench_replicas.py --mode thread                       # replicas as threads in this process
+    python bench_replicas.py --mode device --device-ms 40        # accelerator time stood in by a sleep
+
+The compute modes need at least as many free cores as replicas to scale.
+"""
+import os
+
+# One BLAS thread per replica, otherwise a single replica already spreads over every core
+for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import argparse
+import contextlib
+import functools
+import io
+import threading
+import time
+
+import frame_protocol
+from bench_decode import synthetic_corpus
+from fog_server import FogServer, FogServerConfig, Route
+from inference_scheduler import InferenceJob
+from process_replica import ProcessReplica
+from standin_backend import StandInBackend
+
+
+def make_replicas(mode, count, args):
+    if mode == "device":
+        # Little CPU work, most of the time is "on the device" where the thread holds no CPU
+        factory = functools.partial(StandInBackend, dim=64, layers=1, device_ms=args.device_ms)
+    else:
+        factory = functools.partial(StandInBackend, dim=args.dim, layers=args.layers)
+    if mode == "process":
+        return [ProcessReplica(factory, name=f"process-{i}") for i in range(count)]
+    return [factory(name=f"{mode}-{i}") for i in range(count)]
+
+
+def run(mode, count, frames, args):
+    replicas = make_replicas(mode, count, args)
+    config = FogServerConfig(
+        routes=[Route("camera", "bench/camera", ["camera"], deadline_s=60.0)],
+        max_queued_frames=4 * count,
+        max_batch_size=1,
+        result_cache=False,  # The corpus repeats, every frame must reach a replica
+    )
+    server = FogServer(config, replicas)
+    for replica in replicas:
+        replica.load()
+
+    finished = []
+    lock = threading.Lock()
+
+    def on_result(job, result):
+        with lock:
+            finished.append(time.monotonic())
+
+    scheduler = server.scheduler
+    # The server's debug output would dominate the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.start()
+        start = time.monotonic()
+        submitted = 0
+        while time.monotonic() - start < args.seconds:
+            if scheduler.qsize() < 2 * count:
+                frame = frames[submitted % len(frames)]
+                scheduler.submit(InferenceJob("camera", frame, 60.0, on_result=on_result))
+                submitted += 1
+            else:
+                time.sleep(0.001)
+        report = scheduler.replica_report()
+        scheduler.stop()
+    for replica in replicas:
+        if hasattr(replica, "close"):
+            replica.close()
+
+    window_start = start + args.warmup
+    window_end = start + args.seconds
+    measured = [t for t in finished if window_start <= t <= window_end]
+    return len(measured) / (window_end - window_start), report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=["process", "thread", "device"], default="process")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=6.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--dim", type=int, default=1024, help="stand-in layer width (compute modes)")
+    parser.add_argument("--layers", type=int, default=24, help="stand-in layer count (compute modes)")
+    parser.add_argument("--device-ms", type=float, default=40.0, help="stand-in accelerator time per call (device mode)")
+    args = parser.parse_args()
+
+    # Frames at the size ROVs send once they have the capabilities message
+    frames = [
+        frame_protocol.decode_frame(frame_protocol.encode_frame(jpeg, "camera", 360, 202, i, time.time()))
+        for i, jpeg in enumerate(synthetic_corpus(8, width=360, height=202))
+    ]
+    print(f"mode {args.mode}, {os.cpu_count()} CPU cores")
+    print(f"{'replicas':>8} {'frames/s':>9} {'speedup':>8} {'efficiency':>10}  utilization")
+    baseline = None
+    for count in args.replicas:
+        fps, report = run(args.mode, count, frames, args)
+        if baseline is None:
+            baseline = fps / count
+        speedup = fps / baseline
+        utilization = " ".join(f"{entry['utilization']:.0%}" for entry in report)
+        print(f"{count:>8} {fps:>9.1f} {speedup:>7.2f}x {speedup / count:>10.0%}  {utilization}")
+
+
+if __name__ == "__main__":
+    main()
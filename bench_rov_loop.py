@@ -0,0 +1,396 @@
+"""
+Where the ROV control loop (ROV/compmqtt3.py) spends its time, simulated on one host with
+no robot, camera, LiDAR or GPU.
+
+compmqtt3.py runs unchanged except for its settings and its hardware. gpiozero is replaced
+by motor pins that do nothing, and the camera by the synthetic test pattern
+(USE_SYNTHETIC_CAMERA). The LiDAR is replaced by synthetic scans in a temporary ring
+(lidar_ring.SyntheticScanSource), with the obstacle ahead held at --obstacle-m. The ROV's
+MQTT client talks to a fog server in the same process: a frame reaches
+FogServer.on_message --upload-ms after it is published, and the server's messages go
+straight back to the ROV's on_message. The server answers with the stand-in model
+(standin_backend.py) at --device-ms per call. The object is never found, so the ROV keeps
+exploring for the whole run.
+
+--loop picks the loops to run, one process each:
+
+    baseline:    the loop as it was before it waited on MQTT events (sleep 1 s after each
+                 frame, poll FOG_AI_BUSY once a second, poll the LiDAR reader's text file),
+                 run on the same script, simulated server and LiDAR
+    sequential:  the send-and-wait loop (PIPELINED = False)
+    pipelined:   frames in flight while the ROV moves (PIPELINED = True)
+
+A cycle is one move the loop carries out. Each cycle's time is split into:
+
+    server:  the server has a frame, from sending it until AI_Status is READY again
+    motion:  inside the motor functions
+    idle:    neither, the loop is waiting on nothing useful
+
+In the pipelined loop the server works while the ROV moves, so server + motion can add up
+to more than the cycle. To compare against another version of compmqtt3.py (one that reads
+the LiDAR through lidar_ring.py), check it out to a file and pass it as --script.
+
+    python bench_rov_loop.py                              # baseline and sequential
+    python bench_rov_loop.py --shared
+    python bench_rov_loop.py --loop pipelined --local-planner
+"""
+import argparse
+import functools
+import io
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import paho.mqtt.client as mqtt
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROV_DIR = os.path.join(HERE, "ROV")
+sys.path.append(ROV_DIR)  # After this directory: the fog server's modules come first
+
+from fog_server import FogServer, FogServerConfig, Route
+from standin_backend import StandInBackend
+
+import lidar_ring
+
+ROUTES = [
+    Route("camera", "team24/rov/camera", ["camera"], deadline_s=10.0),
+    Route("navcam", "team24/rov/navcam", ["navcam"], deadline_s=10.0),
+    Route("frame", "team24/rov/frame", ["camera", "navcam"], deadline_s=10.0),
+]
+MOTOR_FUNCTIONS = ("move_forward", "move_backward", "rotate_left", "rotate_right")
+
+
+class NeverFound(StandInBackend):
+    """
+    The stand-in model, except that the goal object is never in sight.
+    """
+
+    def answer(self, task, hidden):
+        if task.name == "camera":
+            return "NO", 0.9
+        return super().answer(task, hidden)
+
+
+class Timeline:
+    """
+    Wall time per activity, and the time with no activity running at all.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._since = {}
+        self.totals = {}
+        self.idle_s = 0.0
+        self._idle_since = time.monotonic()
+
+    def set(self, name, active):
+        now = time.monotonic()
+        with self._lock:
+            if active == (name in self._since):
+                return
+            if active:
+                if not self._since:
+                    self.idle_s += now - self._idle_since
+                self._since[name] = now
+            else:
+                self.totals[name] = self.totals.get(name, 0.0) + now - self._since.pop(name)
+                if not self._since:
+                    self._idle_since = now
+
+    def close(self):
+        for name in list(self._since):
+            self.set(name, False)
+        with self._lock:
+            self.idle_s += time.monotonic() - self._idle_since
+            self._idle_since = time.monotonic()
+
+
+class Link:
+    """
+    One direction of the simulated network: messages arrive delay_s after they are sent,
+    in the order they were sent.
+    """
+
+    def __init__(self, deliver, delay_s=0.0):
+        self.deliver = deliver
+        self.delay_s = delay_s
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="link", daemon=True).start()
+
+    def send(self, topic, payload):
+        self._queue.put((time.monotonic() + self.delay_s, topic, payload))
+
+    def _run(self):
+        while True:
+            due, topic, payload = self._queue.get()
+            time.sleep(max(0.0, due - time.monotonic()))
+            self.deliver(topic, payload)
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload if isinstance(payload, bytes) else str(payload).encode()
+
+
+def fake_gpiozero():
+    class Device:
+        def __init__(self, *args, **kwargs):
+            self.value = 0
+
+        def on(self):
+            pass
+
+        def off(self):
+            pass
+
+    module = types.ModuleType("gpiozero")
+    module.OutputDevice = module.PWMOutputDevice = Device
+    return module
+
+
+def fake_mqtt_client(send):
+    class Client:
+        """
+        Just enough of paho's Client for compmqtt3.py, publishing with send(topic, payload).
+        """
+
+        def __init__(self, *args, **kwargs):
+            self.on_connect = self.on_message = None
+
+        def username_pw_set(self, *args):
+            pass
+
+        def connect(self, *args):
+            pass
+
+        def subscribe(self, *args):
+            pass
+
+        def loop_forever(self):
+            pass
+
+        def publish(self, topic, payload, *args, **kwargs):
+            send(topic, payload)
+
+    return Client
+
+
+def load_script(path, settings, code=None):
+    """
+    Run the ROV script as module compmqtt3, with each NAME = value line in settings
+    replaced by the value, and in code by the expression given as source. It starts its
+    control loop and returns (loop_forever() returns at once).
+    """
+    with open(path) as f:
+        source = f.read()
+    replacements = {name: repr(value) for name, value in settings.items()}
+    replacements.update(code or {})
+    for name, value in replacements.items():
+        source, count = re.subn(rf"^{name} = .*$", f"{name} = {value}", source, count=1, flags=re.M)
+        if not count:
+            raise SystemExit(f"{path} has no {name} setting")
+    module = types.ModuleType("compmqtt3")
+    module.__file__ = path
+    exec(compile(source, path, "exec"), module.__dict__)
+    return module
+
+
+# -----------------------------------------
+# The loop before it waited on MQTT events
+# -----------------------------------------
+
+def polled_distance(scan_file):
+    # The LiDAR reader node used to write the distance ahead to a text file
+    try:
+        with open(scan_file, "r") as f:
+            return float(f.read().strip())
+    except Exception:
+        return None
+
+
+def sleep_polling_safe_distance(rov, scan_file, threshold=0.2):
+    while True:
+        distance = polled_distance(scan_file)
+        if distance is not None:
+            if distance < threshold:
+                rov.move_backward(speed=0.5, duration=0.3)
+                return False
+            return True
+        time.sleep(0.1)
+
+
+def sleep_polling_loop(rov):
+    """
+    compmqtt3.py's main_thread as it was before it waited on MQTT events: sleep 1 s after
+    sending each frame, then poll FOG_AI_BUSY once a second. It runs on the loaded
+    script's state and functions.
+    """
+    while True:
+        if not rov.FOG_RESULT and not rov.FOG_AI_BUSY and rov.SHARED_FRAME_MODE:
+            rov.capture_and_send_image_shared()
+            time.sleep(1)
+            while rov.FOG_AI_BUSY:
+                time.sleep(1)
+            if rov.FOG_RESULT:
+                continue
+            rov.execute_navdir()
+        elif not rov.FOG_RESULT and not rov.FOG_AI_BUSY:
+            rov.capture_and_send_image_object()
+            time.sleep(1)
+            while rov.FOG_AI_BUSY:
+                time.sleep(1)
+            rov.capture_and_send_image_navigation()
+            time.sleep(1)
+            while rov.FOG_AI_BUSY:
+                time.sleep(1)
+            rov.execute_navdir()
+        else:
+            time.sleep(1)
+
+
+def write_scan_file(source, scan_file):
+    interval = 1.0 / source.rate_hz
+    while True:
+        with open(scan_file, "w") as f:
+            f.write(f"{source.obstacle_distance():.2f}")
+        time.sleep(interval)
+
+
+# -----------------------------------------
+# Simulated run
+# -----------------------------------------
+
+def run(args, loop):
+    """
+    One simulated run of the given loop, reported on the real stdout.
+    """
+    backend = NeverFound(dim=64, layers=1, device_ms=args.device_ms)
+    server = FogServer(FogServerConfig(routes=ROUTES, result_cache=False), [backend])
+    backend.load()
+    server.lifecycle = "READY"
+    server.scheduler.start()
+
+    timeline = Timeline()
+    rov = {}
+
+    def to_rov(topic, payload):
+        if topic == server.config.status_topic and payload == "READY":
+            timeline.set("server", False)
+        rov["on_message"](None, None, Message(topic, payload))
+
+    def to_server(topic, payload):
+        server.on_message(server.client, None, Message(topic, payload))
+
+    downlink, uplink = Link(to_rov), Link(to_server, args.upload_ms / 1000.0)
+    server.client.publish = lambda topic, payload=None, *a, **k: downlink.send(topic, payload)
+
+    def upload(topic, payload):
+        timeline.set("server", True)
+        uplink.send(topic, payload)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        ring_path = os.path.join(scratch, "lidar")
+        source = lidar_ring.SyntheticScanSource(far_m=args.obstacle_m, near_m=args.obstacle_m)
+        threading.Thread(target=source.run, args=(lidar_ring.LidarRing.create(ring_path),), daemon=True).start()
+        lidar_ring.RingReader = functools.partial(lidar_ring.RingReader, ring_path)
+        sys.modules["gpiozero"] = fake_gpiozero()
+        mqtt.Client = fake_mqtt_client(upload)
+
+        settings = {"USE_SYNTHETIC_CAMERA": True, "PIPELINED": loop == "pipelined",
+                    "SHARED_FRAME_MODE": args.shared}
+        if loop == "pipelined":
+            settings.update(LOCAL_PLANNER=args.local_planner, PIPELINE_DEPTH=args.depth)
+        # The baseline loop is started below, once the script is loaded
+        code = {"main_loop": "lambda: None"} if loop == "baseline" else None
+        # The script's and the server's output would drown the report, and the script's
+        # threads cannot be stopped: keep it all out of sight until the process exits
+        sys.stdout = io.StringIO()
+        rov_script = load_script(args.script, settings, code)
+        rov["on_message"] = rov_script.on_message
+
+        def timed(function):
+            @functools.wraps(function)
+            def motion(*a, **k):
+                timeline.set("motion", True)
+                try:
+                    return function(*a, **k)
+                finally:
+                    timeline.set("motion", False)
+            return motion
+
+        for name in MOTOR_FUNCTIONS:
+            setattr(rov_script, name, timed(getattr(rov_script, name)))
+        cycles = [0]
+        _move = rov_script.move
+
+        def move(direction):
+            cycles[0] += 1
+            _move(direction)
+
+        rov_script.move = move
+
+        if loop == "baseline":
+            scan_file = os.path.join(scratch, "scan_90deg.txt")
+            threading.Thread(target=write_scan_file, args=(source, scan_file), daemon=True).start()
+            rov_script.wait_for_safe_90_distance = functools.partial(sleep_polling_safe_distance, rov_script, scan_file)
+            threading.Thread(target=sleep_polling_loop, args=(rov_script,), daemon=True).start()
+
+        start = time.monotonic()
+        time.sleep(args.seconds)
+        wall = time.monotonic() - start
+        timeline.close()
+        stats = server.scheduler.snapshot()
+
+    report = sys.__stdout__
+    mode = f"{loop} loop, {'shared' if args.shared else 'split'} frames"
+    if loop == "pipelined":
+        mode += f", depth {args.depth}" + (", local planner" if args.local_planner else "")
+    print(mode, file=report)
+    count = cycles[0]
+    if not count:
+        print(f"  no moves in {wall:.0f} s", file=report)
+        return
+    per_cycle = {name: timeline.totals.get(name, 0.0) / count for name in ("server", "motion")}
+    print(f"  {count} cycles in {wall:.0f} s, {wall / count:.2f} s/cycle: server {per_cycle['server']:.2f} s, "
+          f"motion {per_cycle['motion']:.2f} s, idle {timeline.idle_s / count:.2f} s per cycle", file=report)
+    print(f"  {stats['processed']} frames answered, {stats['expired']} expired", file=report)
+    if loop == "pipelined":
+        print(f"  decisions: {rov_script.nav_decisions}", file=report)
+    report.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--loop", nargs="+", choices=["baseline", "sequential", "pipelined"],
+                        default=["baseline", "sequential"])
+    parser.add_argument("--shared", action="store_true", help="one frame answers both questions (SHARED_FRAME_MODE)")
+    parser.add_argument("--local-planner", action="store_true", help="pipelined loop: decide from the LiDAR when it can")
+    parser.add_argument("--depth", type=int, default=2, help="pipelined loop: frames in flight")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--device-ms", type=float, default=300.0, help="stand-in model time per call")
+    parser.add_argument("--upload-ms", type=float, default=50.0, help="time for a frame to reach the server")
+    parser.add_argument("--obstacle-m", type=float, default=0.6,
+                        help="distance to the obstacle ahead; 0.35-1.0 m leaves the direction to the server")
+    parser.add_argument("--script", default=os.path.join(ROV_DIR, "compmqtt3.py"))
+    args = parser.parse_args()
+
+    print(f"model {args.device_ms:.0f} ms/call, upload {args.upload_ms:.0f} ms, obstacle at {args.obstacle_m:.2f} m, "
+          f"{args.seconds:.0f} s per run")
+    sys.stdout.flush()
+    # One process per run: the script's threads cannot be stopped, and it is loaded fresh each time
+    context = multiprocessing.get_context("spawn")
+    for loop in args.loop:
+        process = context.Process(target=run, args=(args, loop))
+        process.start()
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import threading
+import time
+
+# ------------------------------
+# Vehicle topics
+# ------------------------------
+
+# Vehicle id for ROVs on the original, un-namespaced topics (team24/rov/camera, team24/fog/result, ...)
+DEFAULT_VEHICLE = "rov"
+
+# The vehicle id goes in as the third topic level:
+# team24/rov/camera -> team24/rov/<vehicle>/camera, team24/fog/result/detail -> team24/fog/<vehicle>/result/detail
+NAMESPACE_LEVEL = 2
+
+
+def vehicle_topic(topic, vehicle_id):
+    """
+    The per-vehicle version of a topic. The default vehicle keeps the original topic.
+    vehicle_topic(topic, "+") is the subscription wildcard for every vehicle.
+    """
+    if vehicle_id == DEFAULT_VEHICLE:
+        return topic
+    levels = topic.split("/")
+    return "/".join(levels[:NAMESPACE_LEVEL] + [vehicle_id] + levels[NAMESPACE_LEVEL:])
+
+
+def split_vehicle_topic(topic, base_topics):
+    """
+    Match a received topic against the un-namespaced base topics.
+    Returns (vehicle id, base topic), or (None, None) if it is none of them.
+    """
+    if topic in base_topics:
+        return DEFAULT_VEHICLE, topic
+    levels = topic.split("/")
+    if len(levels) > NAMESPACE_LEVEL:
+        vehicle_id = levels[NAMESPACE_LEVEL]
+        base = "/".join(levels[:NAMESPACE_LEVEL] + levels[NAMESPACE_LEVEL + 1:])
+        if base in base_topics and vehicle_id and vehicle_id not in "+#":
+            return vehicle_id, base
+    return None, None
+
+
+# ------------------------------
+# Sessions
+# ------------------------------
+
+class VehicleSession:
+    """
+    Everything the fog server keeps per vehicle: its objective, its latest answer per
+    task, frames in flight and counters. objective None means "use the fleet-wide
+    objective" (the one received on the un-namespaced objective topic).
+    """
+
+    def __init__(self, vehicle_id):
+        self.vehicle_id = vehicle_id
+        self.objective = None
+        self.last_results = {}  # task -> {"label": ..., "confidence": ..., "at": time.time()}
+        self.pending = 0
+        self.last_seen = None
+        self.stats = {"frames": 0, "answered": 0, "dropped": {}, "max_latency": 0.0, "total_latency": 0.0}
+        self._lock = threading.Lock()
+
+    def received(self):
+        with self._lock:
+            self.last_seen = time.time()
+            self.stats["frames"] += 1
+            self.pending += 1
+
+    def finished(self, latency, results=None):
+        """
+        Record an answered job, results being {task name: (label, confidence)}.
+        Returns the number of this vehicle's frames still in flight.
+        """
+        with self._lock:
+            self.pending -= 1
+            self.stats["answered"] += 1
+            self.stats["total_latency"] += latency
+            self.stats["max_latency"] = max(self.stats["max_latency"], latency)
+            for task_name, answer in (results or {}).items():
+                label, confidence = answer
+                self.last_results[task_name] = {"label": label, "confidence": confidence, "at": time.time()}
+            return self.pending
+
+    def dropped(self, reason):
+        with self._lock:
+            self.pending -= 1
+            self.stats["dropped"][reason] = self.stats["dropped"].get(reason, 0) + 1
+            return self.pending
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats, dropped=dict(self.stats["dropped"]))
+            total_latency = stats.pop("total_latency")
+            stats["mean_latency"] = total_latency / stats["answered"] if stats["answered"] else 0.0
+            return {
+                "objective": self.objective,
+                "pending": self.pending,
+                "last_seen": self.last_seen,
+                "last_results": dict(self.last_results),
+                "stats": stats,
+            }
@@ -0,0 +1,824 @@
+import asyncio
+import io
+import json
+import signal
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from PIL import Image
+
+from inference_scheduler import InferenceJob, InferenceScheduler
+import frame_protocol
+import image_decode
+from result_cache import ResultCache, dhash
+from fog_tasks import TASKS
+from fleet import DEFAULT_VEHICLE, VehicleSession, vehicle_topic, split_vehicle_topic
+from mqtt_asyncio import AsyncioMqttLoop
+import stage_metrics
+
+# ------------------------------
+# Configuration
+# ------------------------------
+
+class Route:
+    """
+    An input topic and the tasks every frame published on it is answered for.
+    A frame routed to several tasks is decoded, preprocessed and prefilled once and
+    answered for each task from the same vision pass.
+    name is the scheduler task class (see inference_scheduler.TASK_PRIORITY).
+    """
+
+    def __init__(self, name, topic, tasks, deadline_s, priority=None):
+        unknown = [task for task in tasks if task not in TASKS]
+        if unknown:
+            raise ValueError(f"Route {name!r} refers to unregistered tasks {unknown}")
+        self.name = name
+        self.topic = topic
+        self.tasks = tuple(tasks)
+        self.deadline_s = deadline_s
+        self.priority = priority
+
+
+class FogServerConfig:
+    """
+    Server settings. Every attribute below is a default; pass overrides as keyword arguments.
+    """
+
+    # MQTT Configuration
+    mqtt_broker = "broker.example.com"
+    mqtt_port = 1883
+    mqtt_username = "yourUsername"
+    mqtt_password = "yourPassword"
+
+    # Image Configuration
+    img_max_res = 360        # The maximum width/height of incoming images
+    rov_jpeg_quality = 80    # JPEG quality the ROV should encode at once it has downscaled to img_max_res
+
+    # Topics (un-namespaced; see fleet.vehicle_topic for the per-vehicle versions)
+    routes = ()                                          # Route per input topic
+    objective_topic = "team24/fog/goal"                  # Contains the object to look for
+    status_topic = "team24/fog/AI_Status"                # Publish "READY" or "BUSY" (AI status)
+    capabilities_topic = "team24/fog/capabilities"       # Retained JSON with the input size/codec the ROV should send
+    stats_topic = "team24/fog/stats"                     # JSON scheduler and cache statistics
+    stats_interval_s = 10.0
+    metrics_host = "127.0.0.1"  # Prometheus text endpoint, GET /metrics (see stage_metrics.py)
+    metrics_port = 9464         # None = no endpoint
+    announce_loading = False  # Publish LOADING on the status topic (and BUSY on result topics) when connecting, READY once ready
+    lifecycle_topic = "team24/fog/lifecycle"  # Retained LOADING -> WARMING -> READY, then STOPPING -> OFFLINE (also the will)
+
+    # Startup Configuration (see FogServer.serve)
+    warmup = True              # Answer a synthetic frame for every route on every replica before READY
+    startup_frames = "queue"   # Frames that arrive before READY: "queue" them for the model (deadlines still
+                               # apply) or "reject" them, reported on the detail topic as dropped "starting"
+
+    # Fleet Configuration
+    # ROVs on the original topics are the vehicle fleet.DEFAULT_VEHICLE. With fleet enabled, other
+    # vehicles publish on team24/rov/<vehicle>/... and get answers on team24/fog/<vehicle>/...
+    fleet = True
+    fair_share = True             # Serve vehicles by least model time used, not first come first served
+    max_queued_per_vehicle = 2    # One vehicle flooding frames cannot take more queue slots than this
+    conflate_frames = True        # A vehicle's new frame replaces its queued, not yet started frame for the same route
+
+    # Scheduling Configuration
+    max_queued_frames = 8     # Bound on frames waiting for the model, across all vehicles
+    max_batch_size = 4        # Frames of the same route folded into one model call (1 = no batching)
+    max_batch_wait_ms = 0     # How long to hold a batch open for more frames; 0 = only take what is already queued
+
+    # Server Core Configuration (see FogServer.serve)
+    ingest_queue_size = 64     # Messages received but not yet routed; beyond this new ones are dropped, never waited for
+    publish_queue_size = 256   # Messages waiting to be handed to the MQTT client
+    shutdown_timeout_s = 10.0  # How long shutdown waits for batches already on a replica
+
+    # Result Cache Configuration
+    result_cache = True
+    result_cache_size = 64          # Answers kept, least recently used are evicted first
+    result_cache_max_distance = 4   # Hamming distance tolerance out of 64 hash bits
+    result_cache_ttl_s = 10.0       # Answers older than this are not reused, the scene may have changed
+
+    # Global variable for the current objective (default if none received)
+    default_objective = "object"
+
+    def __init__(self, **overrides):
+        for key, value in overrides.items():
+            if not hasattr(FogServerConfig, key):
+                raise TypeError(f"Unknown fog server setting {key!r}")
+            setattr(self, key, value)
+
+
+# ------------------------------
+# Ingestion
+# ------------------------------
+
+def warmup_frame(width, height):
+    """
+    A noise JPEG as a frame, for warming up the model path before real frames arrive.
+    """
+    buffer = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffer, format="JPEG")
+    return frame_protocol.Frame(memoryview(buffer.getvalue()), width=width, height=height, frame_id=0,
+                                timestamp=time.time())
+
+
+# dHash needs 9x8 pixels: frames are hashed from a thumbnail no wider than this, decoded at 1/8 scale
+HASH_RES = 32
+
+
+class PreparedFrame:
+    """
+    A frame after the shared ingestion stage: decoded, downscaled and hashed, ready to be
+    answered for any number of tasks. image_tensor is the model input, None until
+    FogServer.preprocess() is called for a task the result cache could not answer.
+    vehicle_id is the sender, whose earlier answers are the only ones the frame may reuse.
+    Picklable, so it can be handed to a replica in another process.
+    """
+
+    def __init__(self, image, frame_hash, image_tensor=None, vehicle_id=None):
+        self.image = image
+        self.frame_hash = frame_hash
+        self.image_tensor = image_tensor
+        self.vehicle_id = vehicle_id
+
+
+# ------------------------------
+# Server
+# ------------------------------
+
+class FogServer:
+    """
+    The fog server engine: subscribes to each route's topic, queues frames on the
+    inference scheduler, runs each frame through the shared ingestion stage once and
+    publishes one answer per task of its route.
+
+    backends are the model replicas that answer tasks for prepared frames, see
+    llava_backend.LlavaBackend. Each replica gets its own inference worker and takes
+    the next batch from the shared queue whenever it is idle.
+    """
+
+    def __init__(self, config, backends):
+        self.config = config
+        self.backends = list(backends)
+        self.routes = {route.name: route for route in config.routes}
+        self.topic_routes = {route.topic: route for route in config.routes}
+        self.base_topics = set(self.topic_routes) | {config.objective_topic}
+        self.objective = config.default_objective  # Fleet-wide, vehicles may override it with their own
+        self.sessions = {}
+        self._sessions_lock = threading.Lock()
+        self.result_cache = ResultCache(config.result_cache_size, config.result_cache_max_distance,
+                                        config.result_cache_ttl_s)
+        self.scheduler = InferenceScheduler(self.handle_batch, max_queue=config.max_queued_frames,
+                                            max_batch_size=config.max_batch_size,
+                                            max_batch_wait_ms=config.max_batch_wait_ms, replicas=self.backends,
+                                            fair_share=config.fair_share,
+                                            max_queue_per_flow=config.max_queued_per_vehicle,
+                                            conflate=config.conflate_frames)
+        self.client = mqtt.Client()
+        self.client.username_pw_set(config.mqtt_username, config.mqtt_password)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        # Brokers publish the will if the server drops off without disconnecting
+        self.client.will_set(config.lifecycle_topic, "OFFLINE", retain=True)
+        self.lifecycle = "LOADING"
+        self.startup = {"connect_s": None, "replicas": {}, "ready_s": None}
+        self._started_at = time.monotonic()
+        # Set while serve() runs the asyncio core
+        self._loop = None
+        self._loop_thread = None
+        self._ingest = None
+        self._outbox = None
+        self._stopping = None
+        self.serving = threading.Event()  # Set while serve() is READY
+        self.core_stats = {"received": 0, "ingest_dropped": 0, "published": 0, "publish_dropped": 0}
+
+    def route_tasks(self, route):
+        return [TASKS[name] for name in route.tasks]
+
+    def session(self, vehicle_id):
+        with self._sessions_lock:
+            session = self.sessions.get(vehicle_id)
+            if session is None:
+                session = self.sessions[vehicle_id] = VehicleSession(vehicle_id)
+                print(f"DEBUG - New vehicle session: {vehicle_id}")
+            return session
+
+    def objective_for(self, vehicle_id):
+        session = self.sessions.get(vehicle_id)
+        if session is not None and session.objective is not None:
+            return session.objective
+        return self.objective
+
+    # ------------------------------
+    # 1. Connect
+    # ------------------------------
+
+    def publish_capabilities(self):
+        """
+        Tell ROVs which input size and codec to send. Retained, so ROVs that connect later
+        get it immediately and pick up a new setting as soon as the server restarts with it.
+        """
+        capabilities = {
+            "max_res": self.config.img_max_res,
+            "codec": "jpeg",
+            "quality": self.config.rov_jpeg_quality,
+            "protocol": frame_protocol.VERSION,
+        }
+        self.publish(self.config.capabilities_topic, json.dumps(capabilities), retain=True)
+        print(f"DEBUG - Published capabilities: {capabilities}")
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print("DEBUG - Connected to MQTT Broker")
+            if self.startup["connect_s"] is None:
+                self.startup["connect_s"] = time.monotonic() - self._started_at
+            # Again on every reconnect, the broker may have published the will meanwhile
+            self.publish(self.config.lifecycle_topic, self.lifecycle, retain=True)
+            self.publish_capabilities()
+            # Subscribe to all relevant topics, and their per-vehicle versions
+            for topic in [route.topic for route in self.routes.values()] + [self.config.objective_topic]:
+                client.subscribe(topic)
+                if self.config.fleet:
+                    client.subscribe(vehicle_topic(topic, "+"))
+            if self.config.announce_loading and self.lifecycle != "READY":
+                self.publish(self.config.status_topic, "LOADING")
+                for task in self.result_tasks():
+                    self.publish(task.result_topic, "BUSY")
+        else:
+            print("DEBUG - Failed to connect, return code", rc)
+            sys.exit(1)
+
+    def result_tasks(self):
+        names = []
+        for route in self.routes.values():
+            names += [name for name in route.tasks if name not in names]
+        return [TASKS[name] for name in names]
+
+    # ------------------------------
+    # 2. Ingestion & Answers
+    # ------------------------------
+
+    def frame_hash(self, frame):
+        """
+        Perceptual hash of a frame for the result cache, from a thumbnail decode cheap enough
+        for the router on the event loop. None if the result cache is off or the frame is unusable.
+        """
+        if not self.config.result_cache:
+            return None
+        try:
+            with stage_metrics.timed("hash"):
+                return dhash(image_decode.decode_thumbnail(frame, HASH_RES))
+        except Exception as e:
+            print("DEBUG - Error hashing image:", e)
+            return None
+
+    def ingest(self, frame, backend, tag="", frame_hash=None, vehicle_id=None):
+        """
+        Decode a frame straight from the payload buffer at reduced scale (see image_decode.py).
+        frame_hash is the hash the router took for the result cache, taken here if missing.
+        Runs once per frame no matter how many tasks the frame is answered for; preprocessing
+        waits until a task misses the cache.
+        Returns None if the frame is unusable.
+        """
+        try:
+            image = image_decode.decode_image(frame, self.config.img_max_res)
+        except Exception as e:
+            print(f"DEBUG - {tag}Error decoding image:", e)
+            return None
+        print(f"DEBUG - {tag}Decoded image at {image.size[0]}x{image.size[1]}")
+        if frame_hash is None:
+            frame_hash = self.frame_hash(frame)
+        return PreparedFrame(image, frame_hash, vehicle_id=vehicle_id)
+
+    def preprocess(self, prepared, backend):
+        """
+        The model input for a prepared frame (process_images and the transfer to the device),
+        made once and only for frames the model will actually see.
+        """
+        if prepared.image_tensor is None:
+            prepared.image_tensor = backend.preprocess(prepared.image)
+        return prepared
+
+    def cached_answer(self, vehicle_id, task, instruction, frame_hash, tag=""):
+        """
+        Answers are keyed by the instruction, not the backend's prompt, so the router can
+        look them up without a replica. The worker looks again for frames the router looked
+        up, which catches a frame queued behind a near-identical one.
+        """
+        if not self.config.result_cache or frame_hash is None:
+            return None
+        answer = self.result_cache.lookup(task.name, instruction, frame_hash, vehicle_id)
+        if answer is not None:
+            print(f"DEBUG - {tag}Result cache hit:", answer)
+        return answer
+
+    def store_answer(self, vehicle_id, task, instruction, frame_hash, answer, cost_s):
+        if self.config.result_cache and answer is not None and frame_hash is not None:
+            self.result_cache.store(task.name, instruction, frame_hash, answer, cost_s, vehicle_id)
+
+    def answer_task(self, task, frames, backend, objective):
+        """
+        Answer one task for a batch of prepared frames with one model call.
+        Frames that match a recent answer for the same question skip the model.
+        Returns one (label, confidence) per frame, None for frames that could not be decoded.
+        Model errors are raised, the scheduler counts them against the replica's health.
+        """
+        tag = task.tag
+        instruction = task.instruction_for(objective)
+        question = backend.question(instruction)
+        results = [None] * len(frames)
+        pending = []
+        for i, prepared in enumerate(frames):
+            if prepared is None:
+                continue
+            results[i] = self.cached_answer(prepared.vehicle_id, task, instruction, prepared.frame_hash, tag)
+            if results[i] is None:
+                pending.append(i)
+        if not pending:
+            return results
+
+        print(f"DEBUG - {tag}Question: {question}")
+        start = time.monotonic()
+        inputs = [self.preprocess(frames[i], backend) for i in pending]
+        with stage_metrics.timed("inference"):
+            answers = backend.answer_batch(task, inputs, question, tag)
+        cost_s = (time.monotonic() - start) / len(pending)
+        for i, answer in zip(pending, answers):
+            results[i] = answer
+            self.store_answer(frames[i].vehicle_id, task, instruction, frames[i].frame_hash, answer, cost_s)
+        print(f"DEBUG - {tag}Final results:", results)
+        return results
+
+    def answer_tasks(self, tasks, prepared, backend, objective):
+        """
+        Answer several tasks for one prepared frame with a single vision pass.
+        Returns one (label, confidence) per task, None for tasks that could not be answered.
+        """
+        tag = "[Shared] "
+        if prepared is None:
+            return [None] * len(tasks)
+        instructions = [task.instruction_for(objective) for task in tasks]
+        # Keyed like answer_task, so shared frames and single-task frames reuse each other's answers
+        results = [self.cached_answer(prepared.vehicle_id, task, instruction, prepared.frame_hash, tag)
+                   for task, instruction in zip(tasks, instructions)]
+        pending = [i for i, answer in enumerate(results) if answer is None]
+        if not pending:
+            return results
+
+        start = time.monotonic()
+        self.preprocess(prepared, backend)
+        with stage_metrics.timed("inference"):
+            answers = backend.answer_shared([tasks[i] for i in pending], prepared,
+                                            [instructions[i] for i in pending], tag)
+        cost_s = (time.monotonic() - start) / len(pending)
+        for i, answer in zip(pending, answers):
+            results[i] = answer
+            self.store_answer(prepared.vehicle_id, tasks[i], instructions[i], prepared.frame_hash, answer, cost_s)
+        print(f"DEBUG - {tag}Final results:", results)
+        return results
+
+    def handle_batch(self, jobs, backend):
+        """
+        Runs on a replica's inference worker thread with a batch of jobs that share a route.
+        The batch may mix vehicles; jobs whose vehicles have different objectives get separate
+        model calls. Returns, per job, one answer per task of the route.
+        """
+        route = self.routes[jobs[0].task]
+        tasks = self.route_tasks(route)
+        tag = tasks[0].tag if len(tasks) == 1 else "[Shared] "
+        for job in jobs:
+            stage_metrics.record("queue_wait", job.started_at - job.enqueued_at)
+        frames = [self.ingest(job.payload, backend, tag, job.frame_hash, job.flow) for job in jobs]
+        objectives = [self.objective_for(job.flow) for job in jobs]
+        if len(tasks) > 1:
+            return [self.answer_tasks(tasks, prepared, backend, objective)
+                    for prepared, objective in zip(frames, objectives)]
+
+        results = [None] * len(jobs)
+        groups = {}
+        for i, objective in enumerate(objectives):
+            groups.setdefault(objective if tasks[0].uses_objective else self.objective, []).append(i)
+        for objective, indices in groups.items():
+            answers = self.answer_task(tasks[0], [frames[i] for i in indices], backend, objective)
+            for i, answer in zip(indices, answers):
+                results[i] = [answer]
+        return results
+
+    # ------------------------------
+    # 3. Publishing
+    # ------------------------------
+
+    def publish_answer(self, job, task, answer):
+        """
+        Publish the bare label for existing subscribers and the label with its confidence as JSON.
+        The JSON echoes the frame id and capture timestamp of the frame it answers, so a ROV with
+        several frames in flight can match answers to frames (both None for legacy frames).
+        Returns the published (label, confidence).
+        """
+        label, confidence = answer if answer is not None else (task.fallback, None)
+        self.publish(vehicle_topic(task.result_topic, job.flow), label)
+        self.publish_detail(job, task, {"label": label, "confidence": confidence})
+        return label, confidence
+
+    def publish_detail(self, job, task, detail):
+        if task.detail_topic is None:
+            return
+        detail.update(task=task.name, frame_id=job.payload.frame_id, timestamp=job.payload.timestamp)
+        self.publish(vehicle_topic(task.detail_topic, job.flow), json.dumps(detail))
+
+    def publish_status(self, vehicle_id, status):
+        self.publish(vehicle_topic(self.config.status_topic, vehicle_id), status)
+
+    def publish_results(self, job, results):
+        tasks = self.route_tasks(self.routes[job.task])
+        if results is None:
+            results = [None] * len(tasks)
+        published = {}
+        for task, answer in zip(tasks, results):
+            published[task.name] = self.publish_answer(job, task, answer)
+        latency = time.monotonic() - job.enqueued_at
+        stage_metrics.record("end_to_end", latency)
+        pending = self.session(job.flow).finished(latency, published)
+        if pending == 0:
+            self.publish_status(job.flow, "READY")
+
+    def publish_dropped(self, job, reason):
+        """
+        A conflated frame was replaced by a newer one from the same vehicle, which will be
+        answered instead: only the detail topic hears about it (so a ROV tracking frame ids
+        can let it go), the bare result topics get the newer frame's answer rather than BUSY.
+        """
+        for task in self.route_tasks(self.routes[job.task]):
+            if reason != "conflated":
+                self.publish(vehicle_topic(task.result_topic, job.flow), "BUSY")
+            self.publish_detail(job, task, {"label": None, "confidence": None, "dropped": reason})
+        if self.session(job.flow).dropped(reason) == 0 and self.lifecycle == "READY":
+            self.publish_status(job.flow, "READY")
+
+    def stats(self):
+        replicas = self.scheduler.replica_report()
+        for report, backend in zip(replicas, self.backends):
+            report.update(backend.stats)
+        flows = self.scheduler.flow_report()
+        with self._sessions_lock:
+            sessions = list(self.sessions.values())
+        vehicles = {}
+        for session in sessions:
+            vehicles[session.vehicle_id] = session.snapshot()
+            vehicles[session.vehicle_id]["model_time_s"] = flows.get(session.vehicle_id, {}).get("service_s", 0.0)
+        return {"lifecycle": self.lifecycle, "startup": self.startup, "scheduler": self.scheduler.snapshot(),
+                "replicas": replicas, "vehicles": vehicles, "result_cache": self.result_cache.snapshot(),
+                "core": dict(self.core_stats), "stages": stage_metrics.metrics.snapshot()}
+
+    def publish_stats(self):
+        """
+        Publish scheduler counters, per-replica health and utilization, per-vehicle sessions,
+        result cache hit rate / latency saved and per-stage latency percentiles as JSON.
+        """
+        self.publish(self.config.stats_topic, json.dumps(self.stats()))
+
+    def publish(self, topic, payload, retain=False):
+        """
+        Publish from any thread. While the asyncio core runs, the message goes through the
+        outbox and the event loop hands it to the MQTT client in order; the client is only
+        touched from the loop thread. Without the core (benchmarks calling on_message
+        directly) it is published straight away.
+        """
+        if self._loop is None:
+            with stage_metrics.timed("publish"):
+                self.client.publish(topic, payload, retain=retain)
+        elif threading.get_ident() == self._loop_thread:
+            self._post((topic, payload, retain, time.perf_counter()))
+        else:
+            self._loop.call_soon_threadsafe(self._post, (topic, payload, retain, time.perf_counter()))
+
+    def _post(self, message):
+        try:
+            self._outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            self.core_stats["publish_dropped"] += 1
+            print(f"DEBUG - Outbox full, dropping message on {message[0]}")
+
+    # ------------------------------
+    # 4. MQTT Message Callbacks
+    # ------------------------------
+
+    def set_objective(self, vehicle_id, objective):
+        """
+        The un-namespaced objective topic sets the fleet-wide objective, a vehicle's own
+        objective topic overrides it for that vehicle.
+        """
+        print(f"DEBUG - Updated objective for {vehicle_id} to: {objective}")
+        if vehicle_id != DEFAULT_VEHICLE:
+            # Prompt prefixes and cached answers are keyed by the question text, so other
+            # vehicles' entries stay valid and this vehicle's old ones simply age out
+            self.session(vehicle_id).objective = objective
+            return
+        self.objective = objective
+        self.result_cache.clear()
+        if self._loop is not None and threading.get_ident() == self._loop_thread:
+            # A process replica answers only between batches: wait for it off the event loop
+            self._loop.run_in_executor(None, self.invalidate_objective_prefixes)
+        else:
+            self.invalidate_objective_prefixes()
+
+    def invalidate_objective_prefixes(self):
+        """
+        Drop the backends' cached prompt prefixes for the tasks that ask about the objective.
+        """
+        for task in TASKS.values():
+            if task.uses_objective:
+                for backend in self.backends:
+                    try:
+                        backend.invalidate(task.name)
+                    except Exception as e:
+                        print(f"DEBUG - Error invalidating {task.name} prefixes:", e)
+
+    def on_message(self, client, userdata, msg):
+        """
+        With the asyncio core this runs on the event loop as the socket is read, so it only
+        queues the message for the router and returns: a full ingest queue drops the message
+        instead of holding up the network loop.
+        """
+        self.core_stats["received"] += 1
+        if self._ingest is None:
+            self.handle_message(msg.topic, msg.payload)
+            return
+        if self._stopping.is_set():
+            return
+        try:
+            self._ingest.put_nowait((msg.topic, msg.payload))
+        except asyncio.QueueFull:
+            self.core_stats["ingest_dropped"] += 1
+            print(f"DEBUG - Ingest queue full, dropping message on {msg.topic}")
+
+    def handle_message(self, topic, payload):
+        print(f"DEBUG - Received message on topic {topic}")
+
+        vehicle_id, base_topic = split_vehicle_topic(topic, self.base_topics)
+        if vehicle_id is None:
+            return
+
+        # Update objective if received
+        if base_topic == self.config.objective_topic:
+            self.set_objective(vehicle_id, payload.decode("utf-8"))
+            return
+
+        # Image topics carry a binary frame, or a base64 string from ROVs that have not been updated.
+        # Binary frames are decoded in place, the image bytes are a view into the payload.
+        route = self.topic_routes[base_topic]
+        try:
+            frame = frame_protocol.decode_frame(payload, default_task=route.name)
+        except ValueError as e:
+            print(f"DEBUG - Dropping malformed frame on {topic}:", e)
+            return
+
+        # Navcam jobs are served ahead of camera jobs, see inference_scheduler.TASK_PRIORITY.
+        # Within a priority, vehicles share the replicas fairly (the job's flow is its vehicle).
+        self.session(vehicle_id).received()
+        job = InferenceJob(route.name, frame, route.deadline_s, on_result=self.publish_results,
+                           on_drop=self.publish_dropped, priority=route.priority, flow=vehicle_id,
+                           frame_hash=self.frame_hash(frame))
+        if self.lifecycle != "READY" and self.config.startup_frames == "reject":
+            print(f"DEBUG - Rejecting frame on {topic}, the server is {self.lifecycle}")
+            self.publish_dropped(job, "starting")
+            return
+        # A frame that looks like one answered recently is answered here and now, without
+        # waiting behind model calls. Partial hits go to the model for the missing tasks only.
+        if job.frame_hash is not None:
+            objective = self.objective_for(vehicle_id)
+            cached = [self.cached_answer(vehicle_id, task, task.instruction_for(objective), job.frame_hash, task.tag)
+                      for task in self.route_tasks(route)]
+            if all(answer is not None for answer in cached):
+                self.publish_results(job, cached)
+                return
+        # Before READY the scheduler is not started yet, queued frames wait for it
+        if self.scheduler.submit(job):
+            self.publish_status(vehicle_id, "BUSY")
+            for task in self.route_tasks(route):
+                self.publish(vehicle_topic(task.result_topic, vehicle_id), "BUSY")
+
+    # ------------------------------
+    # 5. Server Core
+    # ------------------------------
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """
+        Ask serve() to shut down, from any thread (SIGINT and SIGTERM do the same).
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def set_lifecycle(self, state):
+        self.lifecycle = state
+        self.publish(self.config.lifecycle_topic, state, retain=True)
+        print(f"DEBUG - Server {state}")
+
+    def replica_startup(self, index):
+        name = getattr(self.backends[index], "name", None) or f"replica-{index}"
+        return self.startup["replicas"].setdefault(name, {})
+
+    def load_backends(self):
+        for i, backend in enumerate(self.backends):
+            start = time.monotonic()
+            backend.load()
+            report = self.replica_startup(i)
+            report["load_s"] = time.monotonic() - start
+            # Backends may break their load down further, e.g. LlavaBackend.load_times
+            report["load_steps_s"] = dict(getattr(backend, "load_times", {}))
+
+    def warm_up(self, backend):
+        """
+        Answer a synthetic frame for every route on backend, so the first ROV frame does not
+        pay for lazy initialization (kernel compilation and autotuning, allocator pools,
+        tokenizer and processor caches). Returns {route name: seconds}.
+        """
+        frame = warmup_frame(self.config.img_max_res, self.config.img_max_res * 9 // 16)
+        times = {}
+        for route in self.routes.values():
+            job = InferenceJob(route.name, frame, route.deadline_s, flow=DEFAULT_VEHICLE)
+            job.started_at = job.enqueued_at
+            start = time.monotonic()
+            try:
+                self.handle_batch([job], backend)
+            except Exception as e:
+                print(f"DEBUG - Warmup of {route.name} failed on {getattr(backend, 'name', backend)}:", e)
+            times[route.name] = time.monotonic() - start
+        return times
+
+    def warm_up_backends(self):
+        for i, backend in enumerate(self.backends):
+            self.replica_startup(i)["warmup_s"] = self.warm_up(backend)
+        # Warmup answers and timings are not traffic: keep them out of the cache and the histograms
+        self.result_cache.clear()
+        stage_metrics.metrics.reset()
+
+    def report_startup(self):
+        startup = self.startup
+        connect = f"{startup['connect_s']:.2f} s" if startup["connect_s"] is not None else "not yet"
+        print(f"DEBUG - Startup: READY after {startup['ready_s']:.2f} s, MQTT connected after {connect}")
+        for name, report in startup["replicas"].items():
+            steps = ", ".join(f"{step} {seconds:.2f} s" for step, seconds in report["load_steps_s"].items())
+            line = f"DEBUG -   {name}: load {report['load_s']:.2f} s" + (f" ({steps})" if steps else "")
+            if "warmup_s" in report:
+                line += ", warmup " + ", ".join(f"{route} {seconds:.2f} s" for route, seconds in report["warmup_s"].items())
+            print(line)
+
+    async def serve(self):
+        """
+        The server core, one asyncio event loop in four stages joined by bounded queues:
+
+        ingest:    the MQTT socket is read on the loop (mqtt_asyncio.AsyncioMqttLoop) and
+                   on_message puts each message on the ingest queue, or drops it if full
+        route:     _router() parses topics and frame headers and submits jobs to the
+                   inference scheduler, whose bounded priority queue drops rather than waits
+        inference: the scheduler's worker threads, one per replica, are the dedicated
+                   executor the model runs in, off the loop
+        publish:   results come back through publish() into the outbox and _publisher()
+                   hands them to the MQTT client on the loop thread
+
+        None of the loop stages waits on inference, so a burst of frames costs queue slots,
+        not network reads. Runs until stop() or SIGINT/SIGTERM, then shuts down in order.
+
+        Startup goes LOADING -> WARMING -> READY on the retained lifecycle topic: the stages run
+        while the backends load and warm up, so frames that arrive meanwhile are queued or
+        rejected (config.startup_frames), and the scheduler starts at READY. A stop during
+        startup skips READY and goes straight to STOPPING. The time each step took is
+        printed and kept under "startup" in stats().
+        """
+        self._started_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._ingest = asyncio.Queue(self.config.ingest_queue_size)
+        self._outbox = asyncio.Queue(self.config.publish_queue_size)
+        self._stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not the main thread, or no signal support on this platform: use stop()
+
+        network = AsyncioMqttLoop(self.client)
+        try:
+            self.client.connect(self.config.mqtt_broker, self.config.mqtt_port, 60)
+        except Exception as e:
+            print("DEBUG - MQTT connection error:", e)
+            sys.exit(1)
+        publisher = loop.create_task(self._publisher())
+        # LOADING goes out from on_connect
+        stages = [loop.create_task(self._router()), loop.create_task(self._stats_loop())]
+        if self.config.metrics_port is not None:
+            try:
+                metrics_server = await asyncio.start_server(self._serve_metrics, self.config.metrics_host,
+                                                            self.config.metrics_port)
+                stages.append(loop.create_task(metrics_server.serve_forever()))
+                print(f"DEBUG - Metrics on http://{self.config.metrics_host}:{self.config.metrics_port}/metrics")
+            except OSError as e:
+                print("DEBUG - Metrics endpoint not started:", e)
+
+        # Load and warm up on a worker thread, the loop keeps the connection alive meanwhile
+        await loop.run_in_executor(None, self.load_backends)
+        if self.config.warmup and not self._stopping.is_set():
+            self.set_lifecycle("WARMING")
+            await loop.run_in_executor(None, self.warm_up_backends)
+        # Stopped while loading or warming up: never announce READY, go straight to shutdown
+        if not self._stopping.is_set():
+            self.scheduler.start()
+            self.startup["ready_s"] = time.monotonic() - self._started_at
+            self.set_lifecycle("READY")
+            if self.config.announce_loading:
+                self.publish(self.config.status_topic, "READY")
+            self.report_startup()
+            self.serving.set()
+
+        await self._stopping.wait()
+        print("DEBUG - Exiting...")
+        await self.shutdown(stages, publisher, network)
+
+    async def _router(self):
+        while True:
+            topic, payload = await self._ingest.get()
+            try:
+                self.handle_message(topic, payload)
+            except Exception as e:
+                print(f"DEBUG - Error handling message on {topic}:", e)
+
+    async def _publisher(self):
+        while True:
+            topic, payload, retain, posted = await self._outbox.get()
+            self.client.publish(topic, payload, retain=retain)
+            # From the publish() call to the client, including the wait in the outbox
+            stage_metrics.record("publish", time.perf_counter() - posted)
+            self.core_stats["published"] += 1
+            self._outbox.task_done()
+
+    async def _stats_loop(self):
+        while True:
+            await asyncio.sleep(self.config.stats_interval_s)
+            try:
+                # Process replicas report their stats between batches, collect them off the loop
+                await asyncio.get_running_loop().run_in_executor(None, self.publish_stats)
+            except Exception as e:
+                print("DEBUG - Error publishing stats:", e)
+
+    def prometheus_text(self):
+        stats = self.scheduler.snapshot()
+        counters = {
+            "fog_frames_total": {event: stats[event] for event in
+                                 ("submitted", "processed", "expired", "rejected", "evicted", "conflated", "errors",
+                                  "failed")},
+            "fog_messages_total": dict(self.core_stats),
+        }
+        gauges = {"fog_queue_depth": {"frames": self.scheduler.qsize()}}
+        return stage_metrics.metrics.prometheus_text(counters, gauges)
+
+    async def _serve_metrics(self, reader, writer):
+        """
+        Just enough HTTP for a Prometheus scrape or curl: GET /metrics, text format 0.0.4.
+        """
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5.0)
+            path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+            if path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.prometheus_text().encode()
+            else:
+                status, body = "404 Not Found", b"Not found, try /metrics\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def shutdown(self, stages, publisher, network):
+        """
+        Stop routing new messages, let the replicas finish the batches they are running and
+        report every frame still queued as dropped ("shutdown"), send all of that, then close
+        the backends and disconnect.
+        """
+        loop = asyncio.get_running_loop()
+        self.serving.clear()
+        self.set_lifecycle("STOPPING")
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        self.core_stats["ingest_dropped"] += self._ingest.qsize()
+        # Everything the workers post before stop() returns is on the outbox by the time we resume
+        await loop.run_in_executor(None, self.scheduler.stop, self.config.shutdown_timeout_s)
+        self.set_lifecycle("OFFLINE")
+        try:
+            await asyncio.wait_for(self._outbox.join(), self.config.shutdown_timeout_s)
+        except asyncio.TimeoutError:
+            print(f"DEBUG - {self._outbox.qsize()} messages not sent before shutdown")
+        publisher.cancel()
+        await asyncio.gather(publisher, return_exceptions=True)
+        print("DEBUG - Server stats:", self.stats())
+        for backend in self.backends:
+            if hasattr(backend, "close"):
+                backend.close()
+        await network.disconnect()
+        self._loop = self._ingest = self._outbox = None
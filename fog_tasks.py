@@ -0,0 +1,72 @@
+from answer_classifier import OBJECTIVE_CHOICES, NAVCAM_CHOICES, parse_choice
+
+# ------------------------------
+# Task declarations
+# ------------------------------
+
+class Task:
+    """
+    One question the fog server can answer about a frame.
+
+    instruction is the prompt text, or a function of the current objective for tasks
+    that ask about it. choices maps each label to the spellings the model may answer
+    with (see answer_classifier.py); fallback is published when no answer could be
+    read. Results go to result_topic as the bare label and, when set, to detail_topic
+    as JSON {"label": ..., "confidence": ...}.
+    """
+
+    def __init__(self, name, instruction, choices, fallback, result_topic, detail_topic=None, tag=""):
+        self.name = name
+        self.instruction = instruction
+        self.choices = choices
+        self.fallback = fallback
+        self.result_topic = result_topic
+        self.detail_topic = detail_topic
+        self.tag = tag  # Prefix for debug output
+
+    @property
+    def uses_objective(self):
+        return callable(self.instruction)
+
+    def instruction_for(self, objective):
+        return self.instruction(objective) if self.uses_objective else self.instruction
+
+    def parse(self, text):
+        """
+        Read the label from generated text, fallback if none of the choices is there.
+        """
+        return parse_choice(text, self.choices, self.fallback)
+
+
+# Task name -> Task. Routes in fog_server.py refer to tasks by name.
+TASKS = {}
+
+
+def register_task(task):
+    if task.name in TASKS:
+        raise ValueError(f"Task {task.name!r} is already registered")
+    TASKS[task.name] = task
+    return task
+
+
+# ------------------------------
+# Built-in tasks
+# ------------------------------
+
+NAVCAM_INSTRUCTION = "Based on this first person view image, where can I move? Answer with only one of the following letters: W = forward, A = Turn Left, S = backwards, D = turn right, E = End Movement (Stop)."
+# NAVCAM_INSTRUCTION = "Answer with one of: W, A, S, D, E where W = forward, A = turn left , S = backwards, D = turn right and E = stop. Based on this image, can I drive forward? if not, should I turn left, or right, or reverse or stop?"
+
+
+def objective_instruction(objective):
+    return "Just answer with 'Yes' or 'No'. Does this image contain " + objective + "?"
+
+
+OBJECT_CHECK = register_task(Task(
+    "camera", objective_instruction, OBJECTIVE_CHOICES, "NO",
+    result_topic="team24/fog/result", detail_topic="team24/fog/result/detail",
+))
+
+NAVIGATION = register_task(Task(
+    "navcam", NAVCAM_INSTRUCTION, NAVCAM_CHOICES, "STOP",
+    result_topic="team24/fog/navdir", detail_topic="team24/fog/navdir/detail", tag="[Navcam] ",
+))
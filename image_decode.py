@@ -0,0 +1,84 @@
+from PIL import Image
+
+from stage_metrics import timed
+
+# PyTurboJPEG is optional; without it PIL's draft mode gives the same DCT-domain scaling.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbo = TurboJPEG()
+except Exception:
+    _turbo = None
+
+# libjpeg can scale by 1/1, 1/2, 1/4 or 1/8 while decoding
+JPEG_SCALES = (8, 4, 2, 1)
+
+
+def target_size(width, height, max_res):
+    """
+    Shrink so the longer side is max_res, keep the aspect ratio. Images that already fit are left alone.
+    """
+    if width <= max_res and height <= max_res:
+        return width, height
+    scale = max_res / float(max(width, height))
+    return int(width * scale), int(height * scale)
+
+
+def _turbo_decode(data, max_res):
+    width, height, _, _ = _turbo.decode_header(data)
+    size = target_size(width, height, max_res)
+    # Largest reduction that still decodes at or above the target size
+    for denom in JPEG_SCALES:
+        if width // denom >= size[0] and height // denom >= size[1]:
+            break
+    rgb = _turbo.decode(data, pixel_format=TJPF_RGB, scaling_factor=(1, denom))
+    return Image.fromarray(rgb), size
+
+
+def decode_image(frame, max_res):
+    """
+    Decode a frame's image straight to roughly max_res, then do one cheap resize to the exact size.
+
+    For JPEGs the decoder skips the full-resolution pass entirely: it decodes at the
+    smallest 1/2, 1/4 or 1/8 DCT scale that is still at or above the target size.
+    Returns a contiguous RGB PIL image of size target_size(width, height, max_res).
+    """
+    with timed("decode"):
+        if _turbo is not None and frame.codec == "jpeg":
+            image, size = _turbo_decode(frame.data, max_res)
+        else:
+            image = Image.open(frame.open())
+            size = target_size(image.width, image.height, max_res)
+            if image.format == "JPEG":
+                image.draft("RGB", size)
+            image = image.convert("RGB")
+    if image.size != size:
+        with timed("resize"):
+            image = image.resize(size, Image.BILINEAR)
+    return image
+
+
+def decode_thumbnail(frame, max_res):
+    """
+    Decode a frame's image to at most max_res on the longer side, untimed, for perceptual
+    hashing: a JPEG is decoded at 1/8 scale unless that is already smaller than asked.
+    """
+    if _turbo is not None and frame.codec == "jpeg":
+        image, size = _turbo_decode(frame.data, max_res)
+    else:
+        image = Image.open(frame.open())
+        size = target_size(image.width, image.height, max_res)
+        if image.format == "JPEG":
+            image.draft("RGB", size)
+        image = image.convert("RGB")
+    return image.resize(size, Image.BILINEAR) if image.size != size else image
+
+
+def decode_image_full(frame, max_res):
+    """
+    The original path: decode at full resolution, then resize. Kept for comparison (bench_decode.py).
+    """
+    image = Image.open(frame.open()).convert("RGB")
+    size = target_size(image.width, image.height, max_res)
+    if image.size != size:
+        image = image.resize(size)
+    return image
@@ -0,0 +1,493 @@
+import collections
+import itertools
+import threading
+import time
+
+# ------------------------------
+# Task classes
+# ------------------------------
+
+# Lower value = served first. The ROV blocks on navigation frames, object
+# detection frames are fire-and-forget, so navcam always goes ahead of camera.
+TASK_PRIORITY = {
+    "navcam": 0,
+    "frame": 0,   # shared prefill, answers navcam and camera together
+    "camera": 1,
+}
+
+
+class InferenceJob:
+    """
+    A single frame waiting for the model.
+    deadline_s is relative to submission; once it has passed the job is dropped
+    instead of being processed late.
+    on_result(job, result) is called with the handler's return value,
+    on_drop(job, reason) when the job never reaches the model, or reason "failed"
+    when the handler raised on its batch.
+    priority overrides the task's class from TASK_PRIORITY.
+    flow identifies the sender (e.g. a vehicle id) for fair sharing between senders.
+    frame_hash is the payload's perceptual hash, if the submitter computed one.
+    """
+
+    def __init__(self, task, payload, deadline_s, on_result=None, on_drop=None, priority=None, flow=None,
+                 frame_hash=None):
+        self.task = task
+        self.payload = payload
+        self.frame_hash = frame_hash
+        self.priority = priority if priority is not None else TASK_PRIORITY.get(task, len(TASK_PRIORITY))
+        self.flow = flow
+        self.seq = None
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + deadline_s
+        self.started_at = None
+        self.on_result = on_result
+        self.on_drop = on_drop
+
+    def expired(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now > self.deadline
+
+    def sort_key(self):
+        # Priority class first, then earliest deadline first within a class.
+        return (self.priority, self.deadline)
+
+
+# ------------------------------
+# Replicas
+# ------------------------------
+
+class ReplicaStats:
+    """
+    Health and utilization of one model replica. A replica whose handler fails
+    max_consecutive_errors times in a row is marked unhealthy until a batch succeeds again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.monotonic()
+        self.busy_since = None
+        self.busy_s = 0.0
+        self.batches = 0
+        self.frames = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error = None
+        self.healthy = True
+
+    def begin(self):
+        self.busy_since = time.monotonic()
+
+    def end(self, frames, error=None, max_consecutive_errors=3):
+        self.busy_s += time.monotonic() - self.busy_since
+        self.busy_since = None
+        self.batches += 1
+        if error is None:
+            self.frames += frames
+            self.consecutive_errors = 0
+            self.healthy = True
+        else:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = str(error)
+            if self.consecutive_errors >= max_consecutive_errors:
+                self.healthy = False
+
+    def snapshot(self):
+        now = time.monotonic()
+        busy_s = self.busy_s
+        busy_since = self.busy_since
+        if busy_since is not None:
+            busy_s += now - busy_since
+        uptime = now - self.started_at
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "busy": busy_since is not None,
+            "utilization": busy_s / uptime if uptime > 0 else 0.0,
+            "batches": self.batches,
+            "frames": self.frames,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+# ------------------------------
+# Scheduler
+# ------------------------------
+
+class InferenceScheduler:
+    """
+    Long-lived inference workers fed by one bounded priority queue.
+
+    There is one worker thread per entry of replicas (e.g. one model per GPU);
+    each takes the next batch as soon as it is idle, so work always goes to
+    whichever replica is free. handler(jobs, replica) runs on that replica's
+    worker thread with a batch of jobs of the same task and returns one result
+    per job, in order. Without replicas there is a single worker and replica
+    is None. A batch is collected for at most max_batch_wait_ms or until
+    max_batch_size jobs are in hand, whichever comes first; the window closes
+    early when a more urgent task class shows up. max_batch_size=1 is the
+    plain one-frame-at-a-time path.
+
+    With fair_share, jobs of the same priority class are served by flow
+    (sender): the flow that has used the least model time goes first, and a
+    flow that has just become active starts level with the others rather
+    than with credit for the time it was silent. A flow may hold at most
+    max_queue_per_flow queued jobs, so one flooding sender cannot fill the
+    queue, and when the queue is full a job from a lighter flow pushes out
+    the least urgent job of the heaviest flow.
+
+    Otherwise, when the queue is full a new job evicts the least urgent queued
+    job if it is more urgent itself, or is rejected. Either way, jobs already
+    past their deadline leave the queue first.
+
+    With conflate, the queue holds at most one job per (flow, task), a mailbox
+    that only keeps the latest: a new job takes the place of a queued job of
+    the same flow and task that has not started yet, and the older one is
+    dropped as "conflated". A sender streaming faster than the model is then
+    always answered for its freshest frame instead of being turned away. on_idle() is called each
+    time a worker finishes and finds nothing left to do while no other worker is busy.
+
+    A batch whose handler raises is dropped as "failed", not counted as processed.
+    A replica whose handler keeps failing is marked unhealthy and sits out for
+    unhealthy_backoff_s between attempts, leaving the queue to the others.
+    """
+
+    def __init__(self, handler, max_queue=4, on_idle=None, max_batch_size=1, max_batch_wait_ms=0,
+                 replicas=None, max_consecutive_errors=3, unhealthy_backoff_s=5.0,
+                 fair_share=False, max_queue_per_flow=None, conflate=False):
+        self.handler = handler
+        self.replicas = list(replicas) if replicas else [None]
+        self.max_consecutive_errors = max_consecutive_errors
+        self.unhealthy_backoff_s = unhealthy_backoff_s
+        self.replica_stats = [
+            ReplicaStats(getattr(replica, "name", None) or f"replica-{i}")
+            for i, replica in enumerate(self.replicas)
+        ]
+        self.max_queue = max_queue
+        self.on_idle = on_idle
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_wait_s = max_batch_wait_ms / 1000.0
+        self.fair_share = fair_share
+        self.max_queue_per_flow = max_queue_per_flow
+        self.conflate = conflate
+        self._queue = []
+        self._flow_time = {}  # flow -> seconds of model time used
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._stopped = threading.Event()
+        self._threads = []
+        self._busy = 0
+        self.stats = {
+            "submitted": 0,
+            "processed": 0,
+            "expired": 0,
+            "rejected": 0,
+            "evicted": 0,
+            "conflated": 0,
+            "errors": 0,        # handler calls that raised
+            "failed": 0,        # jobs in those calls, dropped as "failed"
+            "max_latency": {},  # task -> worst submit-to-result time in seconds
+            "batches": {},      # batch size -> number of handler calls
+        }
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._stopped.clear()
+        for i in range(len(self.replicas)):
+            thread = threading.Thread(target=self._worker, args=(i,), name=f"inference-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._running = False
+            pending = self._queue
+            self._queue = []
+            self._cond.notify_all()
+        self._stopped.set()
+        for job in pending:
+            self._drop(job, "shutdown")
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def qsize(self):
+        with self._cond:
+            return len(self._queue)
+
+    def idle(self):
+        """
+        True when nothing is queued and no replica is running a batch.
+        """
+        with self._cond:
+            return not self._queue and self._busy == 0
+
+    def snapshot(self):
+        """
+        A copy of the stats counters, safe to serialize while the workers keep counting.
+        """
+        with self._cond:
+            report = dict(self.stats)
+            report["max_latency"] = dict(self.stats["max_latency"])
+            report["batches"] = dict(self.stats["batches"])
+            return report
+
+    def flow_report(self):
+        """
+        Queued jobs and model time used per flow.
+        """
+        with self._cond:
+            queued = collections.Counter(job.flow for job in self._queue)
+            flows = set(queued) | set(self._flow_time)
+            return {flow: {"queued": queued.get(flow, 0), "service_s": self._flow_time.get(flow, 0.0)}
+                    for flow in flows}
+
+    def submit(self, job):
+        """
+        Queue a job. Returns False if the job was rejected because there was no
+        room for it (see the class docstring for who gives way to whom).
+        """
+        with self._cond:
+            self.stats["submitted"] += 1
+            job.seq = next(self._seq)
+            self._activate_flow(job.flow)
+            stale = self._mailbox(job) if self.conflate else None
+            if stale is not None:
+                # Takes the stale job's place, the queue does not grow
+                self._queue[self._queue.index(stale)] = job
+                self.stats["conflated"] += 1
+                expired = []
+                evicted = None
+            else:
+                # Stale jobs give up their slots before anyone is turned away or evicted
+                expired = self._remove_expired()
+                evicted = self._make_room(job)
+            if evicted is job:
+                self.stats["rejected"] += 1
+            else:
+                if evicted is not None:
+                    self._queue.remove(evicted)
+                    self.stats["evicted"] += 1
+                if stale is None:
+                    self._queue.append(job)
+                # Wake every worker: one holding a batch window open may not want this job
+                self._cond.notify_all()
+        if stale is not None:
+            self._drop(stale, "conflated")
+        for expired_job in expired:
+            self._drop(expired_job, "expired")
+        if evicted is not None:
+            self._drop(evicted, "evicted" if evicted is not job else "full")
+        return evicted is not job
+
+    def _mailbox(self, job):
+        """
+        The queued job of the same flow and task that job replaces, if any.
+        Must be called with the lock held.
+        """
+        for queued_job in self._queue:
+            if queued_job.flow == job.flow and queued_job.task == job.task:
+                return queued_job
+        return None
+
+    def _remove_expired(self):
+        """
+        Take the jobs whose deadline has passed off the queue and return them.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        expired = [job for job in self._queue if job.expired(now)]
+        for job in expired:
+            self._queue.remove(job)
+        self.stats["expired"] += len(expired)
+        return expired
+
+    def _make_room(self, job):
+        """
+        Pick the job that has to go for job to be queued: None if there is room,
+        job itself if it is rejected. Must be called with the lock held.
+        """
+        queued = collections.Counter(queued_job.flow for queued_job in self._queue)
+        if self.max_queue_per_flow is not None and queued[job.flow] >= self.max_queue_per_flow:
+            candidates = [queued_job for queued_job in self._queue if queued_job.flow == job.flow]
+        elif len(self._queue) >= self.max_queue:
+            heaviest = max(queued.values())
+            if self.fair_share and heaviest > queued[job.flow] + 1:
+                # A lighter flow takes its share from the heaviest one regardless of urgency
+                victims = [queued_job for queued_job in self._queue if queued[queued_job.flow] == heaviest]
+                return max(victims, key=InferenceJob.sort_key)
+            candidates = self._queue
+        else:
+            return None
+        worst = max(candidates, key=InferenceJob.sort_key)
+        return worst if job.sort_key() < worst.sort_key() else job
+
+    def _activate_flow(self, flow):
+        """
+        A flow with nothing queued starts level with the least served queued flow,
+        so time spent silent is not banked as credit. Must be called with the lock held.
+        """
+        if not self.fair_share:
+            return
+        active = {job.flow for job in self._queue}
+        if flow in active or not active:
+            return
+        floor = min(self._flow_time.get(other, 0.0) for other in active)
+        self._flow_time[flow] = max(self._flow_time.get(flow, 0.0), floor)
+
+    def _rank(self, job):
+        # Priority class first, then (fair share) the least served flow, then earliest deadline
+        service = self._flow_time.get(job.flow, 0.0) if self.fair_share else 0.0
+        return (job.priority, service, job.deadline, job.seq)
+
+    def _charge(self, batch, elapsed):
+        with self._cond:
+            for job in batch:
+                self._flow_time[job.flow] = self._flow_time.get(job.flow, 0.0) + elapsed / len(batch)
+
+    def _next_job(self):
+        """
+        Block until a live job is available. Expired jobs are dropped on the way.
+        Returns None when the scheduler is stopped. A live job counts as busy from the
+        moment it leaves the queue, so idle() cannot miss it in between.
+        """
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return None
+                job = min(self._queue, key=self._rank)
+                self._queue.remove(job)
+                expired = job.expired()
+                if expired:
+                    self.stats["expired"] += 1
+                else:
+                    self._busy += 1
+            if expired:
+                self._drop(job, "expired")
+                self._maybe_idle()
+                continue
+            return job
+
+    def _take_matching(self, task, limit, dropped):
+        """
+        Pop up to limit queued jobs of the given task, next in line first.
+        Must be called with the lock held. Expired jobs go to dropped.
+        """
+        taken = []
+        for job in sorted(self._queue, key=self._rank):
+            if len(taken) >= limit:
+                break
+            if job.task != task:
+                continue
+            self._queue.remove(job)
+            if job.expired():
+                self.stats["expired"] += 1
+                dropped.append(job)
+            else:
+                taken.append(job)
+        return taken
+
+    def _next_batch(self):
+        """
+        Block until at least one live job is available, then keep collecting
+        jobs of the same task until the batch is full or the window closes.
+        Returns None when the scheduler is stopped.
+        """
+        first = self._next_job()
+        if first is None:
+            return None
+        batch = [first]
+        dropped = []
+        window_end = time.monotonic() + self.max_batch_wait_s
+        with self._cond:
+            while len(batch) < self.max_batch_size:
+                batch += self._take_matching(first.task, self.max_batch_size - len(batch), dropped)
+                if len(batch) >= self.max_batch_size or not self._running:
+                    break
+                # A more urgent task class is waiting, run what we have now.
+                if self._queue and min(job.priority for job in self._queue) < first.priority:
+                    break
+                remaining = min(window_end, min(job.deadline for job in batch)) - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        for job in dropped:
+            self._drop(job, "expired")
+        return batch
+
+    def _worker(self, index):
+        replica = self.replicas[index]
+        health = self.replica_stats[index]
+        while True:
+            if not health.healthy and self._stopped.wait(self.unhealthy_backoff_s):
+                return
+            batch = self._next_batch()
+            if batch is None:
+                return
+            now = time.monotonic()
+            for job in batch:
+                job.started_at = now
+            health.begin()
+            error = None
+            try:
+                results = self.handler(batch, replica)
+            except Exception as e:
+                print(f"DEBUG - [Scheduler] Handler error on {batch[0].task} batch ({health.name}):", e)
+                error = e
+                results = None
+            self._charge(batch, time.monotonic() - now)
+            health.end(len(batch), error, self.max_consecutive_errors)
+            with self._cond:
+                self._busy -= 1
+                if error is not None:
+                    self.stats["errors"] += 1
+                    self.stats["failed"] += len(batch)
+                sizes = self.stats["batches"]
+                sizes[len(batch)] = sizes.get(len(batch), 0) + 1
+            if error is not None:
+                # No answers to pass on: the jobs are dropped, not processed
+                for job in batch:
+                    self._drop(job, "failed")
+                self._maybe_idle()
+                continue
+            for job, result in zip(batch, results):
+                self._record_latency(job)
+                if job.on_result is not None:
+                    try:
+                        job.on_result(job, result)
+                    except Exception as e:
+                        print(f"DEBUG - [Scheduler] Result callback error on {job.task} job:", e)
+            self._maybe_idle()
+
+    def _record_latency(self, job):
+        latency = time.monotonic() - job.enqueued_at
+        with self._cond:
+            self.stats["processed"] += 1
+            worst = self.stats["max_latency"]
+            worst[job.task] = max(worst.get(job.task, 0.0), latency)
+
+    def replica_report(self):
+        return [health.snapshot() for health in self.replica_stats]
+
+    def _maybe_idle(self):
+        if self.on_idle is not None and self.idle():
+            try:
+                self.on_idle()
+            except Exception as e:
+                print("DEBUG - [Scheduler] Idle callback error:", e)
+
+    def _drop(self, job, reason):
+        print(f"DEBUG - [Scheduler] Dropped {job.task} job ({reason})")
+        if job.on_drop is not None:
+            try:
+                job.on_drop(job, reason)
+            except Exception as e:
+                print(f"DEBUG - [Scheduler] Drop callback error on {job.task} job:", e)
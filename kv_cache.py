@@ -0,0 +1,184 @@
+import collections
+import copy
+import threading
+
+import torch
+
+# ------------------------------
+# KV cache helpers for LLaVA (Qwen2 backbone)
+# ------------------------------
+#
+# model.generate() always prefills the whole prompt, image tokens included, from
+# scratch. These helpers drive the model one forward call at a time instead, so a
+# prefilled KV cache can be kept around and continued from more than once.
+
+
+@torch.inference_mode()
+def embed_prompt(model, input_ids, images=None, image_sizes=None):
+    """
+    Turn a tokenized prompt into input embeddings. IMAGE_TOKEN_INDEX placeholders
+    are replaced by the vision tower's features for the given images.
+    """
+    if images is None:
+        return model.get_model().embed_tokens(input_ids)
+    _, _, _, _, inputs_embeds, _ = model.prepare_inputs_labels_for_multimodal(
+        input_ids, None, None, None, None, images,
+        modalities=["image"] * len(image_sizes), image_sizes=image_sizes,
+    )
+    return inputs_embeds
+
+
+@torch.inference_mode()
+def forward_step(model, input_ids=None, inputs_embeds=None, past_key_values=None):
+    """
+    Run one forward pass on top of past_key_values.
+    Returns (logits of the last position, updated KV cache).
+    """
+    out = model(
+        input_ids=input_ids,
+        inputs_embeds=inputs_embeds,
+        past_key_values=past_key_values,
+        use_cache=True,
+    )
+    return out.logits[:, -1, :], out.past_key_values
+
+
+def fork_cache(past_key_values):
+    """
+    Independent copy of a KV cache. Continuing from a cache extends it in place,
+    so every branch but the last needs its own copy.
+    """
+    return copy.deepcopy(past_key_values)
+
+
+def cache_length(past_key_values):
+    if hasattr(past_key_values, "get_seq_length"):
+        return past_key_values.get_seq_length()
+    return past_key_values[0][0].shape[-2]
+
+
+@torch.inference_mode()
+def greedy_decode(model, logits, past_key_values, max_new_tokens, eos_token_ids):
+    """
+    Greedy decoding from the logits of the last prefilled position.
+    Returns the generated token ids, without the end-of-sequence token.
+    """
+    tokens = []
+    next_token = logits.argmax(dim=-1, keepdim=True)
+    for _ in range(max_new_tokens):
+        token = next_token.item()
+        if token in eos_token_ids:
+            break
+        tokens.append(token)
+        logits, past_key_values = forward_step(model, input_ids=next_token, past_key_values=past_key_values)
+        next_token = logits.argmax(dim=-1, keepdim=True)
+    return tokens
+
+
+def _forked_branches(model, prefix_ids, images, image_sizes, suffixes):
+    """
+    Encode and prefill the image-bearing prefix once, then prefill each suffix
+    (a [1, n] tensor of token ids) on its own fork of the KV cache.
+    Yields (next-token logits, KV cache) per suffix.
+    """
+    inputs_embeds = embed_prompt(model, prefix_ids, images, image_sizes)
+    _, past_key_values = forward_step(model, inputs_embeds=inputs_embeds)
+    for i, suffix_ids in enumerate(suffixes):
+        # The last branch can consume the original cache
+        branch = past_key_values if i == len(suffixes) - 1 else fork_cache(past_key_values)
+        yield forward_step(model, input_ids=suffix_ids, past_key_values=branch)
+
+
+@torch.inference_mode()
+def fork_continuations(model, prefix_ids, images, image_sizes, suffixes, max_new_tokens, eos_token_ids):
+    """
+    Answer each suffix from its own fork of one shared image prefill.
+    Returns one list of generated token ids per suffix.
+    """
+    return [
+        greedy_decode(model, logits, branch, max_new_tokens, eos_token_ids)
+        for logits, branch in _forked_branches(model, prefix_ids, images, image_sizes, suffixes)
+    ]
+
+
+@torch.inference_mode()
+def fork_next_token_logits(model, prefix_ids, images, image_sizes, suffixes):
+    """
+    Like fork_continuations, but stop after the prefill and return the
+    next-token logits ([1, vocab]) per suffix.
+    """
+    return [logits for logits, _ in _forked_branches(model, prefix_ids, images, image_sizes, suffixes)]
+
+
+@torch.inference_mode()
+def continue_from_prefix(model, past_key_values, suffix_ids, images, image_sizes, max_new_tokens, eos_token_ids):
+    """
+    Prefill only the variable suffix of a prompt (image included) on top of an
+    already prefilled prefix, then decode greedily.
+    Returns the generated token ids.
+    """
+    inputs_embeds = embed_prompt(model, suffix_ids, images, image_sizes)
+    logits, past_key_values = forward_step(model, inputs_embeds=inputs_embeds, past_key_values=past_key_values)
+    return greedy_decode(model, logits, past_key_values, max_new_tokens, eos_token_ids)
+
+
+@torch.inference_mode()
+def suffix_logits(model, past_key_values, suffix_ids, images, image_sizes):
+    """
+    Prefill the variable suffix on top of a prefilled prefix and return the
+    next-token logits ([1, vocab]) without decoding.
+    """
+    inputs_embeds = embed_prompt(model, suffix_ids, images, image_sizes)
+    logits, _ = forward_step(model, inputs_embeds=inputs_embeds, past_key_values=past_key_values)
+    return logits
+
+
+# ------------------------------
+# Prefix cache
+# ------------------------------
+
+class PrefixCache:
+    """
+    Prefilled KV state for the invariant text prefix of each task's prompt.
+
+    get() returns a private fork of the cached state, so callers can continue
+    from it freely. Entries are keyed by task and prefix text, so a task asked
+    with several instructions at once (e.g. vehicles with different objectives)
+    keeps one entry per instruction, up to max_entries in total, least recently
+    used first out. invalidate() drops a task's entries (e.g. when the objective changes).
+    tokenize(text) must return a [1, n] tensor of token ids on the model's device.
+    """
+
+    def __init__(self, model, tokenize, max_entries=8):
+        self.model = model
+        self.tokenize = tokenize
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # (task, prefix text) -> KV cache
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "builds": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, task, prefix_text):
+        key = (task, prefix_text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return fork_cache(entry)
+        _, past_key_values = forward_step(self.model, input_ids=self.tokenize(prefix_text))
+        with self._lock:
+            self._entries[key] = past_key_values
+            self.stats["builds"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return fork_cache(past_key_values)
+
+    def invalidate(self, task=None):
+        with self._lock:
+            if task is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == task]:
+                    del self._entries[key]
+            self.stats["invalidations"] += 1
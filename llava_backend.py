@@ -0,0 +1,345 @@
+import contextlib
+import copy
+import time
+import warnings
+
+import torch
+
+# Import LLaVA modules (make sure llava is installed)
+from llava.model.builder import load_pretrained_model
+from llava.mm_utils import process_images, tokenizer_image_token
+from llava.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN
+from llava.conversation import conv_templates
+
+import kv_cache
+from answer_classifier import AnswerClassifier
+from stage_metrics import timed
+
+
+class LlavaBackend:
+    """
+    LLaVA-OneVision behind the fog server.
+
+    preprocess() turns a decoded image into its model input once; answer_batch() answers
+    one task for several frames, answer_shared() several tasks for one frame with a
+    single vision pass. Answers are (label, confidence) pairs, confidence is None in
+    generate mode.
+
+    classify_mode: read the next-token logits of the allowed answers from one forward pass
+    and publish the argmax with its softmax confidence, instead of generating text.
+    prefix_cache: keep the prefilled KV state of each task's system prompt + instruction
+    and only prefill the image and the closing template tokens per frame. The instruction
+    is placed before the image in this mode, and frames are run one at a time.
+
+    use_safetensors: load the weights only from .safetensors files. They are memory-mapped
+    and copied straight to the device, instead of unpickling each .bin shard into host
+    memory first, and a checkpoint without them fails loudly rather than loading slowly.
+
+    To run several replicas, give each its own device (e.g. "cuda:0", "cuda:1").
+    """
+
+    def __init__(self, pretrained="lmms-lab/llava-onevision-qwen2-7b-ov-chat", model_name="llava_qwen",
+                 device="cuda", device_map="cuda", classify_mode=False, prefix_cache=False,
+                 confidence_temperature=1.0, max_new_tokens=16, use_safetensors=True):
+        self.name = device
+        self.pretrained = pretrained
+        self.model_name = model_name
+        self.device = device
+        self.device_map = device_map
+        self.classify_mode = classify_mode
+        self.use_prefix_cache = prefix_cache
+        self.confidence_temperature = confidence_temperature
+        self.max_new_tokens = max_new_tokens
+        self.use_safetensors = use_safetensors
+        self.load_times = {}  # Step -> seconds, for the server's startup report
+        self.tokenizer = None
+        self.model = None
+        self.image_processor = None
+        self.prefix_cache = None
+        self._classifiers = {}
+
+    def on_device(self):
+        """
+        Make this replica's GPU the current device, for code that says plain "cuda".
+        The current device is per thread, so this is entered on every call.
+        """
+        if self.device.startswith("cuda"):
+            return torch.cuda.device(torch.device(self.device))
+        return contextlib.nullcontext()
+
+    def load(self):
+        warnings.filterwarnings("ignore")
+        print(f"DEBUG - Loading pretrained model on {self.device}")
+        start = time.monotonic()
+        # The builder already passes low_cpu_mem_usage=True to from_pretrained, so with a device_map
+        # the weights go from the mapped files to the device without a full copy in host memory
+        kwargs = {"use_safetensors": True} if self.use_safetensors else {}
+        with self.on_device():
+            self.tokenizer, self.model, self.image_processor, _ = load_pretrained_model(
+                self.pretrained, None, self.model_name, device_map=self.device_map, **kwargs)
+        self.load_times["load_pretrained_model"] = time.monotonic() - start
+        start = time.monotonic()
+        print("DEBUG - Setting model to eval()")
+        self.model.eval()
+        # Batched generate pads prompts on the left, tell LLaVA to keep them that way
+        self.model.config.tokenizer_padding_side = "left"
+        self.prefix_cache = kv_cache.PrefixCache(self.model, self.tokenize)
+        self.load_times["setup"] = time.monotonic() - start
+
+    @property
+    def stats(self):
+        return {"prefix_cache": dict(self.prefix_cache.stats)} if self.prefix_cache is not None else {}
+
+    # ------------------------------
+    # Prompts
+    # ------------------------------
+
+    def question(self, instruction):
+        # The prefix cache can only cover text that comes before the image
+        if self.use_prefix_cache:
+            return instruction + "\n" + DEFAULT_IMAGE_TOKEN
+        return DEFAULT_IMAGE_TOKEN + "\n" + instruction
+
+    def build_prompt(self, question):
+        # Fresh conversation template every time to avoid contamination from previous prompts
+        conv = copy.deepcopy(conv_templates["qwen_2"])
+        conv.append_message(conv.roles[0], question)
+        conv.append_message(conv.roles[1], None)
+        return conv.get_prompt()
+
+    def tokenize(self, text):
+        with timed("tokenize"):
+            return tokenizer_image_token(text, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(self.device)
+
+    def end_of_turn_ids(self):
+        ids = {self.tokenizer.eos_token_id, self.tokenizer.convert_tokens_to_ids("<|im_end|>")}
+        ids.discard(None)
+        return ids
+
+    def invalidate(self, task_name=None):
+        """
+        Forget the cached prompt prefix of a task, e.g. because its instruction changed.
+        """
+        if self.prefix_cache is not None:
+            self.prefix_cache.invalidate(task_name)
+
+    # ------------------------------
+    # Inputs
+    # ------------------------------
+
+    def preprocess(self, image):
+        """
+        The model input for one decoded image (process_images), on the device.
+        """
+        with self.on_device():
+            with timed("process_images"):
+                image_tensor = process_images([image], self.image_processor, self.model.config)
+            with timed("to_device"):
+                # A copy from pageable host memory returns once the data has left the host buffer
+                return image_tensor[0].to(dtype=torch.float16, device=self.device)
+
+    def pad_input_ids(self, sequences):
+        """
+        Left-pad tokenized prompts into one batch and build the matching attention mask.
+        Left padding keeps every prompt flush against the tokens generate() appends.
+        """
+        tokenizer = self.tokenizer
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        longest = max(len(seq) for seq in sequences)
+        input_ids = torch.full((len(sequences), longest), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), longest), dtype=torch.long)
+        for i, seq in enumerate(sequences):
+            input_ids[i, longest - len(seq):] = seq
+            attention_mask[i, longest - len(seq):] = 1
+        return input_ids.to(self.device), attention_mask.to(self.device)
+
+    def prepare_batch(self, frames, question, tag=""):
+        """
+        Tokenize the prompt for a batch of prepared frames.
+        Returns (image_tensor, input_ids, attention_mask, image_sizes).
+        """
+        prompt = self.build_prompt(question)
+        print(f"DEBUG - {tag}Prompt: {prompt}")
+        with timed("tokenize"):
+            sequences = [tokenizer_image_token(prompt, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt")] * len(frames)
+            if len(sequences) == 1:
+                input_ids = sequences[0].unsqueeze(0).to(self.device)
+                attention_mask = None
+            else:
+                input_ids, attention_mask = self.pad_input_ids(sequences)
+        image_sizes = [frame.image.size for frame in frames]
+        print(f"DEBUG - {tag}Image sizes: {image_sizes}")
+        return [frame.image_tensor for frame in frames], input_ids, attention_mask, image_sizes
+
+    # ------------------------------
+    # Answers
+    # ------------------------------
+
+    def classifier(self, task):
+        classifier = self._classifiers.get(task.name)
+        if classifier is None:
+            classifier = AnswerClassifier(self.tokenizer, task.choices, self.confidence_temperature)
+            self._classifiers[task.name] = classifier
+        return classifier
+
+    def classify_answer(self, task, row, tag=""):
+        """
+        Returns (label, confidence) from a next-token logits row.
+        """
+        # Reading the logits waits for the forward pass, whatever of it is still running on the GPU lands here
+        with timed("classify"):
+            label, confidence, probs = self.classifier(task).classify_row(row)
+        print(f"DEBUG - {tag}Answer probabilities:", {k: round(v, 3) for k, v in probs.items()})
+        return label, confidence
+
+    def run_model(self, frames, question, tag=""):
+        """
+        Run a single batched generate over the frames.
+        Returns the decoded model output for each frame. A batch of one is the plain single-frame path.
+        """
+        image_tensor, input_ids, attention_mask, image_sizes = self.prepare_batch(frames, question, tag)
+        with timed("generate"):
+            cont = self.model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                images=image_tensor,
+                image_sizes=image_sizes,
+                do_sample=False,
+                temperature=0,
+                max_new_tokens=self.max_new_tokens,
+            )
+
+        with timed("batch_decode"):
+            text_outputs = self.tokenizer.batch_decode(cont, skip_special_tokens=True)
+        print(f"DEBUG - {tag}Model output:", text_outputs)
+        return text_outputs
+
+    def run_classifier(self, frames, question, tag=""):
+        """
+        Run a single batched forward pass over the frames, no decode loop.
+        Returns the next-token logits row for each frame.
+        """
+        image_tensor, input_ids, attention_mask, image_sizes = self.prepare_batch(frames, question, tag)
+        with timed("forward"), torch.inference_mode():
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                images=image_tensor,
+                image_sizes=image_sizes,
+                modalities=["image"] * len(frames),
+            )
+        return out.logits[:, -1, :]
+
+    def prefix_cached_inputs(self, task, frame, question):
+        """
+        Fork the cached prefix KV state for the task and prepare the per-frame suffix.
+        Returns (past_key_values, suffix_ids).
+        """
+        prefix, suffix = split_before_image(self.build_prompt(question))
+        past_key_values = self.prefix_cache.get(task.name, prefix)
+        return past_key_values, self.tokenize(suffix)
+
+    def run_classifier_prefix_cached(self, task, frame, question):
+        """
+        Next-token logits for one frame on top of the cached prompt prefix.
+        """
+        past_key_values, suffix_ids = self.prefix_cached_inputs(task, frame, question)
+        with timed("forward"):
+            return kv_cache.suffix_logits(self.model, past_key_values, suffix_ids,
+                                          [frame.image_tensor], [frame.image.size])[0]
+
+    def run_model_prefix_cached(self, task, frame, question, tag=""):
+        """
+        Answer one frame, reusing the prefilled KV state of the prompt text that comes
+        before the image. Only the image and the closing template tokens are prefilled.
+        Returns the decoded model output.
+        """
+        past_key_values, suffix_ids = self.prefix_cached_inputs(task, frame, question)
+        with timed("generate"):
+            generated = kv_cache.continue_from_prefix(
+                self.model, past_key_values, suffix_ids, [frame.image_tensor], [frame.image.size],
+                max_new_tokens=self.max_new_tokens, eos_token_ids=self.end_of_turn_ids(),
+            )
+
+        with timed("batch_decode"):
+            text_output = self.tokenizer.decode(generated, skip_special_tokens=True)
+        print(f"DEBUG - {tag}Model output (prefix cached):", text_output)
+        return text_output
+
+    def answer_batch(self, task, frames, question, tag=""):
+        """
+        Answer one task for a batch of prepared frames with one model call, either by
+        classifying the next-token logits or by parsing generated text.
+        question is self.question(instruction). Returns one (label, confidence) per frame.
+        """
+        with self.on_device():
+            return self._answer_batch(task, frames, question, tag)
+
+    def _answer_batch(self, task, frames, question, tag):
+        if self.classify_mode and self.use_prefix_cache:
+            rows = [self.run_classifier_prefix_cached(task, frame, question) for frame in frames]
+        elif self.classify_mode:
+            rows = self.run_classifier(frames, question, tag)
+        elif self.use_prefix_cache:
+            text_outputs = [self.run_model_prefix_cached(task, frame, question, tag) for frame in frames]
+        else:
+            text_outputs = self.run_model(frames, question, tag)
+
+        if self.classify_mode:
+            return [self.classify_answer(task, row, tag) for row in rows]
+        return [(task.parse(text), None) for text in text_outputs]
+
+    def answer_shared(self, tasks, frame, instructions, tag=""):
+        """
+        Answer several tasks for one prepared frame with a single vision pass. The image
+        is encoded and prefilled once, then the KV cache is forked into one short
+        continuation per task. Returns one (label, confidence) per task.
+        """
+        with self.on_device():
+            return self._answer_shared(tasks, frame, instructions, tag)
+
+    def _answer_shared(self, tasks, frame, instructions, tag):
+        prompts = [self.build_prompt(DEFAULT_IMAGE_TOKEN + "\n" + instruction) for instruction in instructions]
+        prefix = split_after_image(prompts[0])[0]
+        suffixes = [split_after_image(prompt)[1] for prompt in prompts]
+        print(f"DEBUG - {tag}Prefix: {prefix}")
+
+        prefix_ids = self.tokenize(prefix)
+        with timed("tokenize"):
+            suffix_ids = [
+                torch.tensor([self.tokenizer(suffix).input_ids], dtype=torch.long, device=self.device)
+                for suffix in suffixes
+            ]
+        images, image_sizes = [frame.image_tensor], [frame.image.size]
+        if self.classify_mode:
+            with timed("forward"):
+                rows = kv_cache.fork_next_token_logits(self.model, prefix_ids, images, image_sizes, suffix_ids)
+            return [self.classify_answer(task, row[0], tag) for task, row in zip(tasks, rows)]
+
+        with timed("generate"):
+            generated = kv_cache.fork_continuations(
+                self.model, prefix_ids, images, image_sizes, suffix_ids,
+                max_new_tokens=self.max_new_tokens, eos_token_ids=self.end_of_turn_ids(),
+            )
+        with timed("batch_decode"):
+            text_outputs = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+        print(f"DEBUG - {tag}Model output:", text_outputs)
+        return [(task.parse(text), None) for task, text in zip(tasks, text_outputs)]
+
+
+def split_after_image(prompt):
+    """
+    Split a prompt right after the image token: everything up to and including the image
+    is shared by all questions about the frame, the rest is the per-question suffix.
+    """
+    prefix, suffix = prompt.split(DEFAULT_IMAGE_TOKEN, 1)
+    return prefix + DEFAULT_IMAGE_TOKEN, suffix
+
+
+def split_before_image(prompt):
+    """
+    Split a prompt right before the image token: everything before the image is the same
+    for every frame of a task, the image and the rest change per frame.
+    """
+    prefix, suffix = prompt.split(DEFAULT_IMAGE_TOKEN, 1)
+    return prefix, DEFAULT_IMAGE_TOKEN + suffix
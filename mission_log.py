@@ -0,0 +1,547 @@
+"""
+Mission recorder and replayer for the team24/... MQTT traffic.
+
+A mission is a directory with two append-only files:
+
+    data.log    records, each a kind byte and a fixed header: every distinct image once,
+                and every message as its topic plus the payload bytes that are not image
+    index.bin   one INDEX_DTYPE entry per message, in arrival order: the receive time and
+                where the message's topic, head and image are in data.log
+
+Binary frames (frame_protocol.py) are split after their header, so a frame seen again (the
+same view resent, or retained and delivered to every subscriber) costs a header, not
+another JPEG. Other payloads of IMAGE_MIN_BYTES or more (legacy base64 frames) are stored
+once as a whole. The reader maps data.log with mmap and the index with numpy.memmap, so
+opening a long mission reads neither file and each payload is sliced out on demand.
+
+    python mission_log.py record missions/dive1 --broker localhost:1883
+    python mission_log.py info missions/dive1
+    python mission_log.py replay missions/dive1 --broker localhost:1883 --speed 1
+    python mission_log.py replay missions/dive1 --speed 0 --into-server
+
+replay re-publishes the ROV side of a mission (frames and objectives) at the recorded pace,
+--speed N times faster, or back to back with --speed 0. With --into-server the messages go
+straight into a FogServer with the stand-in model (standin_backend.py) instead of a broker,
+and it reports what the server answered and dropped and its time per stage, so latency and
+result cache experiments run on the same traffic every time.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import frame_protocol
+import stage_metrics
+
+DATA_FILE = "data.log"
+INDEX_FILE = "index.bin"
+
+LOG_MAGIC = b"T24M"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<4sB3x")
+
+IMAGE, MESSAGE = 1, 2
+IMAGE_RECORD = struct.Struct("<BI")          # kind, length; the image follows
+MESSAGE_RECORD = struct.Struct("<BdBHIQI")   # kind, time, flags, topic length, head length, image offset, image length;
+                                             # the topic and the head follow
+INDEX_ENTRY = struct.Struct("<dQHBxIQI")
+INDEX_DTYPE = np.dtype([
+    ("time", "<f8"),           # seconds since the epoch, when the recorder received it
+    ("topic_offset", "<u8"),   # in data.log; the head follows the topic
+    ("topic_length", "<u2"),
+    ("flags", "u1"),           # QoS in bits 0-1, retain in bit 2
+    ("reserved", "u1"),
+    ("head_length", "<u4"),
+    ("image_offset", "<u8"),   # 0 if the message has no image
+    ("image_length", "<u4"),
+])
+assert INDEX_DTYPE.itemsize == INDEX_ENTRY.size
+
+IMAGE_MIN_BYTES = 1024
+
+# The ROV side of a mission: what a fog server takes as input
+REPLAY_TOPICS = ("team24/rov/#", "team24/fog/goal", "team24/fog/+/goal")
+
+
+def split_payload(payload):
+    """
+    (head, image): a binary frame splits after its header, another payload of at least
+    IMAGE_MIN_BYTES is all image, anything else all head.
+    """
+    if frame_protocol.is_binary_frame(payload) and len(payload) >= frame_protocol.HEADER.size:
+        header_len = frame_protocol.HEADER.unpack_from(payload)[5]
+        if frame_protocol.HEADER.size <= header_len <= len(payload):
+            return payload[:header_len], payload[header_len:]
+    if len(payload) >= IMAGE_MIN_BYTES:
+        return b"", payload
+    return payload, b""
+
+
+class Message:
+    """
+    A recorded message, with the attributes of a paho MQTTMessage so it can be handed to
+    an on_message callback.
+    """
+
+    def __init__(self, time, topic, payload, qos=0, retain=False):
+        self.time = time
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+# ------------------------------
+# Recording
+# ------------------------------
+
+def recover(path):
+    """
+    Make a mission consistent after a crash: drop index entries past the end of data.log,
+    index whole message records the index missed and cut a partial record off the end.
+    Returns the number of index entries added.
+    """
+    data_path = os.path.join(path, DATA_FILE)
+    index_path = os.path.join(path, INDEX_FILE)
+    data_size = os.path.getsize(data_path)
+    entries = os.path.getsize(index_path) // INDEX_ENTRY.size if os.path.exists(index_path) else 0
+    end = LOG_HEADER.size
+    with open(index_path, "ab+") as index:
+        while entries:
+            index.seek((entries - 1) * INDEX_ENTRY.size)
+            entry = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+            end = entry[1] + entry[2] + entry[4]
+            if end <= data_size:
+                break
+            entries -= 1
+            end = LOG_HEADER.size
+        index.truncate(entries * INDEX_ENTRY.size)
+
+        added = 0
+        with open(data_path, "rb+") as data:
+            data.seek(end)
+            while True:
+                start = data.tell()
+                kind = data.read(1)
+                if not kind:
+                    break
+                if kind[0] == IMAGE:
+                    header = kind + data.read(IMAGE_RECORD.size - 1)
+                    length = IMAGE_RECORD.unpack(header)[1] if len(header) == IMAGE_RECORD.size else None
+                    if length is None or start + IMAGE_RECORD.size + length > data_size:
+                        data.truncate(start)
+                        break
+                    data.seek(length, os.SEEK_CUR)
+                    continue
+                header = kind + data.read(MESSAGE_RECORD.size - 1)
+                if kind[0] != MESSAGE or len(header) < MESSAGE_RECORD.size:
+                    data.truncate(start)
+                    break
+                _, at, flags, topic_length, head_length, image_offset, image_length = MESSAGE_RECORD.unpack(header)
+                topic_offset = start + MESSAGE_RECORD.size
+                if topic_offset + topic_length + head_length > data_size:
+                    data.truncate(start)
+                    break
+                index.write(INDEX_ENTRY.pack(at, topic_offset, topic_length, flags, head_length,
+                                             image_offset, image_length))
+                added += 1
+                data.seek(topic_length + head_length, os.SEEK_CUR)
+    return added
+
+
+class MissionRecorder:
+    """
+    Appends messages to a mission, creating it if needed. An existing mission is recovered
+    (see recover()) and appended to, and its images are not stored again.
+
+    record() may be called from any thread. Writes are buffered and a background thread
+    flushes them every flush_interval_s, data.log before the index, so a crash loses at
+    most that much, whether or not more messages follow.
+    """
+
+    def __init__(self, path, flush_interval_s=1.0):
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        os.makedirs(path, exist_ok=True)
+        data_path = os.path.join(path, DATA_FILE)
+        self.images = {}  # blake2b digest -> (offset, length) in data.log
+        self.stats = {"messages": 0, "payload_bytes": 0, "images": 0, "images_reused": 0}
+        if os.path.exists(data_path) and os.path.getsize(data_path) > 0:
+            recover(path)
+            with MissionLog(path) as log:
+                for offset, length in set(zip(log.index["image_offset"].tolist(), log.index["image_length"].tolist())):
+                    if length:
+                        self.images[hashlib.blake2b(log.data[offset:offset + length], digest_size=16).digest()] = (offset, length)
+        self._data = open(data_path, "ab")
+        self._index = open(os.path.join(path, INDEX_FILE), "ab")
+        if self._data.tell() == 0:
+            self._data.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        self.offset = self._data.tell()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="mission-flush", daemon=True)
+        self._flusher.start()
+
+    def _store_image(self, image):
+        digest = hashlib.blake2b(image, digest_size=16).digest()
+        stored = self.images.get(digest)
+        if stored is not None:
+            self.stats["images_reused"] += 1
+            return stored
+        self._data.write(IMAGE_RECORD.pack(IMAGE, len(image)))
+        self._data.write(image)
+        stored = self.images[digest] = (self.offset + IMAGE_RECORD.size, len(image))
+        self.offset += IMAGE_RECORD.size + len(image)
+        self.stats["images"] += 1
+        return stored
+
+    def record(self, topic, payload, qos=0, retain=False, at=None):
+        at = time.time() if at is None else at
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif payload is None:
+            payload = b""
+        head, image = split_payload(bytes(payload))
+        topic = topic.encode()
+        flags = (qos & 0x03) | (0x04 if retain else 0)
+        with self._lock:
+            image_offset, image_length = self._store_image(image) if image else (0, 0)
+            self._data.write(MESSAGE_RECORD.pack(MESSAGE, at, flags, len(topic), len(head), image_offset, image_length))
+            self._data.write(topic)
+            self._data.write(head)
+            topic_offset = self.offset + MESSAGE_RECORD.size
+            self.offset = topic_offset + len(topic) + len(head)
+            self._index.write(INDEX_ENTRY.pack(at, topic_offset, len(topic), flags, len(head),
+                                               image_offset, image_length))
+            self.stats["messages"] += 1
+            self.stats["payload_bytes"] += len(payload)
+            self._dirty = True
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval_s):
+            with self._lock:
+                if self._dirty and not self._closed.is_set():
+                    self._flush()
+
+    def _flush(self):
+        self._data.flush()
+        self._index.flush()
+        self._dirty = False
+
+    def close(self):
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+            self._flush()
+            self._data.close()
+            self._index.close()
+        self._flusher.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ------------------------------
+# Reading & Replay
+# ------------------------------
+
+class MissionLog:
+    """
+    Read-only view of a mission. index is the memory-mapped INDEX_DTYPE array, one entry
+    per message; entries a crash left pointing past the end of data.log are left out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, DATA_FILE), "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(LOG_MAGIC)] != LOG_MAGIC:
+            raise ValueError(f"{path} is not a mission log")
+        index_path = os.path.join(path, INDEX_FILE)
+        entries = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+        self.index = (np.memmap(index_path, dtype=INDEX_DTYPE, mode="r", shape=(entries,)) if entries
+                      else np.zeros(0, dtype=INDEX_DTYPE))
+        while entries:
+            last = self.index[entries - 1]
+            if int(last["topic_offset"]) + int(last["topic_length"]) + int(last["head_length"]) <= len(self.data):
+                break
+            entries -= 1
+        self.index = self.index[:entries]
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def times(self):
+        return self.index["time"]
+
+    def topic(self, i):
+        entry = self.index[i]
+        offset = int(entry["topic_offset"])
+        return self.data[offset:offset + int(entry["topic_length"])].decode()
+
+    def payload(self, i):
+        entry = self.index[i]
+        head = int(entry["topic_offset"]) + int(entry["topic_length"])
+        head = self.data[head:head + int(entry["head_length"])]
+        if not entry["image_length"]:
+            return head
+        image = int(entry["image_offset"])
+        return head + self.data[image:image + int(entry["image_length"])]
+
+    def message(self, i):
+        entry = self.index[i]
+        flags = int(entry["flags"])
+        return Message(float(entry["time"]), self.topic(i), self.payload(i), flags & 0x03, bool(flags & 0x04))
+
+    def select(self, topics=None, start_s=None, end_s=None):
+        """
+        Indices of the messages on any of the topic filters (MQTT wildcards allowed, None =
+        all), between start_s and end_s seconds into the mission.
+        """
+        selected = np.arange(len(self))
+        if len(self) and (start_s is not None or end_s is not None):
+            offset = self.times - self.times[0]
+            keep = np.ones(len(self), dtype=bool)
+            if start_s is not None:
+                keep &= offset >= start_s
+            if end_s is not None:
+                keep &= offset <= end_s
+            selected = selected[keep]
+        if topics is not None:
+            matches = {}
+            kept = []
+            for i in selected:
+                topic = self.topic(i)
+                if topic not in matches:
+                    matches[topic] = any(mqtt.topic_matches_sub(pattern, topic) for pattern in topics)
+                if matches[topic]:
+                    kept.append(i)
+            selected = np.array(kept, dtype=np.int64)
+        return selected
+
+    def close(self):
+        self.index = None
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def replay(log, deliver, speed=1.0, indices=None, stop=None):
+    """
+    Call deliver(message) for the messages of log (all, or indices), spaced as they were
+    recorded divided by speed; speed 0 delivers them back to back. Returns how late each
+    delivery was against that schedule, in seconds: near zero while deliver keeps up.
+    """
+    stop = stop or threading.Event()
+    indices = range(len(log)) if indices is None else indices
+    lateness = []
+    start = first = None
+    for i in indices:
+        message = log.message(i)
+        if speed > 0:
+            if start is None:
+                start, first = time.monotonic(), message.time
+            wait = start + (message.time - first) / speed - time.monotonic()
+            if wait > 0 and stop.wait(wait):
+                break
+            lateness.append(max(0.0, -wait))
+        if stop.is_set():
+            break
+        deliver(message)
+    return lateness
+
+
+# ------------------------------
+# Command line
+# ------------------------------
+
+def parse_broker(broker):
+    host, _, port = broker.rpartition(":")
+    return (host, int(port)) if host else (broker, 1883)
+
+
+def connect(args, client_id):
+    client = mqtt.Client(client_id=client_id)
+    if args.username:
+        client.username_pw_set(args.username, args.password)
+    client.connect(*parse_broker(args.broker))
+    return client
+
+
+def record_main(args):
+    recorder = MissionRecorder(args.path)
+    client = connect(args, "mission-recorder")
+    client.on_message = lambda client, userdata, msg: recorder.record(msg.topic, msg.payload, msg.qos, msg.retain)
+    for topic in args.topics:
+        client.subscribe(topic)
+    client.loop_start()
+    print(f"DEBUG - Recording {', '.join(args.topics)} from {args.broker} to {args.path}, Ctrl-C to stop")
+    try:
+        if args.seconds:
+            time.sleep(args.seconds)
+        else:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    recorder.close()
+    print("DEBUG - Recorded:", recorder.stats)
+
+
+def info_main(args):
+    with MissionLog(args.path) as log:
+        if not len(log):
+            print("empty mission")
+            return
+        data_size = len(log.data)
+        topics = {}
+        for i in range(len(log)):
+            entry = log.index[i]
+            counts = topics.setdefault(log.topic(i), [0, 0])
+            counts[0] += 1
+            counts[1] += int(entry["head_length"]) + int(entry["image_length"])
+        images = np.unique(log.index["image_offset"][log.index["image_length"] > 0]).size
+        payload_bytes = sum(size for _, size in topics.values())
+        print(f"{len(log)} messages over {log.times[-1] - log.times[0]:.1f} s, {images} distinct images")
+        print(f"payloads {payload_bytes / 1e6:.1f} MB, log {data_size / 1e6:.1f} MB + index "
+              f"{log.index.nbytes / 1e6:.2f} MB")
+        print(f"{'messages':>8} {'MB':>8}  topic")
+        for topic, (count, size) in sorted(topics.items()):
+            print(f"{count:>8} {size / 1e6:>8.2f}  {topic}")
+
+
+def replay_into_server(log, indices, args):
+    """
+    Feed the messages to a FogServer's on_message with the stand-in model, as the MQTT
+    loop would, and capture what it publishes. Returns (server stats, detail answers and
+    drops, lateness of each delivery).
+    """
+    from bench_e2e import ROUTES
+    from fog_server import FogServer, FogServerConfig
+    from standin_backend import StandInBackend
+
+    config = FogServerConfig(
+        routes=list(ROUTES.values()),
+        max_batch_size=args.batch,
+        result_cache=not args.no_result_cache,
+        metrics_port=None,
+    )
+    backends = [StandInBackend(f"stand-in-{i}", dim=64, layers=1, device_ms=args.device_ms, frame_ms=args.frame_ms)
+                for i in range(args.replicas)]
+    server = FogServer(config, backends)
+    answers = MissionRecorder(args.answers_out) if args.answers_out else None
+    outcomes = {}
+
+    def publish(topic, payload=None, qos=0, retain=False, *a, **kw):
+        if answers is not None:
+            answers.record(topic, payload, qos, retain)
+        if topic.endswith("/detail"):
+            detail = json.loads(payload)
+            outcome = "answered" if detail["label"] is not None else detail["dropped"]
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    server.client.publish = publish
+    stage_metrics.metrics.reset()
+    # The server's debug output would drown the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.load_backends()
+        server.scheduler.start()
+        lateness = replay(log, lambda message: server.on_message(server.client, None, message), args.speed, indices)
+        while not server.scheduler.idle():
+            time.sleep(0.01)
+        server.scheduler.stop()
+    if answers is not None:
+        answers.close()
+    return server.stats(), outcomes, lateness
+
+
+def replay_main(args):
+    topics = None if "#" in args.topics else args.topics
+    with MissionLog(args.path) as log:
+        indices = log.select(topics, args.start_s, args.end_s)
+        pace = f"{args.speed:g}x" if args.speed > 0 else "max speed"
+        print(f"replaying {len(indices)} of {len(log)} messages at {pace}")
+        start = time.monotonic()
+        if args.into_server:
+            stats, outcomes, lateness = replay_into_server(log, indices, args)
+            stages = stats["stages"]
+            print(f"answers and drops per task: {outcomes}")
+            print(f"scheduler: {({key: value for key, value in stats['scheduler'].items() if isinstance(value, int)})}")
+            print(f"result cache hit rate {stats['result_cache']['hit_rate']:.1%}")
+            for stage in ("queue_wait", "inference", "end_to_end"):
+                if stage in stages:
+                    print(f"{stage:>10}: p50 {stages[stage]['p50'] * 1000:.0f} ms, p95 {stages[stage]['p95'] * 1000:.0f} ms")
+        else:
+            client = connect(args, "mission-replayer")
+            client.loop_start()
+            lateness = replay(log, lambda message: client.publish(message.topic, message.payload, message.qos,
+                                                                  message.retain), args.speed, indices)
+            client.loop_stop()
+            client.disconnect()
+        elapsed = time.monotonic() - start
+    if lateness:
+        late = np.array(lateness) * 1000.0
+        print(f"replayed in {elapsed:.1f} s, behind schedule p95 {np.percentile(late, 95):.1f} ms, "
+              f"max {late.max():.1f} ms")
+    else:
+        print(f"replayed in {elapsed:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay fog server missions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="record MQTT traffic into a mission")
+    record.add_argument("path", help="mission directory, appended to if it exists")
+    record.add_argument("--topics", nargs="+", default=["team24/#"])
+    record.add_argument("--seconds", type=float, default=0.0, help="stop after this long (default: Ctrl-C)")
+
+    info = commands.add_parser("info", help="summarize a mission")
+    info.add_argument("path")
+
+    replay_parser = commands.add_parser("replay", help="replay a mission to a broker or into a fog server")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="N times the recorded pace, 0 = back to back")
+    replay_parser.add_argument("--topics", nargs="+", default=list(REPLAY_TOPICS), help="'#' for everything")
+    replay_parser.add_argument("--start-s", type=float, help="seconds into the mission")
+    replay_parser.add_argument("--end-s", type=float)
+    replay_parser.add_argument("--into-server", action="store_true",
+                               help="feed a fog server with the stand-in model instead of a broker")
+    replay_parser.add_argument("--device-ms", type=float, default=300.0, help="stand-in model time per call")
+    replay_parser.add_argument("--frame-ms", type=float, default=20.0, help="stand-in model time per frame of a call")
+    replay_parser.add_argument("--replicas", type=int, default=1)
+    replay_parser.add_argument("--batch", type=int, default=4)
+    replay_parser.add_argument("--no-result-cache", action="store_true")
+    replay_parser.add_argument("--answers-out", help="record what the server published as a mission")
+
+    for command in (record, replay_parser):
+        command.add_argument("--broker", default="localhost:1883", help="host:port")
+        command.add_argument("--username")
+        command.add_argument("--password")
+
+    args = parser.parse_args()
+    {"record": record_main, "info": info_main, "replay": replay_main}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import asyncio
+
+import paho.mqtt.client as mqtt
+
+
+class AsyncioMqttLoop:
+    """
+    Runs a paho MQTT client on an asyncio event loop instead of paho's own network thread.
+
+    paho reports its socket through the on_socket_* callbacks: the event loop watches it,
+    calls loop_read() when data arrives and loop_write() while paho has data to send, and
+    loop_misc() runs once a second for keepalive pings. A lost connection is re-established
+    with exponential backoff, like loop_start() does. Every paho callback (on_connect,
+    on_message, ...) then runs on the event loop thread, so it must hand work off instead of
+    blocking, and publish() must only be called from that thread.
+
+    Create it before client.connect(), from a coroutine running on the loop.
+    """
+
+    def __init__(self, client, min_reconnect_s=1.0, max_reconnect_s=120.0, read_burst=16):
+        self.client = client
+        self.read_burst = read_burst
+        self.loop = asyncio.get_running_loop()
+        self.min_reconnect_s = min_reconnect_s
+        self.max_reconnect_s = max_reconnect_s
+        self._closed = asyncio.Event()
+        self._closing = False
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        self._misc = self.loop.create_task(self._misc_loop())
+
+    def on_socket_open(self, client, userdata, sock):
+        self._closed.clear()
+        self.loop.add_reader(sock, self._read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self._closed.set()
+
+    def _read(self):
+        # loop_read() takes one QoS 0 packet per call; under load the socket holds many
+        for _ in range(self.read_burst):
+            if self.client.loop_read() != mqtt.MQTT_ERR_SUCCESS or self.client.socket() is None:
+                return
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        delay = self.min_reconnect_s
+        while not self._closing:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                delay = self.min_reconnect_s
+                await asyncio.sleep(1.0)
+                continue
+            await asyncio.sleep(delay)
+            if self._closing:
+                break
+            try:
+                print("DEBUG - Reconnecting to MQTT Broker")
+                self.client.reconnect()
+            except OSError as e:
+                print("DEBUG - MQTT reconnect failed:", e)
+                delay = min(2 * delay, self.max_reconnect_s)
+
+    async def disconnect(self, timeout=2.0):
+        """
+        Send DISCONNECT after everything already published and wait for the socket to close.
+        """
+        self._closing = True
+        self._misc.cancel()
+        if self.client.socket() is not None:
+            self.client.disconnect()
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout)
+            except asyncio.TimeoutError:
+                print("DEBUG - MQTT disconnect timed out")
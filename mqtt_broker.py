@@ -0,0 +1,185 @@
+"""
+A minimal MQTT 3.1.1 broker for benchmarks and local testing, no Mosquitto needed.
+
+Enough of the protocol for the fog server, the ROV scripts and the benchmarks: CONNECT
+(credentials are accepted, not checked), SUBSCRIBE/UNSUBSCRIBE with + and # wildcards,
+PUBLISH with retained messages, PINGREQ and DISCONNECT. Messages are delivered at QoS 0;
+a QoS 1 PUBLISH is acknowledged so QoS 1 senders work, QoS 2 is not supported. No
+sessions, wills or persistence. Not meant to face a network.
+
+    python mqtt_broker.py --port 1883
+
+Benchmarks start it in a subprocess with start_broker().
+"""
+import argparse
+import asyncio
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(levels) or (level != "+" and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def packet(packet_type, body, flags=0):
+    return bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body
+
+
+def publish_packet(topic, payload, retain=False):
+    topic = topic.encode()
+    return packet(PUBLISH, struct.pack("!H", len(topic)) + topic + payload, flags=1 if retain else 0)
+
+
+async def read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            break
+    return header >> 4, header & 0x0F, await reader.readexactly(length)
+
+
+class Broker:
+    def __init__(self):
+        self.subscriptions = {}  # writer -> set of topic filters
+        self.retained = {}       # topic -> payload
+        self.stats = {"clients": 0, "received": 0, "delivered": 0}
+
+    def deliver(self, topic, payload):
+        data = None
+        for writer, filters in self.subscriptions.items():
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                data = data or publish_packet(topic, payload)
+                # No drain per subscriber: one slow subscriber must not hold up the publisher
+                writer.write(data)
+                self.stats["delivered"] += 1
+
+    def handle_publish(self, flags, body, writer):
+        qos = (flags >> 1) & 0x03
+        topic_length = struct.unpack("!H", body[:2])[0]
+        topic = body[2:2 + topic_length].decode()
+        offset = 2 + topic_length
+        if qos:
+            writer.write(packet(PUBACK, body[offset:offset + 2]))
+            offset += 2
+        payload = body[offset:]
+        self.stats["received"] += 1
+        if flags & 0x01:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        self.deliver(topic, payload)
+
+    def handle_subscribe(self, body, writer, subscribe):
+        packet_id, offset = body[:2], 2
+        topic_filters = []
+        while offset < len(body):
+            length = struct.unpack("!H", body[offset:offset + 2])[0]
+            topic_filters.append(body[offset + 2:offset + 2 + length].decode())
+            offset += 2 + length + (1 if subscribe else 0)  # Requested QoS byte, granted as 0
+        filters = self.subscriptions[writer]
+        if not subscribe:
+            filters.difference_update(topic_filters)
+            writer.write(packet(UNSUBACK, packet_id))
+            return
+        filters.update(topic_filters)
+        writer.write(packet(SUBACK, packet_id + bytes(len(topic_filters))))
+        for topic, payload in self.retained.items():
+            if any(topic_matches(topic_filter, topic) for topic_filter in topic_filters):
+                writer.write(publish_packet(topic, payload, retain=True))
+
+    async def client(self, reader, writer):
+        self.subscriptions[writer] = set()
+        self.stats["clients"] += 1
+        try:
+            while True:
+                packet_type, flags, body = await read_packet(reader)
+                if packet_type == CONNECT:
+                    writer.write(packet(CONNACK, b"\x00\x00"))
+                elif packet_type == PUBLISH:
+                    self.handle_publish(flags, body, writer)
+                elif packet_type in (SUBSCRIBE, UNSUBSCRIBE):
+                    self.handle_subscribe(body, writer, packet_type == SUBSCRIBE)
+                elif packet_type == PINGREQ:
+                    writer.write(packet(PINGRESP, b""))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.subscriptions[writer]
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def free_port(host="127.0.0.1"):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_broker(host="127.0.0.1", port=None, timeout=5.0):
+    """
+    Run the broker in a subprocess, so it does not share the benchmark's interpreter.
+    Returns (process, port) once it accepts connections; stop it with process.terminate().
+    """
+    port = port or free_port(host)
+    process = subprocess.Popen([sys.executable, __file__, "--host", host, "--port", str(port)])
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return process, port
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError(f"MQTT broker stand-in did not start on {host}:{port}")
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal MQTT broker for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    try:
+        asyncio.run(Broker().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
-import base64
-import io
 import sys
 from PIL import Image, ImageTk
 import tkinter as tk
 import paho.mqtt.client as mqtt
 
+from frame_protocol import decode_frame
+
 # -------- MQTT Configuration --------
 MQTT_BROKER = "yourBrokerDomainOrIp"       # Replace with your broker
 MQTT_PORT = 1883
@@ -20,8 +20,8 @@ class ImageViewer:
         self.label = tk.Label(self.root)
         self.label.pack()
 
-    def update_image(self, image_data):
-        image = Image.open(io.BytesIO(image_data))
+    def update_image(self, image_file):
+        image = Image.open(image_file)
         photo = ImageTk.PhotoImage(image)
         self.label.config(image=photo)
         self.label.image = photo  # Prevent garbage collection
@@ -41,9 +41,9 @@ def on_connect(client, userdata, flags, rc):
 
 def on_message(client, userdata, msg):
     try:
-        base64_str = msg.payload.decode("utf-8")
-        image_data = base64.b64decode(base64_str)
-        viewer.update_image(image_data)
+        # Binary frame or legacy base64 string, decode_frame tells them apart
+        frame = decode_frame(msg.payload)
+        viewer.update_image(frame.open())
         print("Image updated")
     except Exception as e:
         print(f"Failed to process message: {e}")
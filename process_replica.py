@@ -0,0 +1,94 @@
+import multiprocessing
+import threading
+
+
+def _serve(factory, conn):
+    """
+    Child process: build the backend and answer forwarded calls until told to stop.
+    """
+    backend = factory()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        name, args, kwargs = request
+        try:
+            conn.send((True, getattr(backend, name)(*args, **kwargs)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class ProcessReplica:
+    """
+    A backend (llava_backend.LlavaBackend, standin_backend.StandInBackend) hosted in its own
+    process. On a CPU-only host, replicas running as threads share one interpreter and contend
+    for the GIL in the Python parts of inference; process replicas do not.
+
+    factory is a picklable callable that returns an unloaded backend, e.g.
+    functools.partial(StandInBackend, dim=1024). Calls are forwarded over a pipe, so their
+    arguments and results must be picklable. A call that fails in the child raises RuntimeError.
+    """
+
+    def __init__(self, factory, name=None):
+        self.factory = factory
+        self.name = name or "process-replica"
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()  # One call in flight per pipe
+
+    def load(self):
+        # spawn, not fork: CUDA and threads do not survive a fork
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_serve, args=(self.factory, child_conn), name=self.name, daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._call("load")
+
+    def close(self):
+        if self._process is None:
+            return
+        with self._lock:
+            try:
+                self._conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+
+    def _call(self, name, *args, **kwargs):
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                raise RuntimeError(f"{self.name} is not running")
+            self._conn.send((name, args, kwargs))
+            ok, result = self._conn.recv()
+        if not ok:
+            raise RuntimeError(f"{self.name}: {result}")
+        return result
+
+    @property
+    def stats(self):
+        try:
+            return self._call("__getattribute__", "stats")
+        except RuntimeError:
+            return {}
+
+    def question(self, instruction):
+        return self._call("question", instruction)
+
+    def invalidate(self, task_name=None):
+        self._call("invalidate", task_name)
+
+    def preprocess(self, image):
+        return self._call("preprocess", image)
+
+    def answer_batch(self, task, frames, question, tag=""):
+        return self._call("answer_batch", task, frames, question, tag)
+
+    def answer_shared(self, tasks, frame, instructions, tag=""):
+        return self._call("answer_shared", tasks, frame, instructions, tag)
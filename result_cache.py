@@ -0,0 +1,98 @@
+import collections
+import threading
+import time
+
+from PIL import Image
+
+# ------------------------------
+# Perceptual hash
+# ------------------------------
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash: shrink to (hash_size + 1) x hash_size greyscale and record whether
+    each pixel is brighter than its right neighbour. Near-identical frames (sensor noise,
+    small JPEG differences) land within a few bits of each other.
+    Returns a hash_size * hash_size bit integer.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# ------------------------------
+# Result cache
+# ------------------------------
+
+class ResultCache:
+    """
+    Bounded LRU of model answers keyed on (vehicle, task, objective, perceptual hash).
+
+    lookup() returns a stored answer for the same vehicle, task and objective whose frame
+    hash is within max_distance bits of the new frame and that is younger than ttl_s
+    seconds. Vehicles do not share answers: two ROVs in different places can send frames
+    that hash alike. store() records the inference time the answer cost, so each hit can
+    be credited with the latency it saved. Every lookup counts towards the hit rate,
+    including a second look for a frame that missed once.
+    """
+
+    def __init__(self, max_entries=64, max_distance=4, ttl_s=10.0):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl_s = ttl_s
+        self._entries = collections.OrderedDict()  # (vehicle, task, objective, hash) -> (result, stored_at, cost_s)
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "expired": 0, "evictions": 0, "clears": 0, "saved_s": 0.0}
+
+    def lookup(self, task, objective, frame_hash, vehicle_id=None):
+        now = time.monotonic()
+        with self._lock:
+            self.stats["lookups"] += 1
+            best_key, best_distance = None, self.max_distance + 1
+            for key, (_, stored_at, _) in list(self._entries.items()):
+                if now - stored_at > self.ttl_s:
+                    del self._entries[key]
+                    self.stats["expired"] += 1
+                    continue
+                if key[:3] != (vehicle_id, task, objective):
+                    continue
+                distance = hamming(key[3], frame_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            result, _, cost_s = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self.stats["hits"] += 1
+            self.stats["saved_s"] += cost_s
+            return result
+
+    def store(self, task, objective, frame_hash, result, cost_s, vehicle_id=None):
+        with self._lock:
+            key = (vehicle_id, task, objective, frame_hash)
+            self._entries[key] = (result, time.monotonic(), cost_s)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats["clears"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
@@ -0,0 +1,182 @@
+"""
+Per-stage latency histograms for the fog server.
+
+Every stage a frame goes through (queue wait, decode, resize, process_images, transfer to
+the device, tokenize, the model call, batch_decode, publish) is timed with
+
+    with stage_metrics.timed("decode"):
+        ...
+
+into the process-wide registry stage_metrics.metrics. Each stage keeps an HDR-style
+histogram: log-linear buckets, so recording is a couple of integer operations and a
+percentile is within about 3% of the recorded value from microseconds to minutes, with
+a fixed, small memory footprint no matter how many frames are recorded.
+
+The fog server publishes p50/p95/p99 per stage on its stats topic and serves them as
+Prometheus text (see prometheus_text() and FogServerConfig.metrics_port). Backends
+hosted in another process (process_replica.py) record into that process's registry,
+which the server does not see.
+"""
+import contextlib
+import threading
+import time
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    Durations in whole microseconds. Values below 2**precision_bits are counted exactly;
+    above, every power of two is split into 2**(precision_bits - 1) linear buckets, so a
+    bucket is at most 1/2**(precision_bits - 1) of its value wide.
+    """
+
+    def __init__(self, precision_bits=6):
+        self.precision_bits = precision_bits
+        self.exact = 1 << precision_bits
+        self.half = self.exact >> 1
+        self.counts = [0] * self.exact
+        self.count = 0
+        self.sum_s = 0.0
+        self.max_s = 0.0
+        self._lock = threading.Lock()
+
+    def _index(self, us):
+        if us < self.exact:
+            return us
+        shift = us.bit_length() - self.precision_bits
+        return self.exact + (shift - 1) * self.half + ((us >> shift) - self.half)
+
+    def _upper_us(self, index):
+        # Highest value that lands in bucket index
+        if index < self.exact:
+            return index
+        shift, offset = divmod(index - self.exact, self.half)
+        shift += 1
+        return (((self.half + offset) + 1) << shift) - 1
+
+    def record(self, seconds):
+        us = max(0, int(seconds * 1e6))
+        index = self._index(us)
+        with self._lock:
+            if index >= len(self.counts):
+                self.counts.extend([0] * (index + 1 - len(self.counts)))
+            self.counts[index] += 1
+            self.count += 1
+            self.sum_s += seconds
+            if seconds > self.max_s:
+                self.max_s = seconds
+
+    def percentiles(self, quantiles=QUANTILES):
+        """
+        {quantile: seconds}, each the upper end of the bucket the quantile falls in
+        (never above the largest value recorded).
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            max_s = self.max_s
+        result = {}
+        if not total:
+            return {q: 0.0 for q in quantiles}
+        targets = sorted(quantiles)
+        seen = 0
+        i = 0
+        for index, count in enumerate(counts):
+            seen += count
+            while i < len(targets) and seen >= targets[i] * total and count:
+                result[targets[i]] = min(self._upper_us(index) / 1e6, max_s)
+                i += 1
+            if i == len(targets):
+                break
+        for q in targets[i:]:
+            result[q] = max_s
+        return result
+
+    def snapshot(self):
+        percentiles = self.percentiles()
+        with self._lock:
+            count, sum_s, max_s = self.count, self.sum_s, self.max_s
+        return {
+            "count": count,
+            "mean": sum_s / count if count else 0.0,
+            "p50": percentiles[0.5],
+            "p95": percentiles[0.95],
+            "p99": percentiles[0.99],
+            "max": max_s,
+            "sum": sum_s,
+        }
+
+
+class StageMetrics:
+    """
+    One LatencyHistogram per stage name, created on first use.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, stage):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(stage, LatencyHistogram())
+        return histogram
+
+    def record(self, stage, seconds):
+        self.histogram(stage).record(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    def snapshot(self):
+        """
+        {stage: {"count", "mean", "p50", "p95", "p99", "max", "sum"}}, in seconds.
+        """
+        return {stage: histogram.snapshot() for stage, histogram in sorted(self.stages.items())}
+
+    def prometheus_text(self, counters=None, gauges=None):
+        """
+        The stages as one Prometheus summary (fog_stage_seconds{stage=...}) in the text
+        exposition format. counters and gauges are {metric name: {label value: number}} of
+        extra series, labelled by "event" and "name" respectively.
+        """
+        lines = [
+            "# HELP fog_stage_seconds Time spent in each fog server stage.",
+            "# TYPE fog_stage_seconds summary",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            percentiles = histogram.percentiles()
+            for q in QUANTILES:
+                lines.append(f'fog_stage_seconds{{stage="{stage}",quantile="{q}"}} {percentiles[q]:.6f}')
+            snapshot = histogram.snapshot()
+            lines.append(f'fog_stage_seconds_sum{{stage="{stage}"}} {snapshot["sum"]:.6f}')
+            lines.append(f'fog_stage_seconds_count{{stage="{stage}"}} {snapshot["count"]}')
+        for kind, label, series in (("counter", "event", counters or {}), ("gauge", "name", gauges or {})):
+            for metric, values in sorted(series.items()):
+                lines.append(f"# TYPE {metric} {kind}")
+                for key, value in sorted(values.items()):
+                    lines.append(f'{metric}{{{label}="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+# The process-wide registry every stage records into
+metrics = StageMetrics()
+
+
+def timed(stage):
+    return metrics.timed(stage)
+
+
+def record(stage, seconds):
+    metrics.record(stage, seconds)
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+
+from stage_metrics import timed
+
+# Same placeholder LLaVA uses (llava.constants.DEFAULT_IMAGE_TOKEN), without importing llava
+IMAGE_TOKEN = "<image>"
+
+
+class StandInBackend:
+    """
+    Drop-in replacement for llava_backend.LlavaBackend with no model weights, for benchmarks
+    and for running the fog server on a host without a GPU.
+
+    A stack of dense layers over a tiny greyscale thumbnail stands in for the vision encoder
+    and the language model, so each call costs real CPU time that grows with the batch.
+    device_ms adds a sleep per call, and frame_ms one per frame of the call, to stand in for
+    time spent on an accelerator, during which the calling thread holds no CPU. Answers are deterministic per image but carry
+    no meaning.
+    """
+
+    def __init__(self, name="stand-in", dim=512, layers=8, device_ms=0.0, frame_ms=0.0, seed=24):
+        self.name = name
+        self.dim = dim
+        self.layers = layers
+        self.device_ms = device_ms
+        self.frame_ms = frame_ms
+        self.seed = seed
+        self.weights = None
+        self.calls = 0
+        self.frames = 0
+
+    def load(self):
+        rng = np.random.default_rng(self.seed)
+        scale = 1.0 / np.sqrt(self.dim)
+        self.weights = [(rng.standard_normal((self.dim, self.dim)) * scale).astype(np.float32)
+                        for _ in range(self.layers)]
+
+    @property
+    def stats(self):
+        return {"stand_in": {"calls": self.calls, "frames": self.frames}}
+
+    def question(self, instruction):
+        return IMAGE_TOKEN + "\n" + instruction
+
+    def invalidate(self, task_name=None):
+        pass
+
+    def preprocess(self, image):
+        # dim greyscale pixels in [0, 1], from a thumbnail as close to square as dim allows
+        width = int(np.sqrt(self.dim))
+        height = self.dim // width
+        with timed("process_images"):
+            thumbnail = np.asarray(image.convert("L").resize((width, height)), dtype=np.float32).ravel() / 255.0
+            features = np.zeros(self.dim, dtype=np.float32)
+            features[:thumbnail.size] = thumbnail
+        return features
+
+    def forward(self, features):
+        with timed("forward"):
+            hidden = features
+            for weights in self.weights:
+                hidden = np.tanh(hidden @ weights)
+            if self.device_ms or self.frame_ms:
+                time.sleep((self.device_ms + self.frame_ms * len(features)) / 1000.0)
+        self.calls += 1
+        self.frames += len(features)
+        return hidden
+
+    def answer(self, task, hidden):
+        labels = list(task.choices)
+        logits = 4.0 * hidden[:len(labels)]
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        best = int(probs.argmax())
+        return labels[best], float(probs[best])
+
+    def answer_batch(self, task, frames, question, tag=""):
+        hidden = self.forward(np.stack([frame.image_tensor for frame in frames]))
+        return [self.answer(task, row) for row in hidden]
+
+    def answer_shared(self, tasks, frame, instructions, tag=""):
+        hidden = self.forward(frame.image_tensor[None, :])[0]
+        # One cheap head per task on top of the shared pass, like the forked continuations
+        return [self.answer(task, np.roll(hidden, i)) for i, task in enumerate(tasks)]
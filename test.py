@@ -11,6 +11,8 @@ import torch
 import warnings
 import time
 
+from stage_metrics import metrics, timed
+
 warnings.filterwarnings("ignore")
 
 pretrained = "lmms-lab/llava-onevision-qwen2-7b-ov-chat"
@@ -31,10 +33,12 @@ image = Image.open(requests.get(url, stream=True).raw).convert("RGB").resize((36
 
 start_time = time.time()
 print("DEBUG - Converting image to tensor")
-image_tensor = process_images([image], image_processor, model.config)
+with timed("process_images"):
+    image_tensor = process_images([image], image_processor, model.config)
 
 print("DEBUG - Converting tensor to float16 on CUDA")
-image_tensor = [_image.to(dtype=torch.float16, device=device) for _image in image_tensor]
+with timed("to_device"):
+    image_tensor = [_image.to(dtype=torch.float16, device=device) for _image in image_tensor]
 
 conv_template = "qwen_2"
 question = DEFAULT_IMAGE_TOKEN + "\nJust answer with 'Yes' or 'No'. Is there a Coca-Cola can in this image?"
@@ -51,26 +55,31 @@ print("DEBUG - Getting prompt from conversation")
 prompt_question = conv.get_prompt()
 
 print("DEBUG - Tokenizing input")
-input_ids = tokenizer_image_token(prompt_question, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(device)
+with timed("tokenize"):
+    input_ids = tokenizer_image_token(prompt_question, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(device)
 
 image_sizes = [image.size]
 print(f"DEBUG - Image sizes: {image_sizes}")
 
 print("DEBUG - Calling model.generate()")
-cont = model.generate(
-    input_ids,
-    images=image_tensor,
-    image_sizes=image_sizes,
-    do_sample=False,
-    temperature=0,
-    max_new_tokens=16,
-)
+with timed("generate"):
+    cont = model.generate(
+        input_ids,
+        images=image_tensor,
+        image_sizes=image_sizes,
+        do_sample=False,
+        temperature=0,
+        max_new_tokens=16,
+    )
 
 print("DEBUG - Decoding generated tokens")
-text_outputs = tokenizer.batch_decode(cont, skip_special_tokens=True)
+with timed("batch_decode"):
+    text_outputs = tokenizer.batch_decode(cont, skip_special_tokens=True)
 
 print("DEBUG - Output:")
 print(text_outputs)
 
 end_time = time.time()
 print(f"DEBUG - Time taken: {end_time - start_time:.2f} seconds")
+for stage, timing in metrics.snapshot().items():
+    print(f"DEBUG - {stage}: {timing['sum'] * 1000:.1f} ms")
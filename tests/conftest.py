@@ -0,0 +1,19 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROV = os.path.join(ROOT, "ROV")
+
+sys.path.insert(0, ROOT)
+
+
+def load_rov_module(name):
+    """
+    Import ROV/<name>.py as rov_<name>. The ROV keeps its own copies of some fog server
+    modules under the same names, so ROV/ cannot simply go on sys.path next to the root.
+    """
+    spec = importlib.util.spec_from_file_location(f"rov_{name}", os.path.join(ROV, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
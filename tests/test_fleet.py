@@ -0,0 +1,24 @@
+from fleet import DEFAULT_VEHICLE, split_vehicle_topic, vehicle_topic
+
+BASE_TOPICS = ["team24/rov/camera", "team24/rov/objective", "team24/fog/result", "team24/fog/result/detail"]
+
+
+def test_the_default_vehicle_keeps_the_original_topics():
+    for topic in BASE_TOPICS:
+        assert vehicle_topic(topic, DEFAULT_VEHICLE) == topic
+        assert split_vehicle_topic(topic, BASE_TOPICS) == (DEFAULT_VEHICLE, topic)
+
+
+def test_vehicle_topics_round_trip():
+    assert vehicle_topic("team24/rov/camera", "rov2") == "team24/rov/rov2/camera"
+    assert vehicle_topic("team24/fog/result/detail", "rov2") == "team24/fog/rov2/result/detail"
+    for topic in BASE_TOPICS:
+        assert split_vehicle_topic(vehicle_topic(topic, "rov2"), BASE_TOPICS) == ("rov2", topic)
+
+
+def test_unknown_topics_and_wildcards_do_not_match():
+    assert split_vehicle_topic("team24/rov/rov2/unknown", BASE_TOPICS) == (None, None)
+    assert split_vehicle_topic("team24/rov/rov2/camera/extra", BASE_TOPICS) == (None, None)
+    assert split_vehicle_topic("team24", BASE_TOPICS) == (None, None)
+    assert split_vehicle_topic(vehicle_topic("team24/rov/camera", "+"), BASE_TOPICS) == (None, None)
+    assert split_vehicle_topic("team24/rov//camera", BASE_TOPICS) == (None, None)
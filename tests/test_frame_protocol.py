@@ -0,0 +1,22 @@
+import frame_protocol
+from conftest import load_rov_module
+
+rov_frame_protocol = load_rov_module("frame_protocol")
+
+
+def test_rov_frames_decode_on_the_server():
+    image = b"\xff\xd8 not really a jpeg \xff\xd9"
+    for task in rov_frame_protocol.TASK_CODES:
+        for codec in rov_frame_protocol.CODEC_CODES:
+            payload = rov_frame_protocol.encode_frame(image, task, 1280, 720, 412, 1712345678.25, codec=codec)
+            frame = frame_protocol.decode_frame(payload, default_task="navcam")
+            assert frame.version == frame_protocol.VERSION
+            assert (frame.task, frame.codec) == (task, codec)
+            assert (frame.width, frame.height) == (1280, 720)
+            assert (frame.frame_id, frame.timestamp) == (412, 1712345678.25)
+            assert bytes(frame.data) == image
+
+
+def test_rov_frame_ids_wrap_like_the_server_echoes_them():
+    payload = rov_frame_protocol.encode_frame(b"", "navcam", 1, 1, 2 ** 32 + 7, 0.0)
+    assert frame_protocol.decode_frame(payload).frame_id == 7
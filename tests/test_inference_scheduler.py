@@ -0,0 +1,169 @@
+import threading
+import time
+
+from inference_scheduler import InferenceJob, InferenceScheduler
+
+
+def finished():
+    """
+    A job callback and a way to wait for it: on_result and on_drop both release.
+    """
+    done = threading.Semaphore(0)
+    return (lambda *args: done.release()), done
+
+
+def test_snapshot_is_a_copy():
+    scheduler = InferenceScheduler(lambda batch, replica: [None] * len(batch))
+    callback, done = finished()
+    scheduler.start()
+    try:
+        scheduler.submit(InferenceJob("navcam", b"", 5.0, on_result=callback))
+        assert done.acquire(timeout=5.0)
+    finally:
+        scheduler.stop(1.0)
+    report = scheduler.snapshot()
+    assert report["processed"] == 1
+    assert report["batches"] == {1: 1}
+    report["batches"][1] = 99
+    report["max_latency"].clear()
+    assert scheduler.stats["batches"] == {1: 1}
+    assert "navcam" in scheduler.stats["max_latency"]
+
+
+def test_failing_callbacks_do_not_stop_the_worker():
+    def broken(*args):
+        raise ValueError("callback bug")
+
+    scheduler = InferenceScheduler(lambda batch, replica: [None] * len(batch), on_idle=broken)
+    callback, done = finished()
+    scheduler.start()
+    try:
+        scheduler.submit(InferenceJob("navcam", b"", 5.0, on_result=broken))
+        scheduler.submit(InferenceJob("navcam", b"", -1.0, on_drop=broken))
+        scheduler.submit(InferenceJob("navcam", b"", 5.0, on_result=callback))
+        assert done.acquire(timeout=5.0)
+    finally:
+        scheduler.stop(1.0)
+    assert scheduler.stats["processed"] == 2
+    assert scheduler.stats["expired"] == 1
+
+
+def test_expired_jobs_leave_a_full_queue_first():
+    dropped = []
+    scheduler = InferenceScheduler(lambda batch, replica: [None] * len(batch), max_queue=2)
+    for _ in range(2):
+        scheduler.submit(InferenceJob("camera", b"", 0.01, on_drop=lambda job, reason: dropped.append(reason)))
+    time.sleep(0.05)
+    assert scheduler.submit(InferenceJob("camera", b"", 5.0))
+    assert dropped == ["expired", "expired"]
+    assert scheduler.qsize() == 1
+    assert scheduler.stats["expired"] == 2
+    assert scheduler.stats["rejected"] == scheduler.stats["evicted"] == 0
+
+
+def test_failed_batches_are_dropped_not_processed():
+    def broken(batch, replica):
+        raise RuntimeError("out of memory")
+
+    results, reasons = [], []
+    callback, done = finished()
+    scheduler = InferenceScheduler(broken)
+    scheduler.start()
+    try:
+        scheduler.submit(InferenceJob("navcam", b"", 5.0, on_result=lambda job, result: results.append(result),
+                                      on_drop=lambda job, reason: (reasons.append(reason), callback())))
+        assert done.acquire(timeout=5.0)
+    finally:
+        scheduler.stop(1.0)
+    assert results == []
+    assert reasons == ["failed"]
+    assert scheduler.stats["processed"] == 0
+    assert scheduler.stats["failed"] == 1
+    assert scheduler.stats["errors"] == 1
+    assert scheduler.stats["max_latency"] == {}
+
+
+def recorder(drops):
+    """
+    An on_drop callback that notes (flow, deadline_s, reason) in drops.
+    """
+    return lambda job, reason: drops.append((job.flow, round(job.deadline - job.enqueued_at, 1), reason))
+
+
+def test_fair_share_evicts_from_the_heaviest_flow():
+    drops = []
+    scheduler = InferenceScheduler(lambda batch, replica: [None] * len(batch), max_queue=3, fair_share=True)
+    for deadline_s in (1.0, 2.0, 3.0):
+        assert scheduler.submit(InferenceJob("navcam", b"", deadline_s, on_drop=recorder(drops), flow="a"))
+    # Less urgent than everything queued, but flow b has nothing queued yet
+    assert scheduler.submit(InferenceJob("navcam", b"", 9.0, on_drop=recorder(drops), flow="b"))
+    assert drops == [("a", 3.0, "evicted")]
+    report = scheduler.flow_report()
+    assert (report["a"]["queued"], report["b"]["queued"]) == (2, 1)
+    # The flows are now even: a newcomer has to win on urgency like anyone else
+    assert not scheduler.submit(InferenceJob("navcam", b"", 9.0, on_drop=recorder(drops), flow="b"))
+    assert drops[-1] == ("b", 9.0, "full")
+    assert scheduler.stats["evicted"] == 1
+    assert scheduler.stats["rejected"] == 1
+
+
+def test_without_fair_share_the_least_urgent_job_is_rejected():
+    drops = []
+    scheduler = InferenceScheduler(lambda batch, replica: [None] * len(batch), max_queue=3)
+    for deadline_s in (1.0, 2.0, 3.0):
+        scheduler.submit(InferenceJob("navcam", b"", deadline_s, on_drop=recorder(drops), flow="a"))
+    assert not scheduler.submit(InferenceJob("navcam", b"", 9.0, on_drop=recorder(drops), flow="b"))
+    assert drops == [("b", 9.0, "full")]
+
+
+def test_a_flow_only_competes_with_itself_at_its_limit():
+    drops = []
+    scheduler = InferenceScheduler(lambda batch, replica: [None] * len(batch), max_queue=8,
+                                   fair_share=True, max_queue_per_flow=2)
+    for deadline_s in (2.0, 3.0):
+        scheduler.submit(InferenceJob("navcam", b"", deadline_s, on_drop=recorder(drops), flow="a"))
+    # At its limit, a flow's new job only replaces a less urgent job of its own
+    assert not scheduler.submit(InferenceJob("navcam", b"", 5.0, on_drop=recorder(drops), flow="a"))
+    assert scheduler.submit(InferenceJob("navcam", b"", 1.0, on_drop=recorder(drops), flow="a"))
+    assert drops == [("a", 5.0, "full"), ("a", 3.0, "evicted")]
+    # Other flows are not held back by it
+    assert scheduler.submit(InferenceJob("navcam", b"", 9.0, on_drop=recorder(drops), flow="b"))
+    assert scheduler.qsize() == 3
+
+
+def test_conflation_keeps_only_the_newest_job_per_flow_and_task():
+    drops = []
+    scheduler = InferenceScheduler(lambda batch, replica: [None] * len(batch), max_queue=2, conflate=True)
+    first = InferenceJob("navcam", b"1", 1.0, on_drop=recorder(drops), flow="rov1")
+    newest = InferenceJob("navcam", b"2", 2.0, on_drop=recorder(drops), flow="rov1")
+    assert scheduler.submit(first)
+    assert scheduler.submit(newest)
+    assert drops == [("rov1", 1.0, "conflated")]
+    assert scheduler.qsize() == 1
+    # Other tasks and other flows keep their own place
+    assert scheduler.submit(InferenceJob("camera", b"", 2.0, on_drop=recorder(drops), flow="rov1"))
+    assert scheduler.qsize() == 2
+    # A full queue still takes the newer frame of a queued flow and task
+    assert scheduler.submit(InferenceJob("navcam", b"3", 3.0, on_drop=recorder(drops), flow="rov1"))
+    assert drops[-1] == ("rov1", 2.0, "conflated")
+    assert scheduler.qsize() == 2
+    assert not scheduler.submit(InferenceJob("camera", b"", 9.0, on_drop=recorder(drops), flow="rov2"))
+    assert drops[-1] == ("rov2", 9.0, "full")
+    assert (scheduler.stats["conflated"], scheduler.stats["rejected"], scheduler.stats["evicted"]) == (2, 1, 0)
+
+
+def test_conflated_job_is_the_one_processed():
+    payloads = []
+    scheduler = InferenceScheduler(lambda batch, replica: [payloads.append(job.payload) for job in batch],
+                                   conflate=True)
+    callback, done = finished()
+    for payload in (b"1", b"2", b"3"):
+        scheduler.submit(InferenceJob("navcam", payload, 5.0, on_result=callback, on_drop=callback, flow="rov1"))
+    scheduler.start()
+    try:
+        for _ in range(3):
+            assert done.acquire(timeout=5.0)
+    finally:
+        scheduler.stop(1.0)
+    assert payloads == [b"3"]
+    assert scheduler.stats["processed"] == 1
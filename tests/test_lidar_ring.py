@@ -0,0 +1,109 @@
+import math
+
+import numpy as np
+import pytest
+
+from conftest import load_rov_module
+
+lidar_ring = load_rov_module("lidar_ring")
+
+
+@pytest.fixture
+def rings(tmp_path):
+    """
+    A writer's ring with 4 slots and a reader mapping the same file.
+    """
+    path = str(tmp_path / "lidar")
+    writer = lidar_ring.LidarRing.create(path, slots=4, max_points=16)
+    reader = lidar_ring.LidarRing.open(path)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def test_scans_round_trip(rings):
+    writer, reader = rings
+    assert reader.latest() is None
+    seq = writer.write([1.0, 2.0, math.inf], angle_min=-math.pi, angle_increment=0.5,
+                       range_min=0.1, range_max=12.0, timestamp=100.0)
+    scan = reader.latest()
+    assert (scan.seq, scan.timestamp, scan.angle_min, scan.angle_increment) == (seq, 100.0, -math.pi, 0.5)
+    assert (scan.range_min, scan.range_max) == (0.1, 12.0)
+    assert scan.ranges.tolist() == [1.0, 2.0, math.inf]
+    assert scan.range_at(-math.pi + 0.6) == 2.0
+    assert scan.range_at(-math.pi + 1.1) is None  # inf is no return
+    assert scan.range_at(math.pi) is None          # no such ray
+
+
+def test_long_scans_are_cut_to_max_points(rings):
+    writer, reader = rings
+    writer.write(np.arange(40), angle_min=0.0, angle_increment=0.1)
+    assert reader.latest().ranges.tolist() == list(range(16))
+
+
+def test_old_scans_are_overwritten(rings):
+    writer, reader = rings
+    for i in range(1, 11):
+        writer.write([float(i)], angle_min=0.0, angle_increment=0.1)
+    assert reader.latest_seq() == 10
+    assert reader.read(6) is None  # Its slot now holds scan 10
+    assert reader.read(11) is None
+    assert [scan.ranges[0] for scan in reader.recent(8)] == [7.0, 8.0, 9.0, 10.0]
+    assert reader.latest().ranges.tolist() == [10.0]
+
+
+def test_a_slot_being_written_is_skipped(rings):
+    writer, reader = rings
+    seq = writer.write([1.0], angle_min=0.0, angle_increment=0.1)
+    lidar_ring.SEQ.pack_into(writer._mm, writer._slot_offset(seq % writer.slots), 0)
+    assert reader.read(seq) is None
+
+
+class Overtaken:
+    """
+    Stands in for a slot's ranges in the reader: while the reader copies them,
+    the writer laps the ring and a newer scan takes the slot.
+    """
+
+    def __init__(self, writer, reader, index):
+        self.writer = writer
+        self.reader = reader
+        self.index = index
+        self.ranges = reader._ranges[index]
+        reader._ranges[index] = self
+
+    def __getitem__(self, key):
+        self.reader._ranges[self.index] = self.ranges  # Only the first copy is overtaken
+        return self
+
+    def copy(self):
+        data = self.ranges[:1].copy()
+        for _ in range(self.writer.slots):
+            self.writer.write([float(self.writer._seq + 1)], angle_min=0.0, angle_increment=0.1)
+        self.ranges = None
+        return data
+
+
+def test_a_scan_overwritten_while_copied_is_not_returned(rings):
+    writer, reader = rings
+    seq = writer.write([1.0], angle_min=0.0, angle_increment=0.1)
+    Overtaken(writer, reader, seq % writer.slots)
+    assert reader.read(seq) is None
+
+
+def test_latest_retries_a_torn_read(rings):
+    writer, reader = rings
+    seq = writer.write([1.0], angle_min=0.0, angle_increment=0.1)
+    Overtaken(writer, reader, seq % writer.slots)
+    scan = reader.latest()
+    assert scan.seq == seq + writer.slots
+    assert scan.ranges.tolist() == [float(scan.seq)]
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a_ring"
+    path.write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        lidar_ring.LidarRing.open(str(path))
+    with pytest.raises(FileNotFoundError):
+        lidar_ring.LidarRing.open(str(tmp_path / "missing"))
@@ -0,0 +1,81 @@
+import math
+
+import numpy as np
+
+from conftest import load_rov_module
+
+lidar_sectors = load_rov_module("lidar_sectors")
+
+
+def points_at(analyzer, angle_deg, distance=1.0):
+    """
+    Sector name -> number of points for a scan of a single ray at angle_deg.
+    """
+    readings = analyzer.analyze([distance], math.radians(angle_deg), math.radians(1.0))
+    return {name: reading.points for name, reading in readings.items()}
+
+
+def test_sector_edges():
+    analyzer = lidar_sectors.SectorAnalyzer()
+    # front: 90 +- 15 degrees
+    assert points_at(analyzer, 90)["front"] == 1
+    assert points_at(analyzer, 104.9)["front"] == 1
+    assert points_at(analyzer, 75.1)["front"] == 1
+    assert points_at(analyzer, 105.1)["front"] == 0
+    assert points_at(analyzer, 74.9)["front"] == 0
+    # front_left and front_right: 135 and 45 +- 30 degrees, either side of the front
+    assert points_at(analyzer, 110) == {"front": 0, "front_left": 1, "front_right": 0, "rear": 0}
+    assert points_at(analyzer, 70) == {"front": 0, "front_left": 0, "front_right": 1, "rear": 0}
+    assert points_at(analyzer, 165.1)["front_left"] == 0
+    assert points_at(analyzer, 14.9)["front_right"] == 0
+
+
+def test_sectors_wrap_around_180_degrees():
+    analyzer = lidar_sectors.SectorAnalyzer()
+    # The rear is at 270 degrees, which scans from -180 report as -90
+    assert points_at(analyzer, -90)["rear"] == 1
+    assert points_at(analyzer, -119.9)["rear"] == 1
+    assert points_at(analyzer, -120.1)["rear"] == 0
+    assert points_at(analyzer, 270)["rear"] == 1
+
+    left = lidar_sectors.SectorAnalyzer([lidar_sectors.Sector("left", 180, 60)])
+    for angle in (150.1, 179, 180, -180, -179, -150.1):
+        assert points_at(left, angle)["left"] == 1, angle
+    for angle in (149.9, -149.9, 0):
+        assert points_at(left, angle)["left"] == 0, angle
+
+
+def test_full_scans_agree_whichever_way_they_are_numbered():
+    rng = np.random.default_rng(24)
+    ranges = rng.uniform(0.2, 5.0, 720).astype(np.float32)
+    analyzer = lidar_sectors.SectorAnalyzer()
+    step = 2 * math.pi / 720
+    # A quarter ray off the whole degrees, so no ray sits exactly on a sector edge
+    from_minus_pi = analyzer.analyze(ranges, -math.pi + step / 4, step)
+    # The same scan numbered from 0: the first half of the rays moves to the end
+    from_zero = analyzer.analyze(np.roll(ranges, -360), step / 4, step)
+    for name in from_minus_pi:
+        assert from_minus_pi[name].points == from_zero[name].points
+        assert from_minus_pi[name].min == from_zero[name].min
+    assert from_minus_pi["rear"].points == 120  # 60 degrees at half a degree
+
+
+def test_invalid_returns_are_ignored():
+    analyzer = lidar_sectors.SectorAnalyzer()
+    angle_min = math.radians(88)
+    ranges = [math.inf, math.nan, 0.0, 13.0, 2.0]  # 88 to 92 degrees, all in the front
+    front = analyzer.analyze(ranges, angle_min, math.radians(1.0), range_min=0.15, range_max=12.0)["front"]
+    assert (front.min, front.near, front.points) == (2.0, 2.0, 1)
+    empty = analyzer.analyze(ranges[:4], angle_min, math.radians(1.0), range_min=0.15, range_max=12.0)["front"]
+    assert (empty.min, empty.near, empty.points) == (None, None, 0)
+
+
+def test_near_is_a_low_percentile():
+    analyzer = lidar_sectors.SectorAnalyzer(percentile=10.0)
+    ranges = np.linspace(1.0, 2.0, 11)
+    ranges[5] = 0.3  # One spurious return
+    angle_min = math.radians(85)
+    front = analyzer.analyze(ranges, angle_min, math.radians(1.0))["front"]
+    assert front.points == 11
+    assert front.min == np.float32(0.3)
+    assert front.near == np.float32(1.0)
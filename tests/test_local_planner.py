@@ -0,0 +1,41 @@
+from conftest import load_rov_module
+
+local_planner = load_rov_module("local_planner")
+lidar_sectors = load_rov_module("lidar_sectors")
+
+
+def readings(front, left=None, right=None, rear=None):
+    def reading(distance):
+        if distance is None:
+            return lidar_sectors.SectorReading(None, None, 0)
+        return lidar_sectors.SectorReading(distance, distance, 10)
+
+    return {"front": reading(front), "front_left": reading(left), "front_right": reading(right),
+            "rear": reading(rear)}
+
+
+def test_fog_stop_label_is_the_stop_move():
+    assert local_planner.fog_direction("STOP") == "E"
+    assert local_planner.fog_direction("stop") == "E"
+    assert local_planner.fog_direction(" Stop\n") == "E"
+
+
+def test_fog_directions_pass_through():
+    for direction in "WASDE":
+        assert local_planner.fog_direction(direction) == direction
+        assert local_planner.fog_direction(direction.lower()) == direction
+
+
+def test_fallback_does_not_drive_at_an_obstacle_it_has_seen():
+    planner = local_planner.LocalPlanner()
+    # Something ahead closer than one forward move, nowhere clear to turn to
+    for front in (0.4, 0.7, 0.9):
+        assert planner.decide(readings(front, 0.5, 0.5)) is None
+        assert planner.fallback(readings(front, 0.5, 0.5)) == "E"
+    # The same, with room on the left
+    assert planner.fallback(readings(0.7, 2.0, 0.5)) == "A"
+
+
+def test_fallback_drives_forward_when_ahead_is_clear():
+    planner = local_planner.LocalPlanner()
+    assert planner.fallback(readings(1.5, 0.5, 0.5)) == "W"
@@ -0,0 +1,20 @@
+import os
+import time
+
+from mission_log import DATA_FILE, MissionLog, MissionRecorder
+
+
+def test_records_reach_disk_without_further_traffic(tmp_path):
+    path = str(tmp_path / "mission")
+    recorder = MissionRecorder(path, flush_interval_s=0.2)
+    try:
+        recorder.record("team24/rov/navcam", b"hello")
+        assert os.path.getsize(os.path.join(path, DATA_FILE)) == 0  # Still buffered
+        time.sleep(0.6)
+        with MissionLog(path) as log:
+            assert len(log) == 1
+            assert log.topic(0) == "team24/rov/navcam"
+            assert log.payload(0) == b"hello"
+    finally:
+        recorder.close()
+    recorder.close()
@@ -0,0 +1,74 @@
+import time
+
+from result_cache import ResultCache
+
+
+def test_every_lookup_counts_towards_the_hit_rate():
+    cache = ResultCache()
+    assert cache.lookup("navcam", "q", 0b1010) is None
+    assert cache.lookup("navcam", "q", 0b1010) is None  # The worker looking again
+    cache.store("navcam", "q", 0b1010, ("W", 0.9), cost_s=0.3)
+    for _ in range(3):
+        assert cache.lookup("navcam", "q", 0b1010) == ("W", 0.9)
+    stats = cache.snapshot()
+    assert (stats["lookups"], stats["hits"]) == (5, 3)
+    assert stats["hit_rate"] == 3 / 5
+    assert abs(stats["saved_s"] - 0.9) < 1e-9
+
+
+def test_vehicles_do_not_share_answers():
+    cache = ResultCache()
+    cache.store("navcam", "q", 0b1010, ("W", 0.9), cost_s=0.3, vehicle_id="rov1")
+    assert cache.lookup("navcam", "q", 0b1010, vehicle_id="rov2") is None
+    assert cache.lookup("navcam", "q", 0b1010) is None
+    assert cache.lookup("navcam", "q", 0b1010, vehicle_id="rov1") == ("W", 0.9)
+
+
+def test_answers_expire_after_the_ttl():
+    cache = ResultCache(ttl_s=0.05)
+    cache.store("camera", "q", 0, ("NO", 0.8), cost_s=0.3)
+    assert cache.lookup("camera", "q", 0) == ("NO", 0.8)
+    time.sleep(0.1)
+    assert cache.lookup("camera", "q", 0) is None
+    stats = cache.snapshot()
+    assert stats["expired"] == 1
+    assert stats["entries"] == 0
+
+
+def test_frames_match_within_the_distance_threshold():
+    cache = ResultCache(max_distance=4)
+    cache.store("navcam", "q", 0, ("W", 0.9), cost_s=0.3)
+    assert cache.lookup("navcam", "q", 0b1111) == ("W", 0.9)  # 4 bits off
+    assert cache.lookup("navcam", "q", 0b11111) is None       # 5 bits off
+    assert cache.lookup("navcam", "other question", 0) is None
+    assert cache.lookup("camera", "q", 0) is None
+
+
+def test_the_nearest_stored_frame_answers():
+    cache = ResultCache(max_distance=4)
+    cache.store("navcam", "q", 0b0000, ("A", 0.6), cost_s=0.3)
+    cache.store("navcam", "q", 0b1110, ("D", 0.7), cost_s=0.3)
+    assert cache.lookup("navcam", "q", 0b1100) == ("D", 0.7)
+    assert cache.lookup("navcam", "q", 0b0001) == ("A", 0.6)
+
+
+def test_clear_forgets_every_answer():
+    cache = ResultCache()
+    cache.store("navcam", "q", 0, ("W", 0.9), cost_s=0.3)
+    cache.store("camera", "q", 0, ("NO", 0.8), cost_s=0.3)
+    cache.clear()
+    assert cache.lookup("navcam", "q", 0) is None
+    assert cache.lookup("camera", "q", 0) is None
+    stats = cache.snapshot()
+    assert (stats["clears"], stats["entries"]) == (1, 0)
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache = ResultCache(max_entries=2, max_distance=0)
+    cache.store("navcam", "q", 1, ("W", 0.9), cost_s=0.3)
+    cache.store("navcam", "q", 2, ("A", 0.9), cost_s=0.3)
+    assert cache.lookup("navcam", "q", 1) is not None  # 1 is now the most recently used
+    cache.store("navcam", "q", 3, ("D", 0.9), cost_s=0.3)
+    assert cache.lookup("navcam", "q", 2) is None
+    assert cache.lookup("navcam", "q", 1) is not None
+    assert cache.snapshot()["evictions"] == 1
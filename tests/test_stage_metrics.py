@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+
+from stage_metrics import LatencyHistogram, StageMetrics
+
+
+def test_empty_histogram():
+    assert LatencyHistogram().percentiles() == {0.5: 0.0, 0.95: 0.0, 0.99: 0.0}
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for us in range(1, 21):
+        histogram.record(us / 1e6)
+    assert histogram.percentiles((0.05, 0.5, 0.95, 1.0)) == {0.05: 1e-6, 0.5: 10e-6, 0.95: 19e-6, 1.0: 20e-6}
+
+
+def test_bucket_bounds_cover_every_value_once():
+    histogram = LatencyHistogram(precision_bits=4)
+    previous = -1
+    for index in range(200):
+        upper = histogram._upper_us(index)
+        assert upper > previous
+        assert histogram._index(previous + 1) == index
+        assert histogram._index(upper) == index
+        previous = upper
+
+
+def test_percentiles_are_within_bucket_precision():
+    rng = np.random.default_rng(24)
+    values = rng.lognormal(mean=np.log(0.02), sigma=1.5, size=20000)  # ~20 ms, up to seconds
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    quantiles = (0.5, 0.9, 0.95, 0.99, 0.999)
+    estimates = histogram.percentiles(quantiles)
+    ordered = np.sort(values)
+    for q in quantiles:
+        exact = ordered[math.ceil(round(q * len(values), 6)) - 1]  # The smallest value with a q share at or below it
+        # The upper end of the quantile's bucket: not below it, at most a bucket (1/32) above
+        assert exact - 1e-6 <= estimates[q] <= exact * (1 + 1 / 32) + 1e-6, q
+    assert histogram.count == len(values)
+    assert abs(histogram.sum_s - values.sum()) < 1e-6
+    assert histogram.max_s == values.max()
+
+
+def test_percentiles_never_exceed_the_largest_value():
+    histogram = LatencyHistogram()
+    for _ in range(10):
+        histogram.record(0.1234)
+    assert histogram.percentiles() == {0.5: 0.1234, 0.95: 0.1234, 0.99: 0.1234}
+    snapshot = histogram.snapshot()
+    assert (snapshot["count"], snapshot["max"]) == (10, 0.1234)
+    assert abs(snapshot["mean"] - 0.1234) < 1e-12
+
+
+def test_stages_get_their_own_histograms():
+    metrics = StageMetrics()
+    with metrics.timed("decode"):
+        pass
+    metrics.record("model", 0.5)
+    metrics.record("model", 0.25)
+    assert metrics.histogram("decode").count == 1
+    assert metrics.histogram("model").count == 2
+    assert metrics.histogram("model").percentiles((1.0,)) == {1.0: 0.5}
+    metrics.reset()
+    assert metrics.histogram("model").count == 0